@@ -0,0 +1,88 @@
+"""
+audio_profiles.py
+
+Compares the audio profiles of VideoConverter on the wetlab1 recordings: the bytes that would be
+uploaded to SpeechToText and the time ffmpeg takes to produce them.
+
+Created: 10/18/2026
+
+Usage:
+    python benchmarks/audio_profiles.py                       # every mp4 under data/wetlab1*
+    python benchmarks/audio_profiles.py --json results.json   # also write the raw measurements
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from autolab.vid_converter import AUDIO_PROFILES, VideoConverter  # noqa: E402
+
+# what generateAudio produced before profiles existed: the source rate and channels
+LEGACY = "source-flac"
+
+
+def child_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def convert(video: str, profile: str, output_dir: str) -> dict:
+    converter = VideoConverter(video)
+    if profile == LEGACY:
+        output = os.path.join(output_dir, "audio.flac")
+        kwargs = {"codec": "flac"}
+    else:
+        output = os.path.join(output_dir, f"audio.{AUDIO_PROFILES[profile].extension}")
+        kwargs = {"profile": profile}
+
+    cpu = child_cpu_seconds()
+    start = time.perf_counter()
+    converter.generateAudio(output, quiet=True, **kwargs)
+    wall = time.perf_counter() - start
+    cpu = child_cpu_seconds() - cpu
+
+    size = os.path.getsize(output)
+    os.remove(output)
+    return {"bytes": size, "wall_s": wall, "cpu_s": cpu}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=os.path.join(ROOT_DIR, "data", "wetlab1*"), help="glob of input directories")
+    parser.add_argument("--json", help="file the raw measurements are written to")
+    args = parser.parse_args()
+
+    videos = sorted(glob.glob(os.path.join(args.data, "*.mp4")))
+    if not videos:
+        parser.error(f"no mp4 files under {args.data}")
+
+    profiles = [LEGACY] + list(AUDIO_PROFILES)
+    results = {profile: [] for profile in profiles}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for video in videos:
+            for profile in profiles:
+                results[profile].append({"video": os.path.relpath(video, ROOT_DIR), **convert(video, profile, output_dir)})
+
+    legacy_bytes = sum(run["bytes"] for run in results[LEGACY])
+    print(f"{len(videos)} videos")
+    print(f"{'profile':<20}{'bytes':>14}{'vs source':>11}{'wall s':>10}{'cpu s':>10}")
+    for profile in profiles:
+        total = sum(run["bytes"] for run in results[profile])
+        wall = sum(run["wall_s"] for run in results[profile])
+        cpu = sum(run["cpu_s"] for run in results[profile])
+        print(f"{profile:<20}{total:>14,}{total / legacy_bytes:>10.1%}{wall:>10.2f}{cpu:>10.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
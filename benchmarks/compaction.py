@@ -0,0 +1,85 @@
+"""
+compaction.py
+
+Measures the transcript compaction stage on saved transcripts ({temp_dir}/{uid}.txt files written by
+Autolab): the lines and prompt tokens before and after compaction and, with --generate, the time
+generateInstructions takes on the original and the compacted transcript.
+
+Created: 10/18/2026
+
+Usage:
+    python benchmarks/compaction.py transcripts/*.txt
+    python benchmarks/compaction.py transcripts/*.txt --generate --model gpt-4   # needs OPENAI_API_KEY
+    python benchmarks/compaction.py transcripts/*.txt --json results.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from autolab.compaction import compact_transcript, count_tokens  # noqa: E402
+from autolab.gpt_transcript import TranscriptConversion, get_encoding  # noqa: E402
+from autolab.transcript_store import parse_segment  # noqa: E402
+
+
+def generate(lines, model: str) -> float:
+    """Returns the seconds generateInstructions takes on the lines of a transcript"""
+    conversion = TranscriptConversion(model=model, secret_key=os.getenv("OPENAI_API_KEY"))
+    start = time.perf_counter()
+    conversion.generateInstructions(transcript=lines)
+    return time.perf_counter() - start
+
+
+def measure(path: str, encoding, model: str, run_generation: bool) -> dict:
+    with open(path) as f:
+        lines = [line for line in f if line.strip()]
+    compacted = compact_transcript((parse_segment(line) for line in lines), encoding)
+    result = {
+        "transcript": path,
+        "lines_before": len(lines),
+        "lines_after": len(compacted),
+        "tokens_before": count_tokens(lines, encoding),
+        "tokens_after": compacted.tokens_after,
+    }
+    if run_generation:
+        result["generate_s_before"] = generate(lines, model)
+        result["generate_s_after"] = generate(list(compacted.lines()), model)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("transcripts", nargs="+", help="transcript .txt files")
+    parser.add_argument("--model", default="gpt-4", help="model the tokens are counted (and generated) with")
+    parser.add_argument("--generate", action="store_true", help="also time generateInstructions on both versions")
+    parser.add_argument("--json", help="file the raw measurements are written to")
+    args = parser.parse_args()
+
+    encoding = get_encoding(args.model)
+    results = [measure(path, encoding, args.model, args.generate) for path in args.transcripts]
+
+    print(f"{'transcript':<40}{'lines':>14}{'tokens':>16}{'saved':>8}")
+    for result in results:
+        lines = f"{result['lines_before']}->{result['lines_after']}"
+        tokens = f"{result['tokens_before']}->{result['tokens_after']}"
+        saved = 1 - result["tokens_after"] / max(result["tokens_before"], 1)
+        print(f"{os.path.basename(result['transcript']):<40}{lines:>14}{tokens:>16}{saved:>8.1%}")
+    before = sum(result["tokens_before"] for result in results)
+    after = sum(result["tokens_after"] for result in results)
+    print(f"total prompt tokens {before} -> {after} ({1 - after / max(before, 1):.1%} saved)")
+    if args.generate:
+        before = sum(result["generate_s_before"] for result in results)
+        after = sum(result["generate_s_after"] for result in results)
+        print(f"total generateInstructions time {before:.1f}s -> {after:.1f}s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
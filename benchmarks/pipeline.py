@@ -0,0 +1,261 @@
+"""
+pipeline.py
+
+End-to-end benchmark of Autolab.generate_procedure_batch on the wetlab1 recordings. The 60 second clips of
+data/wetlab1_60seconds are concatenated into inputs of increasing length, and each input runs through the real
+pipeline (conversion, transcription, transcript offsets, instruction generation) in a fresh interpreter. Google
+Speech and OpenAI are replayed from a cassette (see replay.py): either a fixture recorded against the real services
+with --fixture, or a synthetic one with one recognized utterance every 5 seconds of each 60 second segment and a
+fixed procedure.
+
+The run reports the per-stage durations of its trace (see tracing.Trace.timings), its wall time, CPU time
+(including ffmpeg), peak RSS and the bytes it wrote. Durations depend on the machine, so they are compared with the
+baseline as multiples of a calibration measured on the same machine in the same run (ffmpeg decoding the first clip).
+Peak RSS, bytes written and span counts are compared as they are. The benchmark exits with status 1 if a metric
+regressed by more than the tolerance, or if there is no baseline to compare with.
+
+Created: 10/18/2026
+
+Usage:
+    python benchmarks/pipeline.py                          # 1, 4 and 9 segments, compared with the baseline
+    python benchmarks/pipeline.py --segments 1 2 --repeat 1
+    python benchmarks/pipeline.py --fixture fixtures/wetlab1.json --delay-scale 1
+    python benchmarks/pipeline.py --update-baseline        # store the results as the new baseline
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from autolab import replay  # noqa: E402
+from autolab.autolab import Autolab  # noqa: E402
+from autolab.vid_converter import SEGMENT_SECONDS  # noqa: E402
+
+CLIPS_DIR = os.path.join(ROOT_DIR, "data", "wetlab1_60seconds")
+BASELINE = os.path.join(ROOT_DIR, "benchmarks", "pipeline_baseline.json")
+
+# metrics of the whole run compared with the baseline, durations are divided by the calibration first
+RUN_METRICS = ("wall", "cpu", "peak_rss_mb", "bytes_written")
+DURATIONS = ("wall", "cpu")
+
+# differences below these are noise, whatever the tolerance. Durations are in calibrations
+NOISE_FLOOR = {"duration": 0.5, "peak_rss_mb": 5.0, "bytes_written": 4096, "count": 0}
+
+WORDS = "add the buffer to the tube then vortex and spin it down for one minute at four degrees".split()
+PROCEDURE = {
+    "Summary": "Prepare the samples",
+    "Procedure": [
+        {"step": "Add the buffer to the tube", "start_time": 0, "end_time": 10},
+        {"step": "Vortex and spin the tube down", "start_time": 10, "end_time": 40},
+        {"step": "Incubate for one minute at four degrees", "start_time": 40, "end_time": 60},
+    ],
+}
+
+
+def synthetic_fixture(path: str, segments: int):
+    """Writes a cassette replaying a Speech response for each of the segments (and a last partial one) and a
+    GPT completion. The requests are not recorded, so they are replayed by order (see replay.Cassette)"""
+    from google.cloud import speech_v2
+    from google.protobuf import duration_pb2
+
+    interactions = []
+    for _ in range(segments + 1):
+        results = []
+        for i in range(SEGMENT_SECONDS // 5):
+            text = " ".join(WORDS[(i + j) % len(WORDS)] for j in range(8))
+            results.append(
+                speech_v2.SpeechRecognitionResult(
+                    alternatives=[speech_v2.SpeechRecognitionAlternative(transcript=text)],
+                    result_end_offset=duration_pb2.Duration(seconds=(i + 1) * 5),
+                )
+            )
+        response = speech_v2.RecognizeResponse.to_json(speech_v2.RecognizeResponse(results=results))
+        interactions.append({"service": "speech", "method": "recognize", "key": "", "response": response})
+    message = {"role": "assistant", "content": json.dumps(PROCEDURE)}
+    completion = {"choices": [{"message": message, "finish_reason": "stop"}]}
+    interactions.append({"service": "openai", "method": "chat_completion", "key": "", "response": completion})
+    with open(path, "w") as fd:
+        json.dump({"version": replay.CASSETTE_VERSION, "interactions": interactions}, fd, indent=1)
+
+
+def concat_clips(count: int, output: str):
+    """Concatenates the first count clips of data/wetlab1_60seconds into output, without re-encoding"""
+    clips = [os.path.join(CLIPS_DIR, f"output{i}.mp4") for i in range(count)]
+    missing = [clip for clip in clips if not os.path.isfile(clip)]
+    if missing:
+        raise Exception("Error: Cannot find the clips {}".format(missing))
+    list_file = output + ".txt"
+    with open(list_file, "w") as fd:
+        fd.writelines(f"file '{clip}'\n" for clip in clips)
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_file, "-c", "copy", output],
+        check=True,
+    )
+    os.remove(list_file)
+
+
+def calibrate(repeat: int = 3) -> float:
+    """Returns the median time ffmpeg takes to decode the first clip, the unit durations are compared in"""
+    clip = os.path.join(CLIPS_DIR, "output0.mp4")
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(["ffmpeg", "-loglevel", "error", "-i", clip, "-f", "null", "-"], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def run_pipeline(video: str, fixture: str, delay_scale: float, work_dir: str) -> dict:
+    """Runs generate_procedure_batch on video with the remote calls replayed from fixture, and returns its
+    measurements. Runs in a fresh interpreter (see --child) so peak RSS and imports are not shared between inputs"""
+    # replayed requests that do not match a recording are logged, which is expected for the synthetic fixture
+    logging.basicConfig(level=logging.ERROR)
+    replay.use_cassette(fixture, delay_scale=delay_scale)
+    autolab = Autolab("benchmark", "benchmark", "gpt-3.5-turbo")
+
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    result = autolab.generate_procedure_batch("benchmark", work_dir, video_path=video, timings=True)
+    wall = time.perf_counter() - start
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if "statusCode" in result:
+        raise Exception("Error: Instruction generation failed: {}".format(result["body"]))
+    stages = result["timings"]["stages"]
+    return {
+        "wall": wall,
+        "cpu": time.process_time() - start_cpu + children.ru_utime + children.ru_stime,
+        "peak_rss_mb": max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, children.ru_maxrss) / 1024,
+        "bytes_written": dir_size(work_dir),
+        "stages": {name: {"count": stage["count"], "duration": stage["duration_s"]} for name, stage in stages.items()},
+    }
+
+
+def run_child(video: str, fixture: str, delay_scale: float) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), "--child", video, "--fixture", fixture]
+    output = subprocess.run(
+        command + ["--delay-scale", str(delay_scale)], check=True, stdout=subprocess.PIPE, text=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def summarize(runs: list, calibration: float) -> dict:
+    """Median of each metric over the runs of an input, durations as multiples of the calibration"""
+    summary = {}
+    for metric in RUN_METRICS:
+        value = statistics.median(run[metric] for run in runs)
+        summary[metric] = value / calibration if metric in DURATIONS else value
+    summary["stages"] = {}
+    for name in runs[0]["stages"]:
+        stage = [run["stages"].get(name, {"count": 0, "duration": 0.0}) for run in runs]
+        summary["stages"][name] = {
+            "count": statistics.median(s["count"] for s in stage),
+            "duration": statistics.median(s["duration"] for s in stage) / calibration,
+        }
+    return summary
+
+
+def exceeds(value: float, expected: float, tolerance: float, floor: float) -> bool:
+    return value > max(expected * (1 + tolerance), expected + floor)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns a description of each metric that is worse than its baseline by more than tolerance"""
+    regressions = []
+    for segments, run in results["runs"].items():
+        expected = baseline["runs"].get(segments)
+        if expected is None:
+            continue
+        for metric in RUN_METRICS:
+            floor = NOISE_FLOOR["duration" if metric in DURATIONS else metric]
+            if exceeds(run[metric], expected[metric], tolerance, floor):
+                regressions.append(f"{segments} segment(s) {metric}: {run[metric]:.3f} > {expected[metric]:.3f}")
+        for name, stage in run["stages"].items():
+            for metric, value in stage.items():
+                reference = expected["stages"].get(name, {}).get(metric)
+                if reference is not None and exceeds(value, reference, tolerance, NOISE_FLOOR[metric]):
+                    regressions.append(f"{segments} segment(s) {name}.{metric}: {value:.3f} > {reference:.3f}")
+    return [f"{regression} (+{tolerance:.0%})" for regression in regressions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, nargs="+", default=[1, 4, 9], help="number of clips per input")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per input, the median of each metric is kept")
+    parser.add_argument("--fixture", help="recorded cassette to replay, instead of a synthetic one")
+    parser.add_argument("--delay-scale", type=float, default=0.0, help="replay the recorded latencies times this")
+    parser.add_argument("--json", default="pipeline_results.json", help="file the results are written to")
+    parser.add_argument("--baseline", default=BASELINE, help="results the run is compared with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression of a metric")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results to --baseline")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        work_dir = tempfile.mkdtemp()
+        try:
+            print(json.dumps(run_pipeline(args.child, args.fixture, args.delay_scale, work_dir)))
+        finally:
+            shutil.rmtree(work_dir)
+        return
+
+    calibration = calibrate()
+    results = {"segments": args.segments, "repeat": args.repeat, "calibration_s": calibration, "runs": {}}
+    with tempfile.TemporaryDirectory() as input_dir:
+        for count in args.segments:
+            video = os.path.join(input_dir, f"wetlab1_{count}.mp4")
+            concat_clips(count, video)
+            fixture = args.fixture
+            if fixture is None:
+                fixture = os.path.join(input_dir, f"wetlab1_{count}.json")
+                synthetic_fixture(fixture, count)
+            runs = [run_child(video, fixture, args.delay_scale) for _ in range(args.repeat)]
+            results["runs"][str(count)] = summarize(runs, calibration)
+
+    print(f"Durations in calibrations of {calibration:.3f}s (ffmpeg decoding one clip)")
+    print(f"{'segments':>8} {'stage':<20}{'count':>7}{'duration':>10}")
+    for count, run in results["runs"].items():
+        for name, stage in run["stages"].items():
+            print(f"{count:>8} {name:<20}{stage['count']:>7g}{stage['duration']:>10.2f}")
+        print(
+            f"{count:>8} {'total':<20}{'':>7}{run['wall']:>10.2f}  cpu {run['cpu']:.2f}, "
+            f"peak {run['peak_rss_mb']:.1f} MB, {int(run['bytes_written']):,} bytes"
+        )
+
+    with open(args.json, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.isfile(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create it")
+        sys.exit(1)
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print("REGRESSIONS:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"No regression against {os.path.relpath(args.baseline)}")
+
+
+if __name__ == "__main__":
+    main()
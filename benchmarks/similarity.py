@@ -0,0 +1,99 @@
+"""
+similarity.py
+
+Measures the near-duplicate procedure index on synthetic transcripts: students of a section record the
+same protocol with their own wording, timing and transcription errors. Reports the time to build the index,
+the latency of a lookup (with the signature already computed, and including the signature of the
+transcript) and how often the transcript of the same protocol is found.
+
+Created: 10/18/2026
+
+Usage:
+    python benchmarks/similarity.py --transcripts 20000
+    python benchmarks/similarity.py --transcripts 50000 --index /tmp/procedures.sqlite3 --json results.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+from autolab.similarity import ProcedureIndex  # noqa: E402
+
+WORDS = (
+    "add pipette buffer sample tube vortex centrifuge minutes seconds microliters plate well incubate ice "
+    "water bath gel load ladder run volts stain rinse measure absorbance spectrophotometer cuvette blank "
+    "dilute stock solution flask beaker stir heat cool filter weigh balance grams record temperature"
+).split()
+
+
+def protocol(generator: random.Random, lines: int = 60) -> list:
+    """Returns the utterances of a lab protocol"""
+    return [" ".join(generator.choices(WORDS, k=generator.randint(6, 14))) for _ in range(lines)]
+
+
+def recording(generator: random.Random, utterances: list, noise: float = 0.05) -> str:
+    """Returns the transcript of a recording of a protocol, with other times and some misrecognized words"""
+    time_s, lines = 0.0, []
+    for utterance in utterances:
+        words = [generator.choice(WORDS) if generator.random() < noise else word for word in utterance.split()]
+        duration = generator.uniform(2, 9)
+        lines.append(f"{' '.join(words)} [{time_s:.1f}-{time_s + duration:.1f}]\n")
+        time_s += duration + generator.uniform(0, 20)
+    return "".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcripts", type=int, default=20000, help="transcripts stored in the index")
+    parser.add_argument("--protocols", type=int, default=500, help="distinct protocols they are recordings of")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--index", default=":memory:", help="SQLite file of the index")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    generator = random.Random(0)
+    protocols = [protocol(generator) for _ in range(args.protocols)]
+    index = ProcedureIndex(args.index)
+
+    start = time.perf_counter()
+    for i in range(args.transcripts):
+        number = i % args.protocols
+        transcript = recording(generator, protocols[number])
+        index.add(transcript, {"Summary": f"protocol {number}", "Procedure": []})
+    build_s = time.perf_counter() - start
+
+    lookups, totals, found = [], [], 0
+    for _ in range(args.queries):
+        number = generator.randrange(args.protocols)
+        transcript = recording(generator, protocols[number])
+        start = time.perf_counter()
+        signature = index.signature(transcript)
+        lookup_start = time.perf_counter()
+        match = index.query(signature=signature)
+        end = time.perf_counter()
+        lookups.append(end - lookup_start)
+        totals.append(end - start)
+        found += match is not None and match.procedure["Summary"] == f"protocol {number}"
+
+    results = {
+        "transcripts": len(index),
+        "build_s": round(build_s, 3),
+        "lookup_ms_p50": round(statistics.median(lookups) * 1000, 4),
+        "lookup_ms_max": round(max(lookups) * 1000, 4),
+        "lookup_with_signature_ms_p50": round(statistics.median(totals) * 1000, 4),
+        "recall": found / args.queries,
+    }
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+startup.py
+
+Benchmarks the cold start of the Lambda entry point: the time to import lambda_function and the
+latency of the first request in a fresh interpreter, where the heavy modules and clients are loaded.
+
+Created: 10/18/2026
+
+Usage:
+    python benchmarks/startup.py                # import time and first-use cost of each client
+    python benchmarks/startup.py --uid <uid>    # also times a full first lambda_handler call (needs .env)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# runs in a fresh interpreter so every measurement is a cold start
+CHILD = """
+import json, sys, time
+timings = {}
+
+start = time.perf_counter()
+import lambda_function
+timings["import"] = time.perf_counter() - start
+
+def timed(name, fn):
+    start = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        timings[name + "_error"] = str(e)
+    timings[name] = time.perf_counter() - start
+
+uid = sys.argv[1] if len(sys.argv) > 1 else None
+if uid:
+    timed("first_request", lambda: lambda_function.lambda_handler({"queryStringParameters": {"uid": uid}}, None))
+    timed("second_request", lambda: lambda_function.lambda_handler({"queryStringParameters": {"uid": uid}}, None))
+else:
+    from autolab.gpt_transcript import get_encoding
+    from autolab.googlestt import get_speech_client
+    timed("autolab", lambda_function.get_autolab)
+    timed("tiktoken_encoding", lambda: get_encoding(lambda_function.gpt_model))
+    timed("speech_client", get_speech_client)
+    timed("supabase_client", lambda_function.get_supabase)
+
+print(json.dumps(timings))
+"""
+
+
+def run_once(uid=None) -> dict:
+    args = [sys.executable, "-c", CHILD] + ([uid] if uid else [])
+    output = subprocess.run(args, cwd=SRC_DIR, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts measured")
+    parser.add_argument("--uid", help="video uid used to time a full first request")
+    args = parser.parse_args()
+
+    runs = [run_once(args.uid) for _ in range(args.runs)]
+
+    report = {}
+    for name in runs[0]:
+        values = [run[name] for run in runs if isinstance(run.get(name), float)]
+        if values:
+            report[name] = {"median_s": round(statistics.median(values), 4), "max_s": round(max(values), 4)}
+        else:
+            report[name] = runs[0][name]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,14 @@ for dir in "${exclude_dirs[@]}"; do
   exclude="$exclude -x \*${dir}\*"
 done
 
+# Bundle the tiktoken BPE files so Lambda never downloads them on a cold start
+# (lambda_function.py points TIKTOKEN_CACHE_DIR at this directory)
+TIKTOKEN_CACHE_DIR=./src/tiktoken_cache python -c "import tiktoken; tiktoken.get_encoding('cl100k_base')"
+if [ $? -ne 0 ]; then
+    echo "An error occurred while bundling the tiktoken encodings"
+    exit 1
+fi
+
 # Change to src/ directory and zip its contents (this places the contents at the base of the zip)
 cd src/
 eval "zip -r ../$output_path ./* $exclude"
@@ -6,48 +6,867 @@ This module provides a callable function for the entire Autolab pipeline process
 Created: 07/11/2023
 
 """
-from .googlestt import SpeechToText
-from .gpt_transcript import TranscriptConversion
-from .vid_converter import VideoConverter
+from . import ratelimit, tracing
+from .cache import ResultCache
+from .compaction import CompactionSettings, compact_transcript
+from .googlestt import SpeechToText, delete_from_gcs, upload_to_gcs
+from .manifest import CONVERTED, DONE, FAILED, PENDING, RunManifest
+from .similarity import ProcedureIndex
+from .stt_engine import SpeechEngine, create_engine, engine_class
+from .transcript_store import TranscriptStore
+from .gpt_transcript import GPT_PROMPT, TranscriptConversion, format_result
+from .vid_converter import (
+    SEGMENT_SECONDS,
+    AudioSegment,
+    VideoConverter,
+    encode_wav,
+    get_profile,
+    is_url,
+    probe_duration,
+    smallest_profile,
+)
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable, Iterator, List, Tuple
+import itertools
 import os
 import logging
+import queue
+import threading
 from dotenv import load_dotenv
 
+logger = logging.getLogger("autolab")
+
+# enable_logging of the run in progress. Context variables follow the run into its worker threads (see
+# tracing.propagate), so concurrent runs with different settings do not change each other's logging
+_run_logging = ContextVar("autolab_run_logging", default=None)
+
+
+class _RunLoggingFilter(logging.Filter):
+    """Drops the info and debug records of runs started with enable_logging=False. The level of the logger and the
+    handlers and format of the application are left alone"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or _run_logging.get() is not False
+
+
+logger.addFilter(_RunLoggingFilter())
+
+
+@contextmanager
+def _logging_enabled(enable_logging: bool):
+    """Sets enable_logging for the run in the current context"""
+    token = _run_logging.set(bool(enable_logging))
+    try:
+        yield
+    finally:
+        _run_logging.reset(token)
+
 
 class Autolab:
-    def __init__(self, project_id, recognizer_id, gpt_model, acodec: str = "flac"):
-        """Constructor - sets logging format and the output_clean variable
+    def __init__(
+        self,
+        project_id,
+        recognizer_id,
+        gpt_model,
+        acodec: str = "flac",
+        cache: ResultCache = None,
+        map_reduce: bool = False,
+        structured_output: bool = False,
+        audio_profile: str = None,
+        gcs_bucket: str = None,
+        long_audio_seconds: float = 900,
+        dynamic_batching: bool = False,
+        engine="google",
+        trace_exporter=None,
+        ffmpeg_workers: int = 1,
+        compact_transcript: bool = False,
+        procedure_index: str = None,
+        reuse_threshold: float = 0.9,
+    ):
+        """Constructor - sets the output_clean variable
                           This is used to keep track of the residual files
                           generated in the process to create our lab
                           instructions
 
         Args:
-            None
+            project_id    (str): Google Project ID
+            recognizer_id (str): Speech Recognizer to be used
+            gpt_model     (str): OpenAI model used for instruction generation
+            acodec        (str): audio codec the video is converted to when audio_profile is None
+            cache         (ResultCache, optional): cache of transcripts and instructions. Stages with a
+                                                   cache hit are skipped. Default is no caching.
+            map_reduce    (bool, optional): generate instructions for long transcripts in token-budgeted
+                                            windows in parallel (see TranscriptConversion.generateInstructions)
+            structured_output (bool, optional): generate schema-constrained procedures and repair invalid JSON
+                                                instead of regenerating it (see TranscriptConversion)
+            audio_profile (str, optional): name of the vid_converter.AUDIO_PROFILES entry the audio sent to
+                                           SpeechToText is encoded with. None (default) keeps the source audio
+                                           encoded with acodec, "auto" opts in to the smallest profile the
+                                           recognizer accepts (the lossy 24 kbps stt-opus-low for Google)
+            gcs_bucket    (str, optional): Cloud Storage bucket the audio of long recordings is uploaded to. When set,
+                                           generate_procedure_batch transcribes recordings longer than
+                                           long_audio_seconds with one BatchRecognize operation instead of 60 second
+                                           synchronous requests
+            long_audio_seconds (float, optional): duration above which the BatchRecognize backend is used
+            dynamic_batching (bool, optional): submit BatchRecognize operations with dynamic batching, which costs
+                                               less but can take hours to complete
+            engine        (str or SpeechEngine, optional): speech-to-text engine, "google" (default), "vosk" for
+                                                           local CPU transcription, or a SpeechEngine instance
+            trace_exporter (str or Callable, optional): where the per-stage spans of each run are sent, "emf"
+                                                        (CloudWatch Embedded Metric Format), "otel" (OpenTelemetry)
+                                                        or a function (see tracing.py). Defaults to $AUTOLAB_TRACE
+            ffmpeg_workers (int, optional): number of audio segments converted at once. 1 decodes the video with a
+                                            single ffmpeg process, None uses one process per available core
+                                            (see VideoConverter.split_and_convert_parallel)
+            compact_transcript (bool, optional): merge short segments, quantize timestamps and strip fillers and
+                                                 repeats before the transcript is sent to GPT (see compaction.py)
+            procedure_index (str, optional): SQLite file of the near-duplicate index of transcripts and their
+                                             procedures (see similarity.py). Procedures of other recordings of the
+                                             same lab are reused or edited instead of generated from scratch
+            reuse_threshold (float, optional): similarity above which a stored procedure is returned (retimed to the
+                                               new transcript) without calling GPT
         """
         load_dotenv()
         self.project_id = project_id
         self.recognizer_id = recognizer_id
         self.gpt_model = gpt_model
         self.acodec = acodec
-        self._default_logging()
+        self.engine = engine
+        self._stt_engine = None
+        if audio_profile == "auto":
+            audio_profile = smallest_profile(engine_class(engine).SUPPORTED_ENCODINGS).name
+        self.audio_profile = audio_profile
+        # extension of the audio files written by the converter
+        self.audio_extension = get_profile(audio_profile).extension if audio_profile else acodec
+        self.cache = cache
+        self.map_reduce = map_reduce
+        self.structured_output = structured_output
+        self.gcs_bucket = gcs_bucket
+        self.long_audio_seconds = long_audio_seconds
+        self.dynamic_batching = dynamic_batching
+        self.trace_exporter = trace_exporter
+        self.ffmpeg_workers = ffmpeg_workers
+        self.compaction = CompactionSettings() if compact_transcript else None
+        # loaded once, lookups are in memory
+        self.procedure_index = ProcedureIndex(procedure_index) if procedure_index else None
+        self.reuse_threshold = reuse_threshold
         self.output_clean = None
 
-    def _default_logging(self):
+    @property
+    def stt_engine(self) -> SpeechEngine:
+        """The speech-to-text engine segments are transcribed with, created on first use"""
+        if self._stt_engine is None:
+            self._stt_engine = create_engine(self.engine, self.project_id, self.recognizer_id)
+        return self._stt_engine
+
+    @staticmethod
+    def _content_hash(video_path: str) -> str:
+        """Hashes the input video by content (remote inputs are hashed by the version of the object, see hash_url)"""
+        if is_url(video_path):
+            return ResultCache.hash_url(video_path)
+        return ResultCache.hash_file(video_path)
+
+    def _stt_settings(self, **settings) -> dict:
+        """Returns every setting that changes the transcript, including the extra settings of the calling pipeline"""
+        return {
+            "engine": self.stt_engine.engine_id,
+            "project_id": self.project_id,
+            "recognizer_id": self.recognizer_id,
+            "acodec": self.acodec,
+            "audio_profile": self.audio_profile,
+            # recordings above the threshold are transcribed by a different backend
+            "long_audio_seconds": self.long_audio_seconds if self.gcs_bucket else None,
+            **settings,
+        }
+
+    def _cache_keys(self, video_path: str, content_hash: str = None, **settings) -> dict:
         """
-            Sets logging to our default logging format
+            Builds the cache keys of the transcript and instructions generated from video_path
 
         Args:
-            None
+            video_path   (str): input video, hashed by content (remote inputs are hashed by version)
+            content_hash (str, optional): hash of the input, used instead of hashing video_path (e.g. the parts
+                                          of a multi-part recording)
+            settings     (dict): extra settings of the calling pipeline that change the transcript
+
+        Return:
+            keys (dict): {"transcript": key, "instructions": key}, or None if caching is disabled
+
+        """
+        if self.cache is None:
+            return None
+
+        content_hash = content_hash or self._content_hash(video_path)
+        stt_settings = self._stt_settings(**settings)
+        return {
+            "transcript": ResultCache.make_key("transcript", content_hash, **stt_settings),
+            "instructions": ResultCache.make_key(
+                "instructions",
+                content_hash,
+                model=self.gpt_model,
+                prompt=GPT_PROMPT,
+                map_reduce=self.map_reduce,
+                structured_output=self.structured_output,
+                compaction=self.compaction._asdict() if self.compaction else None,
+                reuse_threshold=self.reuse_threshold if self.procedure_index else None,
+                **stt_settings,
+            ),
+        }
+
+    def _run_manifest(
+        self, uid: str, temp_dir: str, video_path: str, listener=None, content_hash: str = None, **settings
+    ) -> RunManifest:
+        """
+            Opens the manifest of a run, resuming the previous run of uid if it had the same input and settings
+
+        Args:
+            uid          (str): unique identifier of the video
+            temp_dir     (str): directory the manifest is kept in
+            video_path   (str): input video
+            listener     (Callable, optional): called with each update of the manifest (see RunManifest)
+            content_hash (str, optional): hash of the input, used instead of hashing video_path
+            settings     (dict): extra settings of the calling pipeline that change the transcript
+
+        Return:
+            manifest (RunManifest): manifest at {temp_dir}/{uid}.manifest.jsonl
+
+        """
+        fingerprint = ResultCache.make_key(
+            "run",
+            content_hash or self._content_hash(video_path),
+            model=self.gpt_model,
+            prompt=GPT_PROMPT,
+            map_reduce=self.map_reduce,
+            structured_output=self.structured_output,
+            **self._stt_settings(**settings),
+        )
+        return RunManifest(f"{temp_dir}/{uid}.manifest.jsonl", fingerprint, listener=listener)
+
+    def _transcribe_segments(
+        self,
+        stt: SpeechEngine,
+        segments: Iterable[AudioSegment],
+        max_workers: int = 8,
+        tolerate_errors: bool = False,
+    ) -> Iterator[Tuple[AudioSegment, object]]:
+        """
+            Transcribes audio segments concurrently with a bounded pool of workers
+
+            At most max_workers segments are read or held in memory at once, so a
+            streaming iterable of segments is consumed only as fast as it is transcribed,
+            and responses are yielded as soon as every earlier segment is done.
+
+        Args:
+            stt           (SpeechEngine): engine used to transcribe each segment
+            segments      (Iterable[AudioSegment]): audio segments, ordered by segment index
+            max_workers   (int): maximum number of segments transcribed at once
+            tolerate_errors (bool): return the exception of a failed segment in place of its transcript
+                                    instead of raising it
+
+        Yields:
+            responses (tuple): (segment, List[Tuple[str, float, float]]) pairs in the same order as
+                               segments regardless of completion order, with times relative to the segment
+
+        """
+
+        def transcribe(segment):
+            logger.info(f"Transcribing segment {segment.index}")
+            try:
+                with tracing.span("stt_chunk", index=segment.index, engine=stt.name) as span:
+                    content = segment.read()
+                    span.set(bytes=len(content), audio_seconds=segment.duration)
+                    return segment, stt.transcribe(content, duration=segment.duration)
+            except Exception as e:
+                if not tolerate_errors:
+                    raise
+                return segment, e
+
+        max_workers = max(1, max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for segment in segments:
+                pending.append(executor.submit(tracing.propagate(transcribe), segment))
+                if len(pending) >= max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _vad_segments(
+        self, vid_converter: VideoConverter, temp_dir: str, sample_rate: int = 16000
+    ) -> Iterator[AudioSegment]:
+        """
+            Finds the speech regions of the audio and packs them into segments that fit the
+            synchronous recognizer. Silence is never sent to SpeechToText.
+
+            The audio is decoded through a pipe: frame energies are computed chunk by chunk while the PCM is
+            spooled to an unlinked temporary file in temp_dir, from which the segments are cut as they are
+            transcribed. Memory does not grow with the length of the recording.
+
+        Args:
+            vid_converter (VideoConverter): converter of the input video
+            temp_dir      (str): directory of the spooled PCM, about 115 MB per hour of audio at 16 kHz
+            sample_rate   (int): sample rate the audio is decoded at
+
+        Yields:
+            segments (AudioSegment): in-memory WAV segments, each with the region_map used to map its transcript
+                                     times back to the original recording. Nothing if the audio has no speech
+
+        """
+        import tempfile
+
+        import numpy as np
+        from .vad import FrameEnergy, extract_chunk, pack_regions, speech_regions
+
+        os.makedirs(temp_dir, exist_ok=True)
+        with tempfile.TemporaryFile(dir=temp_dir) as spool:
+            meter = FrameEnergy(sample_rate)
+            with tracing.span("convert") as span:
+                for pcm in vid_converter.stream_pcm(sample_rate=sample_rate):
+                    meter.update(pcm)
+                    spool.write(pcm)
+                span.set(bytes=meter.bytes, audio_seconds=meter.duration)
+            with tracing.span("vad"):
+                regions = speech_regions(meter.energy, meter.duration, meter.frame_length / sample_rate)
+            speech_seconds = sum(end - start for start, end in regions)
+            logger.info(
+                f"Detected {speech_seconds:.1f}s of speech in {meter.duration:.1f}s of audio ({len(regions)} regions)"
+            )
+            if not regions:
+                return
+
+            spool.flush()
+            samples = np.memmap(spool, dtype=np.int16, mode="r", shape=(meter.bytes // 2,))
+            for index, region_map in enumerate(pack_regions(regions, max_chunk_seconds=SEGMENT_SECONDS - 5)):
+                chunk = extract_chunk(samples, sample_rate, region_map)
+                yield AudioSegment(
+                    index=index,
+                    start=region_map[0][1],
+                    duration=len(chunk) / sample_rate,
+                    content=encode_wav(chunk.tobytes(), sample_rate),
+                    region_map=tuple(region_map),
+                )
+
+    def _transcribe_single(
+        self, uid: str, temp_dir: str, video_path: str, tolerate_errors: bool = False
+    ) -> List[Tuple[str, float, float]]:
+        """
+            Converts the whole video to a single audio file and transcribes it in one request
+            (steps 1 and 2 of generate_procedure and generate_procedure_v2)
+
+        Args:
+            uid             (str): unique identifier of the video
+            temp_dir        (str): directory the audio file is written to
+            video_path      (str): input video
+            tolerate_errors (bool): log conversion errors instead of raising them. Transcription errors are
+                                    logged and always raised, a failed request is not an empty recording
+
+        Return:
+            transcript_time (List[Tuple[str, float, float]]): transcript segments with their start and end times
+
+        """
+        # 1) Read and Convert mp4 File to .flac
+        ###############################################
+        logger.info(f"Generating .{self.audio_extension} file")
+        vid_converter = VideoConverter(video_path)
+        audio_path = f"{temp_dir}/{uid}.{self.audio_extension}"
+        try:
+            with tracing.span("convert") as span:
+                plan = vid_converter.generateAudio(
+                    audio_path, codec=self.acodec, quiet=True, profile=self.audio_profile
+                )
+                span.set(bytes=os.path.getsize(audio_path), **plan.metrics())
+        except Exception as e:
+            if not tolerate_errors:
+                raise
+            logger.critical(f"vid_converter failed to generate. {e}")
+
+        logger.info("OK")
+        ###############################################
+
+        # 2) SpeechToText Transcription
+        ###############################################
+        logger.info(f"Generating SpeechToText transcription ({self.stt_engine.name})")
+        stt = self.stt_engine
+
+        # read in audio file previously generated
+        with open(audio_path, "rb") as fd:
+            contents = fd.read()
+        duration = None
+        # the duration is only needed to charge the request to a speech audio quota
+        if ratelimit.get_scheduler("speech").limits("audio_seconds"):
+            try:
+                duration = probe_duration(audio_path)
+            except Exception as e:
+                # the request is charged as the longest synchronous request instead
+                logger.warning(f"Could not probe the duration of {audio_path}. {e}")
+
+        try:
+            with tracing.span("stt_chunk", index=0, engine=stt.name, bytes=len(contents), audio_seconds=duration):
+                return stt.transcribe(contents, duration=duration)
+        except Exception as e:
+            if tolerate_errors:
+                logger.critical(f"speech_to_text failed to execute. {e}")
+            raise
+
+    def _transcribe_batch(
+        self,
+        uid: str,
+        temp_dir: str,
+        video_path: str,
+        cwd: str,
+        stt_max_workers: int = 8,
+        streaming: bool = False,
+        vad: bool = False,
+        manifest: RunManifest = None,
+        store: TranscriptStore = None,
+        segments: List[AudioSegment] = None,
+    ):
+        """
+            Splits the video into segments and transcribes them concurrently
+            (steps 1 and 2 of generate_procedure_batch)
+
+        Args:
+            uid             (str): unique identifier of the video
+            temp_dir        (str): directory the audio segments are written to
+            video_path      (str): input video
+            cwd             (str): directory temp_dir is relative to
+            stt_max_workers (int): maximum number of segments transcribed concurrently
+            streaming       (bool): decode segments through a pipe instead of writing them to disk
+            vad             (bool): only transcribe speech regions found by voice activity detection
+            manifest        (RunManifest, optional): checkpoint of the run. Segments it records as transcribed
+                                                     are not transcribed again, and segments converted by a
+                                                     previous run are reused
+            store           (TranscriptStore): store the transcript segments are appended to, in order, as
+                                               soon as their audio segment and every earlier one is transcribed
+            segments        (List[AudioSegment], optional): segments already converted (see generate_procedures),
+                                                            the video is not converted again
+
+        Return:
+            speech (bool): False if voice activity detection found no speech in the recording. Transcript
+                           segments are appended to store with their start and end times offset by the start of
+                           their audio segment
+
+        Throws:
+            Exception if any segment failed to transcribe. The segments that succeeded are kept in the
+            manifest, so a rerun only retries the failed ones.
+
+        """
+        if manifest is not None and manifest.stage_status("transcribe") == DONE:
+            logger.info("Resuming run. Transcript already complete")
+            store.extend(manifest.transcript())
+            return manifest.stage("transcribe").get("speech", True)
+
+        if segments is None and not vad and self._use_batch_recognize(video_path):
+            self._transcribe_long(uid, temp_dir, video_path, manifest, store)
+            return True
+
+        # 1) Read and Convert mp4 File to .flac
+        ###############################################
+        logger.info(f"Generating .{self.audio_extension} file")
+        vid_converter = VideoConverter(video_path)
+        if segments is not None:
+            logger.info("Using converted segments")
+        elif vad:
+            segments = self._vad_segments(vid_converter, temp_dir)
+            first = next(segments, None)
+            if first is None:
+                logger.info("No speech detected. Skipping transcription")
+                if manifest is not None:
+                    manifest.set_stage("transcribe", DONE, speech=False)
+                return False
+            segments = itertools.chain([first], segments)
+        elif streaming:
+            # segments are decoded lazily while they are being transcribed
+            segments = vid_converter.stream_segments(quiet=True)
+        else:
+            segments = self._split_segments(vid_converter, temp_dir, cwd, manifest)
+
+        logger.info("OK")
+        ###############################################
+
+        # 2) SpeechToText Transcription
+        ###############################################
+        logger.info(f"Generating SpeechToText transcription ({self.stt_engine.name})")
+        stt = self.stt_engine
+
+        # segments transcribed by a previous run, their transcripts are read back from the manifest in order
+        resumed = deque()
+        if manifest is not None:
+            resumed.extend(sorted(index for index in manifest.segments if manifest.segment_status(index) == DONE))
+            if resumed:
+                logger.info(f"Resuming run. {len(resumed)} segment(s) already transcribed")
+        skipped = set(resumed)
+
+        # segments are transcribed concurrently but kept in segment index order,
+        # only the responses of in-flight segments are held in memory
+        responses = self._transcribe_segments(
+            stt,
+            (segment for segment in segments if segment.index not in skipped),
+            max_workers=stt_max_workers,
+            tolerate_errors=True,
+        )
+
+        failed = []
+        for segment, response in responses:
+            while resumed and resumed[0] < segment.index:
+                store.extend(manifest.segment_transcript(resumed.popleft()))
+            try:
+                if isinstance(response, Exception):
+                    raise response
+
+                # List[Tuple[str, float, float]]
+                tmp_transcript_time = response
+                offset_transcript_time = []
+
+                # offset times
+                for dialogue_snip in tmp_transcript_time:
+                    content, start_time_tmp, end_time_tmp = dialogue_snip
+                    # segment start, or the original timeline of packed speech regions
+                    offset_start_time = segment.source_time(start_time_tmp)
+                    offset_end_time = segment.source_time(end_time_tmp)
+
+                    updated_snip = (content, offset_start_time, offset_end_time)
+                    offset_transcript_time.append(updated_snip)
+
+                store.extend(offset_transcript_time)
+                if manifest is not None:
+                    manifest.set_segment(
+                        segment.index,
+                        DONE,
+                        start=segment.start,
+                        duration=segment.duration,
+                        transcript=offset_transcript_time,
+                    )
+            except Exception as e:
+                logger.critical(f"ERROR: Autolab.py Step 2. Segment {segment.index}: {e}")
+                failed.append(segment.index)
+                if manifest is not None:
+                    manifest.set_segment(
+                        segment.index, FAILED, start=segment.start, duration=segment.duration, error=str(e)
+                    )
+
+        while resumed:
+            store.extend(manifest.segment_transcript(resumed.popleft()))
+
+        if failed:
+            # a missing segment would leave a hole in the procedure, fail the run so it is retried instead
+            if manifest is not None:
+                manifest.set_stage("transcribe", FAILED, failed_segments=failed)
+            raise Exception(
+                "Error: {} segment(s) failed to transcribe: {}. Rerun with the same uid to retry them".format(
+                    len(failed), failed
+                )
+            )
+        if manifest is not None:
+            manifest.set_stage("transcribe", DONE)
+        return True
+
+    def _use_batch_recognize(self, video_path: str) -> bool:
+        """Returns True if the recording is long enough to be transcribed with BatchRecognize"""
+        if self.gcs_bucket is None or not isinstance(self.stt_engine, SpeechToText):
+            return False
+        try:
+            duration = probe_duration(video_path)
+        except Exception as e:
+            logger.warning(f"Could not probe the duration of the recording, using synchronous requests. {e}")
+            return False
+        return duration > self.long_audio_seconds
+
+    def _transcribe_long(
+        self, uid: str, temp_dir: str, video_path: str, manifest: RunManifest, store: TranscriptStore
+    ):
+        """
+            Transcribes the whole recording with one BatchRecognize operation (steps 1 and 2 of
+            generate_procedure_batch for recordings longer than long_audio_seconds)
+
+        Args:
+            uid        (str): unique identifier of the video
+            temp_dir   (str): directory the audio file is written to
+            video_path (str): input video
+            manifest   (RunManifest): checkpoint of the run, or None. The recording is recorded as segment 0
+            store      (TranscriptStore): store the transcript is appended to
 
         Return:
             None
 
         """
-        logging.basicConfig(
-            level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+        # 1) Read and Convert mp4 File to audio
+        ###############################################
+        audio_path = f"{temp_dir}/{uid}.{self.audio_extension}"
+        logger.info(f"Generating .{self.audio_extension} file for BatchRecognize")
+        with tracing.span("convert") as span:
+            plan = VideoConverter(video_path).generateAudio(
+                audio_path, codec=self.acodec, quiet=True, profile=self.audio_profile
+            )
+            duration = probe_duration(audio_path)
+            span.set(bytes=os.path.getsize(audio_path), audio_seconds=duration, **plan.metrics())
+        logger.info("OK")
+        ###############################################
+
+        # 2) SpeechToText Transcription
+        ###############################################
+        logger.info("Generating SpeechToText transcription with BatchRecognize")
+        stt = self.stt_engine
+        with tracing.span("upload", bytes=os.path.getsize(audio_path)):
+            audio_uri = upload_to_gcs(audio_path, self.gcs_bucket, f"autolab/{uid}.{self.audio_extension}")
+        try:
+            with tracing.span("stt_batch", engine=stt.name, audio_seconds=duration):
+                results = stt.batch_recognize(audio_uri, dynamic_batching=self.dynamic_batching, duration=duration)
+        except Exception as e:
+            if manifest is not None:
+                manifest.set_segment(0, FAILED, start=0.0, duration=duration, error=str(e))
+                manifest.set_stage("transcribe", FAILED, failed_segments=[0])
+            raise
+        finally:
+            delete_from_gcs(audio_uri)
+
+        # times are already relative to the start of the recording
+        transcript_time = stt.get_transcript_list_and_times(results)
+        store.extend(transcript_time)
+        if manifest is not None:
+            manifest.set_segment(0, DONE, start=0.0, duration=duration, transcript=transcript_time)
+            manifest.set_stage("transcribe", DONE)
+
+    def _split_segments(
+        self, vid_converter: VideoConverter, temp_dir: str, cwd: str, manifest: RunManifest = None
+    ) -> List[AudioSegment]:
+        """
+            Splits the audio into segment files under {temp_dir}/input_sliced, reusing the segments of a
+            previous run recorded in the manifest if they are still on disk
+
+        Args:
+            vid_converter (VideoConverter): converter of the input video
+            temp_dir      (str): directory the audio segments are written to
+            cwd           (str): directory temp_dir is relative to
+            manifest      (RunManifest, optional): checkpoint of the run
+
+        Return:
+            segments (List[AudioSegment]): segments on disk, each starting where the previous one ended
+                                           according to ffprobe
+
+        """
+        if manifest is not None and manifest.stage_status("convert") == DONE:
+            segments = [
+                AudioSegment(index=index, start=segment["start"], duration=segment["duration"], path=segment["path"])
+                for index, segment in sorted(manifest.segments.items())
+            ]
+            if segments and all(os.path.isfile(segment.path) for segment in segments):
+                logger.info("Resuming run. Reusing converted segments")
+                return segments
+
+        audio_dir = f"{temp_dir}/input_sliced"
+        os.makedirs(audio_dir, exist_ok=True)
+        # segments left by an interrupted run would make ffmpeg refuse to overwrite them
+        for path in vid_converter.list_segments(os.path.join(cwd, audio_dir), codec=self.audio_extension):
+            os.remove(path)
+        with tracing.span("convert") as span:
+            try:
+                vid_converter.split_and_convert(
+                    audio_dir,
+                    codec=self.acodec,
+                    quiet=True,
+                    profile=self.audio_profile,
+                    max_workers=self.ffmpeg_workers,
+                )
+            except Exception as e:
+                logger.critical(f"vid_converter failed to generate. {e}")
+                if manifest is not None:
+                    manifest.set_stage("convert", FAILED, error=str(e))
+                raise
+            if vid_converter.conversion is not None:
+                conversion = vid_converter.conversion
+                reason = f" ({conversion.reason})" if conversion.reason else ""
+                logger.info(f"Audio conversion: {conversion.path}{reason}")
+                span.set(**conversion.metrics())
+
+            # segments are cut on packet boundaries, so their real length drifts from SEGMENT_SECONDS
+            segments = []
+            start = 0.0
+            segment_paths = vid_converter.list_segments(os.path.join(cwd, audio_dir), codec=self.audio_extension)
+            for index, path in enumerate(segment_paths):
+                duration = probe_duration(path)
+                segments.append(AudioSegment(index=index, start=start, duration=duration, path=path))
+                start += duration
+            span.set(bytes=sum(os.path.getsize(segment.path) for segment in segments), audio_seconds=start)
+
+        if not segments:
+            # an input ffmpeg could not decode, not a silent recording. Never checkpointed as converted
+            if manifest is not None:
+                manifest.set_stage("convert", FAILED, error="no audio segments")
+            raise Exception("Error: ffmpeg did not produce any audio segment from {}".format(vid_converter.base_name))
+
+        if manifest is not None:
+            for segment in segments:
+                # conversion is deterministic, transcripts of a previous run still match the new files
+                status = DONE if manifest.segment_status(segment.index) == DONE else CONVERTED
+                manifest.set_segment(
+                    segment.index, status, start=segment.start, duration=segment.duration, path=segment.path
+                )
+            manifest.set_stage("convert", DONE, segments=len(segments))
+        return segments
+
+    def _generate_instructions(self, store: TranscriptStore, on_event: Callable[[dict], None] = None) -> dict:
+        """
+            Generates lab instructions from a saved transcript (step 3 of generate_procedure*)
+
+        Args:
+            store    (TranscriptStore): transcript, streamed line by line to TranscriptConversion
+            on_event (Callable[[dict], None], optional): when set, the completion is streamed and on_event is called
+                                                        with its partial results as they are parsed (the summary,
+                                                        step and retry events of TranscriptConversion.streamInstructions)
+
+        Return:
+            instr_json (dict): instructions generated by TranscriptConversion
+
+        """
+        logger.info("Instruction Generation - {}".format(self.gpt_model))
+        logger.info("Generating lab instructions...")
+
+        load_dotenv()
+        secret_key = os.getenv("OPENAI_API_KEY")
+        instr_generator = TranscriptConversion(
+            model=self.gpt_model,
+            secret_key=secret_key,
+            structured_output=self.structured_output,
+            index=self.procedure_index,
+            reuse_threshold=self.reuse_threshold,
         )
 
-    def generate_procedure(self, uid: str, temp_dir: str, enable_logging=False) -> dict:
+        transcript = store.lines()
+        if self.compaction is not None:
+            encoding = getattr(instr_generator, "encoding", None)
+            with tracing.span("compact") as span:
+                compacted = compact_transcript(store, encoding, self.compaction)
+                # maps the lines sent to GPT back to the segments of the transcript file
+                compacted.save(os.path.splitext(store.path)[0] + ".compact.json")
+                if compacted.tokens_before is not None:
+                    span.set(
+                        tokens=compacted.tokens_after, tokens_saved=compacted.tokens_before - compacted.tokens_after
+                    )
+                    logger.info(
+                        f"Compacted transcript from {len(store)} to {len(compacted)} lines, "
+                        f"{compacted.tokens_before} to {compacted.tokens_after} tokens"
+                    )
+            transcript = compacted.lines()
+
+        if on_event is None:
+            instr_json = instr_generator.generateInstructions(transcript=transcript, map_reduce=self.map_reduce)
+        else:
+            for event in instr_generator.streamInstructions(transcript=transcript):
+                if event["type"] in ("result", "error"):
+                    instr_json = event["result"]
+                else:
+                    on_event(event)
+
+        if instr_generator.match is not None:
+            logger.info(f"Closest procedure in the index has a similarity of {instr_generator.match.similarity:.2f}")
+        if instr_generator.regenerations_avoided:
+            logger.info(f"Repaired JSON instead of regenerating {instr_generator.regenerations_avoided} time(s)")
+        logger.info("OK. Returning instructions")
+
+        return instr_json
+
+    def _cached_instructions(self, cache_keys: dict, manifest: RunManifest = None) -> dict:
+        """Returns the cached instructions of a run, or those of its completed previous run, or None"""
+        if cache_keys is not None:
+            with tracing.span("instructions_cache") as span:
+                instr_json = self.cache.get_instructions(cache_keys["instructions"])
+                span.set(cache_hit=instr_json is not None)
+            if instr_json is not None:
+                logger.info("Cache hit. Returning cached instructions")
+                return instr_json
+        if manifest is not None and manifest.stage_status("instructions") == DONE:
+            logger.info("Resuming run. Returning the instructions of the completed run")
+            return manifest.stage("instructions")["result"]
+        return None
+
+    def _run_cached(
+        self,
+        uid: str,
+        temp_dir: str,
+        cache_keys: dict,
+        transcribe,
+        manifest: RunManifest = None,
+        on_event: Callable[[dict], None] = None,
+    ) -> dict:
+        """
+            Runs the pipeline, skipping every stage that already has a cache hit
+
+        Args:
+            uid        (str): unique identifier of the video
+            temp_dir   (str): directory the transcript is written to
+            cache_keys (dict): keys returned by _cache_keys, or None if caching is disabled
+            transcribe (Callable[[TranscriptStore], bool]): runs the conversion and transcription stages, appending
+                                                            the transcript to the given store. Returns False when
+                                                            voice activity detection found no speech
+            manifest   (RunManifest, optional): checkpoint of the run, the instructions of a completed run are
+                                                returned without generating them again
+            on_event   (Callable[[dict], None], optional): streams the instructions, see _generate_instructions
+
+        Return:
+            instr_json (dict): instructions generated from the transcription
+
+        """
+        instr_json = self._cached_instructions(cache_keys, manifest)
+        if instr_json is not None:
+            return instr_json
+
+        # the transcript is written to {temp_dir}/{uid}.txt as it is produced
+        with TranscriptStore(f"{temp_dir}/{uid}.txt") as store:
+            transcript_time = None
+            if cache_keys is not None:
+                with tracing.span("transcript_cache") as span:
+                    transcript_time = self.cache.get_transcript(cache_keys["transcript"])
+                    span.set(cache_hit=transcript_time is not None)
+            if transcript_time is not None:
+                logger.info("Cache hit. Skipping conversion and transcription")
+                store.extend(transcript_time)
+                # only the transcripts of recordings without speech are cached empty
+                no_speech = len(store) == 0
+                del transcript_time
+            else:
+                no_speech = transcribe(store) is False
+                # an empty transcript is only cached when VAD found no speech, so it is never the result of
+                # an error that a rerun could fix
+                if cache_keys is not None and (len(store) or no_speech):
+                    self.cache.put_transcript(cache_keys["transcript"], store)
+            logger.info("Saved transcript")
+
+            if no_speech:
+                # nothing was said, there is nothing for GPT to convert
+                logger.info("No speech detected. Skipping instruction generation")
+                return format_result({"Summary": "No speech was detected in the recording.", "Procedure": []})
+
+            # 3) Instruction Generation
+            ###############################################
+            if on_event is None:
+                instr_json = self._generate_instructions(store)
+            else:
+                instr_json = self._generate_instructions(store, on_event)
+
+        with tracing.span("serialize"):
+            # failed generations are returned as an error response and must not be cached
+            if cache_keys is not None and "statusCode" not in instr_json:
+                self.cache.put_instructions(cache_keys["instructions"], instr_json)
+            if manifest is not None:
+                if "statusCode" in instr_json:
+                    manifest.set_stage("instructions", FAILED, error=instr_json.get("body"))
+                else:
+                    manifest.set_stage("instructions", DONE, result=instr_json)
+
+        return instr_json
+
+    @staticmethod
+    def _attach_timings(instr_json: dict, trace: tracing.Trace, timings: bool) -> dict:
+        """Returns a copy of the result with the timings of its run under "timings" if timings is set"""
+        if not timings:
+            return instr_json
+        return {**instr_json, "timings": trace.timings()}
+
+    def generate_procedure(self, uid: str, temp_dir: str, enable_logging=False, timings: bool = False) -> dict:
         """
         Generates a procedural script based on video input by converting the video to audio, transcribing the speech,
         and then using an instruction generator to convert the transcription into instructions.
@@ -60,6 +879,9 @@ class Autolab:
             The path to the directory where temporary files will be stored during the process.
         enable_logging : bool, optional
             If True, logging is enabled. Default is False.
+        timings : bool, optional
+            If True, the per-stage timings of the run (see `tracing.Trace.timings`) are attached to the result
+            under "timings". Default is False.
 
         Returns
         -------
@@ -75,72 +897,29 @@ class Autolab:
         5. Finally, instructions are generated based on the saved transcript using a `TranscriptConversion` instance,
         and returned as a dictionary.
 
+        If the Autolab has a cache, steps 1-2 are skipped when the transcript is cached and every step is skipped
+        when the instructions are cached.
+
         @TODO
         ----
         More thorough implementation of `VideoConverter`.
         """
-        logging.basicConfig(
-            level=logging.INFO if enable_logging else logging.WARNING, force=True
-        )
-        # 1) Read and Convert mp4 File to .flac
-        # @TODO finish more through implementation of VideoConverter
-        ###############################################
-        logging.info("Generating .flac file")
-        vid_converter = VideoConverter(f"{temp_dir}/{uid}.mp4")
-        vid_converter.generateAudio(f"{temp_dir}/{uid}.{self.acodec}", codec=self.acodec, quiet=True)
-        logging.info("OK")
-        ###############################################
-
-        # 2) SpeechToText Transcription
-        ###############################################
-        logging.info("Generating SpeechToText transcription")
-        stt = SpeechToText(project_id=self.project_id, recognizer_id=self.recognizer_id)
-
-        # read in audio file previously generated
-        with open(f"{temp_dir}/{uid}.flac", "rb") as fd:
-            contents = fd.read()
-        response = stt.speech_to_text(contents)
-
-        transcript_concat = stt.concatenate_transcripts(response)
-        transcript_time = stt.get_transcript_list_and_times(response)
-
-        # convert transcript_time into string
-        format_transcript_time = ""
-        for item in transcript_time:
-            text = item[0]
-            start_time = item[1]
-            end_time = item[2]
-            format_transcript_time += f"{text} [{start_time}-{end_time}]\n"
-
-        logging.info("OK. Saving transcript...")
-        with open(f"{temp_dir}/{uid}.txt", "w") as file:
-            file.write(format_transcript_time)
-
-        logging.info("Saved")
-        ###############################################
-
-        # 3) Instruction Generation
-        ###############################################
-        logging.info("Instruction Generation - {}".format(self.gpt_model))
-        logging.info("Generating lab instructions...")
-        transcription_path = f"{temp_dir}/{uid}.txt"
-        instr_path = f"{temp_dir}/{uid}_instr.txt"
-
-        load_dotenv()
-        secret_key = os.getenv("OPENAI_API_KEY")
-        instr_generator = TranscriptConversion(
-            model=self.gpt_model, secret_key=secret_key
-        )
-
-        instr_json = instr_generator.generateInstructions(
-            transcript_path=transcription_path
-        )
-
-        logging.info("OK. Returning instructions")
-
-        return instr_json
-    
-    def generate_procedure_v2(self, uid: str, temp_dir: str, video_path: str = None, enable_logging=False) -> dict:
+        video_path = f"{temp_dir}/{uid}.mp4"
+        with _logging_enabled(enable_logging), tracing.start_trace(
+            "generate_procedure", self.trace_exporter, uid=uid
+        ) as trace:
+            cache_keys = self._cache_keys(video_path, mode="single")
+            instr_json = self._run_cached(
+                uid,
+                temp_dir,
+                cache_keys,
+                lambda store: store.extend(self._transcribe_single(uid, temp_dir, video_path)),
+            )
+        return self._attach_timings(instr_json, trace, timings)
+
+    def generate_procedure_v2(
+        self, uid: str, temp_dir: str, video_path: str = None, enable_logging=False, timings: bool = False
+    ) -> dict:
         """
         Generates a procedural script based on video input by converting the video to audio, transcribing the speech,
         and then using an instruction generator to convert the transcription into instructions.
@@ -156,6 +935,9 @@ class Autolab:
             The path to the video directory if specified. If not, we will use the temp_dir
         enable_logging : bool, optional
             If True, logging is enabled. Default is False.
+        timings : bool, optional
+            If True, the per-stage timings of the run (see `tracing.Trace.timings`) are attached to the result
+            under "timings". Default is False.
 
         Returns
         -------
@@ -171,84 +953,31 @@ class Autolab:
         5. Finally, instructions are generated based on the saved transcript using a `TranscriptConversion` instance,
         and returned as a dictionary.
 
+        If the Autolab has a cache, steps 1-2 are skipped when the transcript is cached and every step is skipped
+        when the instructions are cached.
+
         @TODO
         ----
         More thorough implementation of `VideoConverter`.
         """
 
-        logging.basicConfig(
-            level=logging.INFO if enable_logging else logging.WARNING, force=True
-        )
-
-        # 1) Read and Convert mp4 File to .flac
-        ###############################################
-        logging.info("Generating .flac file")
         if video_path == None:
             video_path = f"{temp_dir}/{uid}.mp4"
-
-        vid_converter = VideoConverter(video_path)
-        try:
-            vid_converter.generateAudio(f"{temp_dir}/{uid}.{self.acodec}", codec=self.acodec, quiet=True)
-        except Exception as e:
-            logging.critical(f"vid_converter failed to generate. {e}")
-
-        logging.info("OK")
-        ###############################################
-
-        # 2) SpeechToText Transcription
-        ###############################################
-        logging.info("Generating SpeechToText transcription")
-        stt = SpeechToText(project_id=self.project_id, recognizer_id=self.recognizer_id)
-
-        # read in audio file previously generated
-        with open(f"{temp_dir}/{uid}.{self.acodec}", "rb") as fd:
-            contents = fd.read()
-
-        try:
-            response = stt.speech_to_text(contents)
-        except Exception as e:
-            logging.critical(f"speech_to_text failed to execute. {e}")
-
-        # transcript_concat = stt.concatenate_transcripts(response)
-        transcript_time = stt.get_transcript_list_and_times(response)
-
-        # convert transcript_time into string
-        format_transcript_time = ""
-        for item in transcript_time:
-            text = item[0]
-            start_time = item[1]
-            end_time = item[2]
-            format_transcript_time += f"{text} [{start_time}-{end_time}]\n"
-
-        logging.info("OK. Saving transcript...")
-        with open(f"{temp_dir}/{uid}.txt", "w") as file:
-            file.write(format_transcript_time)
-
-        logging.info("Saved")
-        ###############################################
-
-        # 3) Instruction Generation
-        ###############################################
-        logging.info("Instruction Generation - {}".format(self.gpt_model))
-        logging.info("Generating lab instructions...")
-        transcription_path = f"{temp_dir}/{uid}.txt"
-        instr_path = f"{temp_dir}/{uid}_instr.txt"
-
-        load_dotenv()
-        secret_key = os.getenv("OPENAI_API_KEY")
-        instr_generator = TranscriptConversion(
-            model=self.gpt_model, secret_key=secret_key
-        )
-
-        instr_json = instr_generator.generateInstructions(
-            transcript_path=transcription_path
-        )
-
-        logging.info("OK. Returning instructions")
-
-        return instr_json
-    
-    def generate_procedure_batch(self, uid: str, temp_dir: str, video_path: str = None, cwd: str = os.getcwd(), enable_logging=False) -> dict:
+        with _logging_enabled(enable_logging), tracing.start_trace(
+            "generate_procedure_v2", self.trace_exporter, uid=uid
+        ) as trace:
+            cache_keys = self._cache_keys(video_path, mode="single")
+            instr_json = self._run_cached(
+                uid,
+                temp_dir,
+                cache_keys,
+                lambda store: store.extend(
+                    self._transcribe_single(uid, temp_dir, video_path, tolerate_errors=True)
+                ),
+            )
+        return self._attach_timings(instr_json, trace, timings)
+
+    def generate_procedure_batch(self, uid: str, temp_dir: str, video_path: str = None, cwd: str = os.getcwd(), enable_logging=False, stt_max_workers: int = 8, streaming: bool = False, vad: bool = False, resume: bool = True, timings: bool = False, progress=None, on_event=None) -> dict:
         """
         Generates a procedural script based on video input by converting the video to audio, transcribing the speech,
         and then using an instruction generator to convert the transcription into instructions.
@@ -264,7 +993,29 @@ class Autolab:
         video_path : str, optional
             The path to the video directory if specified. If not, we will use the temp_dir
         enable_logging : bool, optional
-            If True, logging is enabled. Default is False.
+            If True, logging is enabled. Default is False. Only the info messages of this run are affected, they go to
+            the "autolab" logger and are shown according to the logging configuration of the application.
+        timings : bool, optional
+            If True, the per-stage timings of the run (see `tracing.Trace.timings`) are attached to the result
+            under "timings". Default is False.
+        stt_max_workers : int, optional
+            Maximum number of segments transcribed concurrently. Use 1 to transcribe serially. Default is 8.
+        streaming : bool, optional
+            If True, ffmpeg decodes the audio through a pipe and segments are sent to `SpeechToText` from memory,
+            so no intermediate audio files or `input_sliced/` directory are created. Default is False.
+        vad : bool, optional
+            If True, only the speech regions found by voice activity detection are transcribed, packed into chunks
+            under the recognizer's sync limit instead of fixed 60-second slices. Recordings without speech skip
+            transcription and instruction generation. Default is False.
+        resume : bool, optional
+            If True, the run is checkpointed in `{temp_dir}/{uid}.manifest.jsonl` and a rerun with the same uid, input
+            and settings only processes the stages and segments that are missing or failed. Default is True.
+        progress : Callable[[RunManifest, dict], None], optional
+            Called with the manifest and each stage or segment update of the run as soon as it is checkpointed,
+            e.g. to report the progress of a job (see `jobs.Worker`). Needs `resume`. Default is None.
+        on_event : Callable[[dict], None], optional
+            If set, the GPT completion is streamed and on_event is called with the summary and each procedure step
+            as soon as they are generated (see `TranscriptConversion.streamInstructions`). Default is None.
 
         Returns
         -------
@@ -274,118 +1025,488 @@ class Autolab:
         Notes
         -----
         1. This function begins by converting a mp4 video file to .flac audio using a `VideoConverter` instance.
-        2. The audio is then transcribed into text using a `SpeechToText` instance.
-        3. The transcriptions are processed into a string, each transcript segment along with their start and end times.
+        2. The audio segments are transcribed concurrently into text using a `SpeechToText` instance.
+        3. The transcriptions are merged in segment order into a string, each transcript segment along with their
+        start and end times.
         4. The transcript is saved in a .txt file.
         5. Finally, instructions are generated based on the saved transcript using a `TranscriptConversion` instance,
         and returned as a dictionary.
 
+        If the Autolab has a cache, steps 1-2 are skipped when the transcript is cached and every step is skipped
+        when the instructions are cached.
+
+        If a segment fails to transcribe, the run raises after the other segments are done instead of leaving a
+        gap in the transcript.
+
         @TODO
         ----
         More thorough implementation of `VideoConverter`.
         """
 
-        logging.basicConfig(
-            level=logging.INFO if enable_logging else logging.WARNING, force=True
-        )
-
-        # 1) Read and Convert mp4 File to .flac
-        ###############################################
-        logging.info("Generating .flac file")
         if video_path == None:
             # TODO Unclear purpose of code below. Add or delete?
             video_path = f"{temp_dir}/{uid}.mp4"
+        with _logging_enabled(enable_logging), tracing.start_trace(
+            "generate_procedure_batch", self.trace_exporter, uid=uid
+        ) as trace:
+            cache_keys = self._cache_keys(video_path, mode="batch", streaming=streaming, vad=vad)
+            manifest = None
+            if resume:
+                manifest = self._run_manifest(
+                    uid, temp_dir, video_path, listener=progress, mode="batch", streaming=streaming, vad=vad
+                )
+
+            instr_json = self._run_cached(
+                uid,
+                temp_dir,
+                cache_keys,
+                lambda store: self._transcribe_batch(
+                    uid,
+                    temp_dir,
+                    video_path,
+                    cwd,
+                    stt_max_workers=stt_max_workers,
+                    streaming=streaming,
+                    vad=vad,
+                    manifest=manifest,
+                    store=store,
+                ),
+                manifest=manifest,
+                on_event=on_event,
+            )
+        return self._attach_timings(instr_json, trace, timings)
+
+    def generate_procedure_stream(
+        self,
+        uid: str,
+        temp_dir: str,
+        video_path: str = None,
+        cwd: str = os.getcwd(),
+        enable_logging=False,
+        stt_max_workers: int = 8,
+        streaming: bool = False,
+        vad: bool = False,
+        resume: bool = True,
+        timings: bool = False,
+    ) -> Iterator[dict]:
+        """
+        Runs `generate_procedure_batch` and yields the procedure while GPT is still generating it, so a client can
+        show the summary and the first steps long before the whole procedure is complete.
 
-        audio_dir = f"{temp_dir}/input_sliced"
-        os.mkdir(audio_dir)
-        vid_converter = VideoConverter(video_path)
-        try:
-            vid_converter.split_and_convert(audio_dir, codec=self.acodec, quiet=True)
-        except Exception as e:
-            logging.critical(f"vid_converter failed to generate. {e}")
-
-        logging.info("OK")
-        ###############################################
+        Parameters
+        ----------
+        uid, temp_dir, video_path, cwd, enable_logging, stt_max_workers, streaming, vad, resume, timings
+            See `generate_procedure_batch`.
 
-        # 2) SpeechToText Transcription
-        ###############################################
-        logging.info("Generating SpeechToText transcription")
-        stt = SpeechToText(project_id=self.project_id, recognizer_id=self.recognizer_id)
+        Yields
+        ------
+        dict
+            {"type": "summary", "summary": str} and {"type": "step", "index": int, "step": dict} as they are generated,
+            {"type": "retry", "attempt": int} when an invalid output is generated again (the partial results
+            yielded before it must be discarded), and last {"type": "result", "result": dict} with the same result
+            as `generate_procedure_batch`. Cached instructions are returned as the result alone.
+
+        Raises
+        ------
+        Exception
+            Any error of the run, raised once the events before it are yielded.
+        """
+        events = queue.Queue()
+        done = object()
 
-        # TODO this will fill up memory if transcript is super long
-        responses = []
+        def run():
+            try:
+                result = self.generate_procedure_batch(
+                    uid,
+                    temp_dir,
+                    video_path=video_path,
+                    cwd=cwd,
+                    enable_logging=enable_logging,
+                    stt_max_workers=stt_max_workers,
+                    streaming=streaming,
+                    vad=vad,
+                    resume=resume,
+                    timings=timings,
+                    on_event=events.put,
+                )
+                events.put({"type": "result", "result": result})
+            except Exception as e:
+                events.put(e)
+            events.put(done)
+
+        # the run goes on in a thread while the events are yielded, its trace is nested in the caller's
+        thread = threading.Thread(target=tracing.propagate(run), name=f"autolab-stream-{uid}", daemon=True)
+        thread.start()
+        while True:
+            event = events.get()
+            if event is done:
+                break
+            if isinstance(event, Exception):
+                raise event
+            yield event
+        thread.join()
+
+    def generate_procedures(
+        self,
+        uids: Iterable[str],
+        temp_dir: str,
+        fetch: Callable[[str, str], str] = None,
+        cwd: str = os.getcwd(),
+        enable_logging=False,
+        stt_max_workers: int = 8,
+        download_workers: int = 2,
+        convert_workers: int = 2,
+        transcribe_workers: int = 2,
+        resume: bool = True,
+    ) -> Iterator[Tuple[str, object]]:
+        """
+        Generates the procedures of several videos through a pipeline of stages, each with its own bounded pool of
+        workers: videos are downloaded while earlier ones are converted by ffmpeg, while still earlier ones are
+        transcribed and converted to instructions. Throughput is limited by the slowest stage instead of the sum
+        of the stages.
 
+        Parameters
+        ----------
+        uids : Iterable[str]
+            Unique identifiers of the videos, each processed once. The iterable is consumed as videos enter
+            the pipeline.
+        temp_dir : str
+            The path to the directory where temporary files will be stored. Each video gets its own
+            `{temp_dir}/{uid}` directory.
+        fetch : Callable[[str, str], str], optional
+            Downloads a video, called with its uid and directory. Returns the path (or URL) of the video. By default
+            the video is expected at `{temp_dir}/{uid}.mp4`.
+        cwd : str, optional
+            The directory temp_dir is relative to.
+        enable_logging : bool, optional
+            If True, logging is enabled. Default is False.
+        stt_max_workers : int, optional
+            Maximum number of segments of one video transcribed concurrently. Default is 8.
+        download_workers : int, optional
+            Maximum number of videos downloaded concurrently. Default is 2.
+        convert_workers : int, optional
+            Maximum number of videos converted by ffmpeg concurrently. Default is 2.
+        transcribe_workers : int, optional
+            Maximum number of videos transcribed and converted to instructions concurrently. Default is 2.
+        resume : bool, optional
+            If True, each video is checkpointed like in `generate_procedure_batch`. Default is True.
+
+        Yields
+        ------
+        Tuple[str, object]
+            (uid, result) pairs in completion order. The result is the dictionary returned by
+            `generate_procedure_batch`, or the exception that stopped the video. A failed video does not affect
+            the others.
 
-        for filename in os.listdir(cwd + "/" + audio_dir):
-            filepath = cwd + "/" +  audio_dir + "/" + filename
-            if os.path.splitext(filename)[1] == f".{self.acodec}":
-                # read in audio file previously generated
-                print(filepath)
-                with open(filepath, "rb") as fd:
-                    tmp_response = fd.read()
-                responses.append(stt.speech_to_text(tmp_response))
+        Notes
+        -----
+        At most download_workers + convert_workers + transcribe_workers videos are in the pipeline at once, so
+        downloaded videos and converted segments waiting for the next stage do not pile up on disk.
+        """
 
-        transcript_time = []
-        time_offset = 0.0
-        for response in responses:
+        def download(uid: str, state: dict):
+            state["dir"] = os.path.join(temp_dir, uid)
+            os.makedirs(state["dir"], exist_ok=True)
+            state["video_path"] = fetch(uid, state["dir"]) if fetch is not None else f"{temp_dir}/{uid}.mp4"
+
+        def convert(uid: str, state: dict):
+            video_path = state["video_path"]
+            state["cache_keys"] = self._cache_keys(video_path, mode="batch", streaming=False, vad=False)
+            state["manifest"] = None
+            if resume:
+                state["manifest"] = self._run_manifest(
+                    uid, state["dir"], video_path, mode="batch", streaming=False, vad=False
+                )
+            instr_json = self._cached_instructions(state["cache_keys"], state["manifest"])
+            if instr_json is not None:
+                state["result"] = instr_json
+                return
+
+            # conversion is skipped when the transcribe stage does not need segments
+            state["segments"] = None
+            transcript_cached = (
+                state["cache_keys"] is not None
+                and self.cache.get_transcript(state["cache_keys"]["transcript"]) is not None
+            )
+            transcribed = state["manifest"] is not None and state["manifest"].stage_status("transcribe") == DONE
+            if not transcript_cached and not transcribed and not self._use_batch_recognize(video_path):
+                state["segments"] = self._split_segments(
+                    VideoConverter(video_path), state["dir"], cwd, state["manifest"]
+                )
+
+        def transcribe(uid: str, state: dict):
+            state["result"] = self._run_cached(
+                uid,
+                state["dir"],
+                state["cache_keys"],
+                lambda store: self._transcribe_batch(
+                    uid,
+                    state["dir"],
+                    state["video_path"],
+                    cwd,
+                    stt_max_workers=stt_max_workers,
+                    manifest=state["manifest"],
+                    store=store,
+                    segments=state["segments"],
+                ),
+                manifest=state["manifest"],
+            )
+
+        stages = [
+            ("download", download, download_workers),
+            ("convert", convert, convert_workers),
+            ("transcribe", transcribe, transcribe_workers),
+        ]
+        pools = [
+            ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f"autolab-{name}")
+            for name, _, workers in stages
+        ]
+        finished = queue.Queue()
+
+        def advance(index: int, uid: str, state: dict):
+            name, stage, _ = stages[index]
             try:
-                # List[Tuple[str, float, float]]
-                tmp_transcript_time = stt.get_transcript_list_and_times(response)
-                offset_transcript_time = []
-
-                # offset times
-                for dialogue_snip in tmp_transcript_time:
-                    content, start_time_tmp, end_time_tmp = dialogue_snip
-                    offset_start_time = start_time_tmp + time_offset
-                    offset_end_time = end_time_tmp + time_offset
-
-                    updated_snip = (content, offset_start_time, offset_end_time)
-                    offset_transcript_time.append(updated_snip)
-                    
-                transcript_time += offset_transcript_time
-                time_offset += 60.0
+                # the videos of a pipeline are batch work, interactive requests are sent before their calls
+                with ratelimit.priority(ratelimit.BATCH), _logging_enabled(enable_logging):
+                    stage(uid, state)
             except Exception as e:
-                logging.critical(f"ERROR: Autolab.py Step 2. {e}")
-            
-        # clears memory
-        del responses
-        
-        # convert transcript_time into string
-        format_transcript_time = ""
-
-        for item in transcript_time:
-            text = item[0]
-            start_time = item[1]
-            end_time = item[2]
-            format_transcript_time += f"{text} [{start_time}-{end_time}]\n"
-    
-        # clears memory
-        del transcript_time
-
-        logging.info("OK. Saving transcript...")
-        with open(f"{temp_dir}/{uid}.txt", "w") as file:
-            file.write(format_transcript_time)
-
-        logging.info("Saved")
-        ###############################################
+                logger.critical(f"ERROR: {uid} failed in the {name} stage: {e}")
+                finished.put((uid, e))
+                return
+            if "result" in state or index + 1 == len(stages):
+                finished.put((uid, state.get("result")))
+            else:
+                pools[index + 1].submit(advance, index + 1, uid, state)
+
+        max_in_flight = sum(max(1, workers) for _, _, workers in stages)
+        pending = iter(uids)
+        in_flight = 0
+        try:
+            while True:
+                while in_flight < max_in_flight:
+                    uid = next(pending, None)
+                    if uid is None:
+                        break
+                    pools[0].submit(advance, 0, uid, {})
+                    in_flight += 1
+                if in_flight == 0:
+                    return
+                result = finished.get()
+                in_flight -= 1
+                yield result
+        finally:
+            # in stage order, so the videos still in flight can move on to the next stages
+            for pool in pools:
+                pool.shutdown(wait=True)
+
+    def _part_unchanged(self, part: str, record: dict) -> bool:
+        """Returns True if a part recorded in the parts manifest is the same input as part"""
+        if record.get("status") != DONE:
+            return False
+        # the object behind a URL can be replaced, and signed URLs of one object differ in their token
+        if is_url(part):
+            return record.get("content") == self._content_hash(part)
+        if record.get("part") != part:
+            return False
+        # local files can be edited in place, uids name the same object
+        if os.path.isfile(part):
+            return record.get("content") == self._content_hash(part)
+        return True
+
+    def _transcribe_part(
+        self, uid: str, index: int, part: str, temp_dir: str, fetch, cwd: str, stt_max_workers: int, resume: bool
+    ) -> Tuple[float, List[Tuple[str, float, float]], str]:
+        """
+            Converts and transcribes one part of a multi-part recording (see generate_procedure_parts)
 
-        # 3) Instruction Generation
-        ###############################################
-        logging.info("Instruction Generation - {}".format(self.gpt_model))
-        logging.info("Generating lab instructions...")
-        transcription_path = f"{temp_dir}/{uid}.txt"
-        instr_path = f"{temp_dir}/{uid}_instr.txt"
+        Args:
+            uid             (str): unique identifier of the whole recording
+            index           (int): position of the part
+            part            (str): uid, path or URL of the part
+            temp_dir        (str): directory of the recording, the part gets {temp_dir}/{uid}/part{index}
+            fetch           (Callable[[str, str], str]): downloads a part given by uid, or None
+            cwd             (str): directory temp_dir is relative to
+            stt_max_workers (int): maximum number of segments of the part transcribed concurrently
+            resume          (bool): checkpoint the part in its own manifest
 
-        load_dotenv()
-        secret_key = os.getenv("OPENAI_API_KEY")
-        instr_generator = TranscriptConversion(
-            model=self.gpt_model, secret_key=secret_key
-        )
+        Return:
+            duration     (float): real duration of the part in seconds
+            transcript   (List[Tuple[str, float, float]]): transcript with times relative to the part
+            content_hash (str): hash of the part
+        """
+        name = f"part{index:03d}"
+        part_dir = os.path.join(temp_dir, uid, name)
+        os.makedirs(part_dir, exist_ok=True)
+        if is_url(part) or os.path.isfile(part):
+            video_path = part
+        elif fetch is not None:
+            video_path = fetch(part, part_dir)
+        else:
+            video_path = f"{temp_dir}/{part}.mp4"
+
+        with tracing.span("part", index=index) as span:
+            content_hash = self._content_hash(video_path)
+            cache_keys = self._cache_keys(
+                video_path, content_hash=content_hash, mode="batch", streaming=False, vad=False
+            )
+            transcript = self.cache.get_transcript(cache_keys["transcript"]) if cache_keys is not None else None
+            span.set(cache_hit=transcript is not None)
+            if transcript is None:
+                manifest = None
+                if resume:
+                    manifest = self._run_manifest(
+                        name, part_dir, video_path, content_hash=content_hash, mode="batch", streaming=False, vad=False
+                    )
+                with TranscriptStore(f"{part_dir}/{name}.txt") as store:
+                    self._transcribe_batch(
+                        name, part_dir, video_path, cwd, stt_max_workers=stt_max_workers, manifest=manifest, store=store
+                    )
+                    transcript = list(store)
+                if cache_keys is not None:
+                    self.cache.put_transcript(cache_keys["transcript"], transcript)
 
-        instr_json = instr_generator.generateInstructions(
-            transcript_path=transcription_path
-        )
+            try:
+                duration = probe_duration(video_path)
+            except Exception as e:
+                # the next part then starts right after the last words of this one
+                duration = transcript[-1][2] if transcript else 0.0
+                logger.warning(f"Could not probe the duration of part {index}, using {duration}s. {e}")
+            span.set(audio_seconds=duration)
+        return duration, transcript, content_hash
+
+    def generate_procedure_parts(
+        self,
+        uid: str,
+        parts: Iterable[str],
+        temp_dir: str,
+        fetch: Callable[[str, str], str] = None,
+        cwd: str = os.getcwd(),
+        enable_logging=False,
+        stt_max_workers: int = 8,
+        part_workers: int = 2,
+        resume: bool = True,
+        timings: bool = False,
+        on_event=None,
+    ) -> dict:
+        """
+        Generates one procedure from a recording split into several files (e.g. sec1.mp4 to sec4.mp4). The parts are
+        converted and transcribed concurrently, their transcripts are stitched in order with the times of each part
+        offset by the real durations of the parts before it, and one procedure is generated from the whole lab.
 
-        logging.info("OK. Returning instructions")
+        Parameters
+        ----------
+        uid : str
+            A unique identifier for the whole recording. Its transcript is saved to `{temp_dir}/{uid}.txt` and each
+            part gets its own `{temp_dir}/{uid}/part<index>` directory.
+        parts : Iterable[str]
+            The parts in recording order: paths or URLs of the videos, or uids of videos downloaded with fetch.
+        temp_dir : str
+            The path to the directory where temporary files will be stored during the process.
+        fetch : Callable[[str, str], str], optional
+            Downloads a part given by uid, called with its uid and directory. Returns the path (or URL) of the video.
+            By default the video is expected at `{temp_dir}/{uid}.mp4`.
+        cwd : str, optional
+            The directory temp_dir is relative to.
+        enable_logging : bool, optional
+            If True, logging is enabled. Default is False.
+        stt_max_workers : int, optional
+            Maximum number of segments of one part transcribed concurrently. Default is 8.
+        part_workers : int, optional
+            Maximum number of parts converted and transcribed concurrently. Default is 2.
+        resume : bool, optional
+            If True, the transcript and duration of each part are checkpointed in
+            `{temp_dir}/{uid}.parts.manifest.jsonl`. Calling again with more parts (e.g. a part uploaded later) only converts and transcribes the new parts,
+            and a failed part is retried without the others. Default is True.
+        timings : bool, optional
+            If True, the per-stage timings of the run (see `tracing.Trace.timings`) are attached to the result
+            under "timings". Default is False.
+        on_event : Callable[[dict], None], optional
+            Streams the procedure like in `generate_procedure_batch`. Default is None.
+
+        Returns
+        -------
+        dict
+            A dictionary containing the instructions generated from the stitched transcription.
 
-        return instr_json
\ No newline at end of file
+        Raises
+        ------
+        Exception
+            If any part failed to transcribe, once the other parts are done.
+        """
+        parts = list(parts)
+        if not parts:
+            raise Exception("Error: A multi-part recording needs at least one part")
+        os.makedirs(temp_dir, exist_ok=True)
+
+        with _logging_enabled(enable_logging), tracing.start_trace(
+            "generate_procedure_parts", self.trace_exporter, uid=uid, parts=len(parts)
+        ) as trace:
+            manifest = None
+            if resume:
+                # the parts are not part of the fingerprint, so that appending a part keeps the earlier ones
+                manifest = self._run_manifest(
+                    f"{uid}.parts",
+                    temp_dir,
+                    None,
+                    content_hash=f"parts:{uid}",
+                    mode="batch",
+                    streaming=False,
+                    vad=False,
+                )
+
+            # index -> (duration, transcript relative to the part, content hash)
+            results = {}
+            pending = []
+            for index, part in enumerate(parts):
+                record = manifest.segments.get(index, {}) if manifest is not None else {}
+                if self._part_unchanged(part, record):
+                    results[index] = (record["duration"], manifest.segment_transcript(index), record["content"])
+                else:
+                    pending.append((index, part))
+            if results:
+                logger.info(f"Reusing {len(results)} part(s) already transcribed, processing {len(pending)}")
+
+            def process(index: int, part: str):
+                try:
+                    duration, transcript, content_hash = self._transcribe_part(
+                        uid, index, part, temp_dir, fetch, cwd, stt_max_workers, resume
+                    )
+                except Exception as e:
+                    logger.critical(f"ERROR: Part {index} ({part}): {e}")
+                    if manifest is not None:
+                        manifest.set_segment(index, FAILED, part=part, error=str(e))
+                    raise
+                results[index] = (duration, transcript, content_hash)
+                if manifest is not None:
+                    manifest.set_segment(
+                        index, DONE, part=part, content=content_hash, duration=duration, transcript=transcript
+                    )
+
+            with ThreadPoolExecutor(max_workers=max(1, part_workers), thread_name_prefix="autolab-part") as executor:
+                futures = [executor.submit(tracing.propagate(process), index, part) for index, part in pending]
+            failed = [index for (index, _), future in zip(pending, futures) if future.exception() is not None]
+            if failed:
+                raise Exception(
+                    "Error: {} part(s) failed to transcribe: {}. Rerun with the same uid to retry them".format(
+                        len(failed), failed
+                    )
+                )
+
+            # the stitched transcript and the procedure change with any part
+            content_hash = ResultCache.make_key("parts", uid, parts=[results[index][2] for index in range(len(parts))])
+            if manifest is not None and manifest.stage("stitch").get("content") != content_hash:
+                manifest.set_stage("instructions", PENDING)
+                manifest.set_stage("stitch", DONE, content=content_hash, parts=len(parts))
+
+            def stitch(store: TranscriptStore):
+                offset = 0.0
+                for index in range(len(parts)):
+                    duration, transcript, _ = results[index]
+                    store.extend(
+                        (text, round(start + offset, 3), round(end + offset, 3)) for text, start, end in transcript
+                    )
+                    offset += duration
+
+            cache_keys = self._cache_keys(None, content_hash=content_hash, mode="parts")
+            instr_json = self._run_cached(uid, temp_dir, cache_keys, stitch, manifest=manifest, on_event=on_event)
+        return self._attach_timings(instr_json, trace, timings)
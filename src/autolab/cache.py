@@ -0,0 +1,246 @@
+"""
+cache.py
+
+This module provides a content-addressed cache for the results of the Autolab pipeline,
+so re-uploaded videos and retried requests do not pay for ffmpeg, Google STT and OpenAI again.
+
+Created: 10/18/2026
+
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+# bump when the format of cached values changes so stale entries are never read back
+# 2: empty transcripts are only cached when voice activity detection found no speech
+# 3: procedures reused from the index are retimed to the transcript
+CACHE_VERSION = 3
+
+# response headers naming the version of a remote object, most specific first
+VERSION_HEADERS = ("x-amz-version-id", "ETag")
+
+
+class CacheStore:
+    """Interface for the storage backend of a ResultCache.
+
+    Backends store opaque bytes under string keys. A backend may drop entries at any
+    time (eviction), so a get after a put is allowed to miss.
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def put(self, key: str, value: bytes):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class LocalDirectoryStore(CacheStore):
+    """Stores cache entries as files in a local directory, evicting the least recently used entries
+    once the directory grows past max_bytes."""
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        """Constructor - indexes entries already present in directory
+
+        Args:
+            directory (str): directory holding the cache entries (created if missing)
+            max_bytes (int): total size of the entries kept before evicting
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        # key -> size, least recently used first
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        existing = []
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            if filename.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            existing.append((stat.st_mtime, filename, stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            try:
+                with open(self._path(key), "rb") as fd:
+                    value = fd.read()
+                # mtime doubles as the recency used to rebuild the LRU order on restart
+                os.utime(self._path(key))
+            except FileNotFoundError:
+                self._total_bytes -= self._entries.pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes):
+        with self._lock:
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "wb") as fd:
+                fd.write(value)
+            os.replace(tmp_path, self._path(key))
+
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(value)
+            self._total_bytes += len(value)
+            self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        """Removes least recently used entries until the store fits in max_bytes (lock must be held)"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+
+class ResultCache:
+    """Caches transcripts and generated instructions keyed by the content of the input and the
+    settings used to produce them."""
+
+    def __init__(self, store: CacheStore):
+        """Constructor
+
+        Args:
+            store (CacheStore): backend the cached results are kept in
+        """
+        self.store = store
+
+    @staticmethod
+    def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+        """
+            Hashes the content of a file without loading it into memory at once
+
+        Args:
+            path       (str): file to hash
+            chunk_size (int): number of bytes read at a time
+
+        Return:
+            digest (str): sha256 hex digest of the file content
+
+        """
+        with open(path, "rb") as fd:
+            return ResultCache._hash_stream(fd, chunk_size)
+
+    @staticmethod
+    def hash_url(url: str, timeout: float = 30, chunk_size: int = 1024 * 1024) -> str:
+        """
+            Hashes a remote input by the version of the storage object behind the URL. Only the first byte of the
+            object is requested: its version id or ETag changes whenever the object is replaced, and does not
+            depend on the query string, so signed URLs of the same object (which carry a new token on every
+            request) share a key. Servers that send neither are hashed by content, streaming the whole object.
+
+        Args:
+            url        (str): http(s) URL of the input
+            timeout    (float): seconds to wait for the server
+            chunk_size (int): number of bytes read at a time when hashing the content
+
+        Return:
+            digest (str): sha256 hex digest of the location and version of the object, or of its content
+
+        """
+        location = urlparse(url)._replace(query="", fragment="").geturl()
+        with urlopen(Request(url, headers={"Range": "bytes=0-0"}), timeout=timeout) as response:
+            for header in VERSION_HEADERS:
+                version = response.headers.get(header)
+                if version:
+                    return hashlib.sha256(f"url:{location}:{header}:{version}".encode()).hexdigest()
+            if response.status != 206:
+                # the server ignored the range, the response already is the whole object
+                return ResultCache._hash_stream(response, chunk_size)
+        with urlopen(url, timeout=timeout) as response:
+            return ResultCache._hash_stream(response, chunk_size)
+
+    @staticmethod
+    def _hash_stream(stream, chunk_size: int) -> str:
+        """Returns the sha256 hex digest of everything left in a binary stream, read chunk_size bytes at a time"""
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(stage: str, content_hash: str, **settings) -> str:
+        """
+            Builds the cache key of a stage result
+
+        Args:
+            stage        (str): name of the cached stage, e.g. "transcript" or "instructions"
+            content_hash (str): hash of the input video or audio
+            settings     (dict): every setting that changes the result of the stage (must be JSON serializable)
+
+        Return:
+            key (str): sha256 hex digest identifying the result
+
+        """
+        payload = json.dumps(
+            {
+                "version": CACHE_VERSION,
+                "stage": stage,
+                "content": content_hash,
+                "settings": settings,
+            },
+            sort_keys=True,
+        )
+        return f"{stage}-{hashlib.sha256(payload.encode()).hexdigest()}"
+
+    def _get_json(self, key: str):
+        value = self.store.get(key)
+        if value is None:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            # a corrupted entry is a miss, not an error
+            self.store.delete(key)
+            return None
+
+    def _put_json(self, key: str, value):
+        self.store.put(key, json.dumps(value).encode())
+
+    def get_transcript(self, key: str) -> Optional[List[Tuple[str, float, float]]]:
+        """Returns the cached output of SpeechToText.get_transcript_list_and_times, or None on a miss"""
+        transcript = self._get_json(key)
+        if transcript is None:
+            return None
+        return [(text, start, end) for text, start, end in transcript]
+
+    def put_transcript(self, key: str, transcript: Iterable[Tuple[str, float, float]]):
+        """Caches (text, start, end) segments, e.g. a list or a TranscriptStore"""
+        self._put_json(key, list(transcript))
+
+    def get_instructions(self, key: str) -> Optional[dict]:
+        """Returns the cached output of TranscriptConversion.generateInstructions, or None on a miss"""
+        return self._get_json(key)
+
+    def put_instructions(self, key: str, instructions: dict):
+        self._put_json(key, instructions)
@@ -0,0 +1,193 @@
+"""
+compaction.py
+
+This module contains the compaction stage run on a transcript before it is sent to GPT. Short adjacent
+segments are merged, timestamps are quantized, disfluencies are stripped and repeated utterances are dropped,
+which cuts the prompt tokens (and the latency) of generateInstructions. Every compacted line keeps the indices
+of the original segments it was built from, so the times of a generated step can be traced back to them.
+
+Created: 10/18/2026
+
+"""
+import json
+import math
+import re
+from typing import Iterable, Iterator, List, NamedTuple, Tuple
+
+from .transcript_store import format_segment
+
+# hesitations of speech that carry no content, as transcribed by the recognizers ("mm" is left alone, it is a unit)
+FILLERS = re.compile(r"(?<![\w'-])(?:u+m+|u+h+m*|e+r+m*|a+h+|h+m+|m+h+m+)(?![\w'-])[,.]?\s*", re.IGNORECASE)
+SPACES = re.compile(r"\s+")
+
+
+class CompactionSettings(NamedTuple):
+    """Settings of compact_transcript, part of the instructions cache key"""
+
+    # segments shorter than this are merged with their neighbours
+    min_seconds: float = 8.0
+    # merged lines do not grow longer than this
+    max_seconds: float = 30.0
+    # segments further apart than this are never merged
+    max_gap: float = 2.0
+    # resolution of the timestamps sent to GPT
+    time_step: float = 1.0
+    strip_fillers: bool = True
+    drop_repeats: bool = True
+
+
+def strip_fillers(text: str) -> str:
+    """Removes filler words (um, uh, erm, hmm...) from an utterance"""
+    text = SPACES.sub(" ", FILLERS.sub("", text)).strip()
+    # a filler that opened the utterance can leave its punctuation behind
+    return text.lstrip(",. ")
+
+
+def quantize(seconds: float, time_step: float, up: bool = False):
+    """Rounds a time down (or up) to a multiple of time_step, as an int when the step is a whole second"""
+    steps = math.ceil(round(seconds / time_step, 6)) if up else math.floor(round(seconds / time_step, 6))
+    value = steps * time_step
+    return int(value) if float(time_step).is_integer() else round(value, 6)
+
+
+class CompactTranscript:
+    """A compacted transcript and the original segments each of its lines was built from"""
+
+    def __init__(self, settings: CompactionSettings):
+        self.settings = settings
+        # (text, start, end) of each line, with quantized times
+        self.segments: List[Tuple[str, float, float]] = []
+        # indices of the original segments of each line. Every original segment belongs to exactly one line,
+        # unless the whole transcript was fillers
+        self.sources: List[Tuple[int, ...]] = []
+        self.tokens_before = None
+        self.tokens_after = None
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def lines(self) -> Iterator[str]:
+        """Yields the formatted lines sent to GPT"""
+        for text, start, end in self.segments:
+            yield format_segment(text, start, end)
+
+    def source_segments(self, start: float, end: float) -> List[int]:
+        """
+            Traces a time range of the compacted transcript (e.g. the times of a generated step) back to the
+            original segments
+
+        Args:
+            start (float): start of the range in seconds
+            end   (float): end of the range in seconds
+
+        Return:
+            indices (List[int]): indices of the original segments of every line overlapping the range, in order
+        """
+        indices = []
+        for (_, line_start, line_end), sources in zip(self.segments, self.sources):
+            if line_start <= end and line_end >= start:
+                indices.extend(sources)
+        return indices
+
+    def to_dict(self) -> dict:
+        """Returns the lines, their sources and token counts as JSON serializable data"""
+        return {
+            "settings": self.settings._asdict(),
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "lines": [
+                {"text": text, "start": start, "end": end, "sources": list(sources)}
+                for (text, start, end), sources in zip(self.segments, self.sources)
+            ],
+        }
+
+    def save(self, path: str):
+        """Writes to_dict() to a JSON file"""
+        with open(path, "w") as fd:
+            json.dump(self.to_dict(), fd)
+
+
+def count_tokens(lines: Iterable[str], encoding) -> int:
+    """Counts the tokens of transcript lines as they are sent to GPT"""
+    return sum(len(encoding.encode(line)) for line in lines)
+
+
+def compact_transcript(
+    segments: Iterable[Tuple[str, float, float]], encoding=None, settings: CompactionSettings = None
+) -> CompactTranscript:
+    """
+        Compacts a transcript before it is sent to GPT
+
+    Args:
+        segments (Iterable[Tuple[str, float, float]]): (text, start, end) of each original segment, in order
+                                                       (e.g. a TranscriptStore)
+        encoding (tiktoken.Encoding, optional): encoder the tokens before and after compaction are counted with
+        settings (CompactionSettings, optional): defaults to CompactionSettings()
+
+    Return:
+        compacted (CompactTranscript): the compacted lines and the original segments of each one
+    """
+    settings = settings or CompactionSettings()
+    compacted = CompactTranscript(settings)
+    tokens_before = 0
+
+    # the line being built: its texts, exact times and sources
+    texts, start, end, sources = [], None, None, []
+    # segments with nothing left to say, attached to the next line when there is no line before them
+    pending = []
+
+    def close():
+        if texts:
+            compacted.segments.append(
+                (
+                    " ".join(texts),
+                    quantize(start, settings.time_step),
+                    quantize(end, settings.time_step, up=True),
+                )
+            )
+            compacted.sources.append(tuple(sources))
+
+    for index, (text, segment_start, segment_end) in enumerate(segments):
+        if encoding is not None:
+            tokens_before += len(encoding.encode(format_segment(text, segment_start, segment_end)))
+        cleaned = strip_fillers(text) if settings.strip_fillers else text.strip()
+
+        # an utterance said again right after itself (or transcribed twice across a segment boundary)
+        repeat = (
+            settings.drop_repeats
+            and texts
+            and cleaned.lower() == texts[-1].lower()
+            and segment_start - end <= settings.max_gap
+        )
+        if not cleaned or repeat:
+            # dropped, but it still belongs to the line it is folded into
+            if repeat:
+                sources.append(index)
+                end = max(end, segment_end)
+            elif texts:
+                sources.append(index)
+            else:
+                pending.append(index)
+            continue
+
+        mergeable = (
+            texts
+            and segment_start - end <= settings.max_gap
+            and segment_end - start <= settings.max_seconds
+            and (end - start < settings.min_seconds or segment_end - segment_start < settings.min_seconds)
+        )
+        if mergeable:
+            texts.append(cleaned)
+            sources.append(index)
+            end = max(end, segment_end)
+            continue
+
+        close()
+        texts, start, end, sources = [cleaned], segment_start, segment_end, pending + [index]
+        pending = []
+    close()
+
+    if encoding is not None:
+        compacted.tokens_before = tokens_before
+        compacted.tokens_after = count_tokens(compacted.lines(), encoding)
+    return compacted
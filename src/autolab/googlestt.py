@@ -7,23 +7,116 @@ to extract a transcript from video
 Created: 07/07/2023
 
 """
-from google.cloud import speech_v2
-from typing import List, Tuple
+from typing import TYPE_CHECKING, List, Tuple
+from urllib.parse import urlparse
+import io
+import logging
+import threading
+import time
+import wave
 import dotenv
 
+from .ratelimit import get_scheduler
+from .stt_engine import SpeechEngine
 
-class SpeechToText:
+if TYPE_CHECKING:
+    from google.cloud import speech_v2
+
+# google-cloud-speech is imported lazily and its client (and gRPC channel) is shared by every
+# SpeechToText instance, so warm Lambda invocations skip both the import and the channel setup
+_client = None
+_client_lock = threading.Lock()
+
+# longest audio a synchronous recognize request accepts, charged for requests of unknown duration
+MAX_SYNC_AUDIO_SECONDS = 60
+
+
+def audio_seconds(content: bytes) -> float:
+    """Returns the duration of WAV audio, or MAX_SYNC_AUDIO_SECONDS for other encodings"""
+    if content[:4] == b"RIFF":
+        try:
+            with wave.open(io.BytesIO(content)) as audio:
+                return audio.getnframes() / audio.getframerate()
+        except (wave.Error, EOFError):
+            pass
+    return MAX_SYNC_AUDIO_SECONDS
+
+
+def get_speech_client():
+    """Returns the process wide speech_v2.SpeechClient, creating it on first use.
+    When a replay cassette is active (see replay.py) the client records or replays its calls."""
+    from .replay import RECORD, ReplaySpeechClient, active_cassette
+
+    cassette = active_cassette()
+    if cassette is not None:
+        return cassette.wrap(
+            "speech",
+            lambda: ReplaySpeechClient(cassette, _create_client() if cassette.mode == RECORD else None),
+        )
+    return _create_client()
+
+
+def _create_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google.cloud import speech_v2
+
+                _client = speech_v2.SpeechClient()
+    return _client
+
+
+def upload_to_gcs(path: str, bucket: str, blob_name: str) -> str:
+    """
+        Uploads a local audio file to Cloud Storage so that BatchRecognize can read it
+
+    Args:
+        path      (str): local audio file
+        bucket    (str): Cloud Storage bucket, readable by the Speech service agent
+        blob_name (str): name of the uploaded object
+
+    Return:
+        uri (str): gs:// URI of the uploaded object
+    """
+    from google.cloud import storage
+
+    blob = storage.Client().bucket(bucket).blob(blob_name)
+    get_scheduler("storage").call(lambda: blob.upload_from_filename(path))
+    return f"gs://{bucket}/{blob_name}"
+
+
+def delete_from_gcs(uri: str):
+    """Deletes the Cloud Storage object at a gs:// URI"""
+    from google.cloud import storage
+
+    location = urlparse(uri)
+    blob = storage.Client().bucket(location.netloc).blob(location.path.lstrip("/"))
+    get_scheduler("storage").call(blob.delete)
+
+
+class SpeechToText(SpeechEngine):
     """Class that handles API calls to Google Speech."""
 
-    def __init__(self, project_id, recognizer_id):
+    name = "google"
+
+    # encodings the recognizer detects with AutoDetectDecodingConfig (AAC/M4A is not one of them)
+    SUPPORTED_ENCODINGS = frozenset(
+        ("linear16", "mulaw", "alaw", "amr", "amr_wb", "flac", "mp3", "ogg_opus", "webm_opus")
+    )
+
+    def __init__(self, project_id, recognizer_id, client=None):
         """Constructor - Sets up Google client and configuration.
 
         Args:
             project_id (_type_): Google Project ID
             recognizer_id (_type_): Speech Recognizer to be used (must run create_recognizer if it does not already)
+            client (speech_v2.SpeechClient, optional): client to send requests with. Defaults to the shared client
         """
+        from google.cloud import speech_v2
+
         dotenv.load_dotenv()
-        self.__client = speech_v2.SpeechClient()
+        self.__client = client or get_speech_client()
         self.project_id = project_id
         self.recognizer_id = recognizer_id
         self.__config = speech_v2.RecognitionConfig(
@@ -33,32 +126,131 @@ class SpeechToText:
     def speech_to_text(
         self,
         content: bytes = 0,
-    ) -> speech_v2.RecognizeResponse:
-        """Calls the STT Recognizer model on [content] and returns response
+        duration: float = None,
+    ) -> "speech_v2.RecognizeResponse":
+        """Calls the STT Recognizer model on [content] and returns response. The request goes through the "speech"
+        scheduler (see ratelimit.py), which keeps it under the quotas and retries it on quota errors.
 
         Args:
             content (bytes, optional): Encoded audio to be transcribed (should auto detect transcoding, but preferably use FLAC). Defaults to 0.
+            duration (float, optional): seconds of audio in content, charged to the audio quota. Defaults to the
+                                        duration of WAV content, or the longest duration of a synchronous request
 
         Returns:
             speech_v2.RecognizeResponse: Returns response containing result from the model (the transcription and other metadata)
         """
 
+        from google.cloud import speech_v2
+
         request = speech_v2.RecognizeRequest(
-            recognizer=f"projects/{self.project_id}/locations/global/recognizers/{self.recognizer_id}",
+            recognizer=self._recognizer_name(),
             content=content,
             config=self.__config,
         )
-        response = self.__client.recognize(request=request)
+        if duration is None:
+            duration = audio_seconds(content)
+        response = get_scheduler("speech").call(
+            lambda: self.__client.recognize(request=request), audio_seconds=duration
+        )
 
         return response
 
-    def create_recognizer(self) -> speech_v2.RecognizeResponse:
+    def transcribe(self, content: bytes, duration: float = None) -> List[Tuple[str, float, float]]:
+        """Transcribes encoded audio with one synchronous request (see SpeechEngine.transcribe)"""
+        return self.get_transcript_list_and_times(self.speech_to_text(content, duration))
+
+    def _recognizer_name(self) -> str:
+        return f"projects/{self.project_id}/locations/global/recognizers/{self.recognizer_id}"
+
+    def batch_recognize(
+        self,
+        audio_uri: str,
+        output_uri: str = None,
+        dynamic_batching: bool = False,
+        duration: float = None,
+        timeout: float = 3600.0,
+        poll_initial: float = 1.0,
+        poll_max: float = 30.0,
+        poll_multiplier: float = 1.5,
+    ) -> "speech_v2.BatchRecognizeResults":
+        """Transcribes a whole recording in one BatchRecognize long-running operation instead of 60 second
+        synchronous requests, polling the operation with exponential backoff.
+
+        Args:
+            audio_uri (str): gs:// URI of the encoded audio (see upload_to_gcs)
+            output_uri (str, optional): gs:// prefix the results are written to. Defaults to returning them
+                                        inline in the operation
+            dynamic_batching (bool, optional): let Google schedule the request in a batch, which is cheaper but
+                                               may take hours to complete. Defaults to False
+            duration (float, optional): seconds of audio in the recording, charged to the audio quota. Defaults to
+                                        charging the request only
+            timeout (float, optional): seconds to wait for the operation before giving up. Defaults to an hour
+            poll_initial (float, optional): seconds before the first poll. Defaults to 1
+            poll_max (float, optional): maximum seconds between polls. Defaults to 30
+            poll_multiplier (float, optional): growth of the delay between polls. Defaults to 1.5
+
+        Returns:
+            speech_v2.BatchRecognizeResults: results of the recording, with the same `results` field as a
+                                             RecognizeResponse so get_transcript_list_and_times accepts it
+
+        Throws:
+            Exception if the operation fails, times out or the recording could not be transcribed
+        """
+        from google.cloud import speech_v2
+
+        if output_uri is None:
+            output_config = speech_v2.RecognitionOutputConfig(inline_response_config=speech_v2.InlineOutputConfig())
+        else:
+            output_config = speech_v2.RecognitionOutputConfig(
+                gcs_output_config=speech_v2.GcsOutputConfig(uri=output_uri)
+            )
+        strategy = speech_v2.BatchRecognizeRequest.ProcessingStrategy
+        request = speech_v2.BatchRecognizeRequest(
+            recognizer=self._recognizer_name(),
+            config=self.__config,
+            files=[speech_v2.BatchRecognizeFileMetadata(uri=audio_uri)],
+            recognition_output_config=output_config,
+            processing_strategy=strategy.DYNAMIC_BATCHING if dynamic_batching else strategy.PROCESSING_STRATEGY_UNSPECIFIED,
+        )
+        cost = {"audio_seconds": duration} if duration is not None else {}
+        operation = get_scheduler("speech").call(lambda: self.__client.batch_recognize(request=request), **cost)
+        logging.getLogger(__name__).info(f"Submitted BatchRecognize operation {operation.operation.name}")
+
+        deadline = time.monotonic() + timeout
+        delay = poll_initial
+        while not operation.done():
+            if time.monotonic() + delay > deadline:
+                raise Exception(
+                    "Error: BatchRecognize operation {} did not finish in {}s".format(operation.operation.name, timeout)
+                )
+            time.sleep(delay)
+            delay = min(delay * poll_multiplier, poll_max)
+
+        file_result = operation.result().results[audio_uri]
+        if file_result.error.code:
+            raise Exception("Error: BatchRecognize failed for {}: {}".format(audio_uri, file_result.error.message))
+        if output_uri is None:
+            return file_result.transcript
+        return self._read_gcs_results(file_result.uri)
+
+    def _read_gcs_results(self, uri: str) -> "speech_v2.BatchRecognizeResults":
+        """Downloads the results BatchRecognize wrote to Cloud Storage"""
+        from google.cloud import speech_v2, storage
+
+        location = urlparse(uri)
+        blob = storage.Client().bucket(location.netloc).blob(location.path.lstrip("/"))
+        content = get_scheduler("storage").call(blob.download_as_text)
+        return speech_v2.BatchRecognizeResults.from_json(content, ignore_unknown_fields=True)
+
+    def create_recognizer(self) -> "speech_v2.RecognizeResponse":
         """You must call this function if the recognizer does not exist.
 
         Throws:
             Error if a recognizer already exists with that id.
         """
 
+        from google.cloud import speech_v2
+
         # Initialize request arguments
         request = speech_v2.CreateRecognizerRequest(
             parent=f"projects/{self.project_id}/locations/global",
@@ -74,7 +266,7 @@ class SpeechToText:
         operation = self.__client.create_recognizer(request=request)
         print("Waiting on create_recognizer operation...")
 
-    def concatenate_transcripts(self, response: speech_v2.RecognizeResponse) -> str:
+    def concatenate_transcripts(self, response: "speech_v2.RecognizeResponse") -> str:
         """
         Concatenates the transcripts from each result in a speech_v2.RecognizeResponse.
 
@@ -90,7 +282,7 @@ class SpeechToText:
         return "".join(transcripts)
 
     def get_transcript_list_and_times(
-        self, response: speech_v2.RecognizeResponse
+        self, response: "speech_v2.RecognizeResponse"
     ) -> List[Tuple[str, float, float]]:
         """
         Returns a list of triples containing the transcript, start time, and end time for each result in a speech_v2.RecognizeResponse.
@@ -8,59 +8,415 @@ Created: 07/06/2023
 
 """
 
-import openai
-import tiktoken
+import functools
 import json
+import logging
+import time
+from . import tracing
+from .ratelimit import get_scheduler
+from .procedure_json import (
+    PROCEDURE_SCHEMA,
+    STEP_SCHEMA,
+    IncrementalProcedureParser,
+    expand_draft,
+    expand_draft_step,
+    invalid_steps,
+    parse_procedure,
+    validate_procedure,
+)
+from .similarity import retime
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
+GPT_PROMPT = """The following is a timestamped transcript of a lab. Edit it into a clean and concise procedure instruction that would appear in a lab report. Return it as a JSON object with the fields {"Summary":, "Procedure": {"step", "start_time", "end_time"}}. Each step is its own object, can be more than one step per timestamp. Transcript: """
+REPAIR_PROMPT = """The following JSON is invalid or does not match this JSON schema: {schema}. Fix it with as few changes as possible and return only the fixed JSON."""
+DRAFT_PROMPT = """The following is a timestamped transcript of a lab, after the numbered procedure of another recording of the same lab protocol. Edit the draft into a clean and concise procedure instruction of this transcript that would appear in a lab report. Return it as a JSON object with the fields {"Summary":, "Procedure": {"step", "start_time", "end_time"}}. For a step that is the same as a draft step, return {"draft": <number of the draft step>, "start_time", "end_time"} instead of its text. Leave out draft steps that did not happen and add the steps that are missing."""
+MERGE_PROMPT = """The following are summaries of consecutive parts of the same lab. Combine them into one concise summary of the lab's goals. Return only the summary text."""
+
+# function the structured outputs are returned through, constrained to PROCEDURE_SCHEMA
+PROCEDURE_FUNCTION = {
+    "name": "record_procedure",
+    "description": "Records the lab procedure edited from the transcript",
+    "parameters": PROCEDURE_SCHEMA,
+}
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model, encoding="cl100k_base"):
+    """
+    Returns the tiktoken encoder of a model, loaded once per process.
+    tiktoken is imported lazily and reads its BPE files from TIKTOKEN_CACHE_DIR when set
+    (the Lambda build bundles them) instead of downloading them.
+
+        Args:
+            model    (string): OpenAI model the encoder is looked up for
+            encoding (string): tiktoken encoder base used if the model is unknown
+
+        Return:
+            encoding (tiktoken.Encoding): the encoder
+    """
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(encoding)
+
+
+def format_result(json_instr):
+    """
+    Adds our metadata to a generated procedure
+
+        Args:
+            json_instr (dict): JSON object with fields {"Summary":, "Procedure": [...]}
+
+        Return:
+            instr_set (json): formatted JSON object with fields {"metadata":, "summary":, "procedure":}
+    """
+    metadata = {
+        "version": "Autolab v1.1.0-alpha",
+        "author": "Altum Labs",
+        "date-generated": date.today().strftime("%Y-%m-%d"),
+        "description": "These generated results are a product of Autolab by Altum Labs. It contains private data and is not for distribution. Unauthorized use of this data for any other purposes is strictly prohibited. ",
+    }
+
+    result = {
+        "metadata": metadata,
+        "summary": json_instr["Summary"],
+        "procedure": json_instr["Procedure"],
+    }
+    return result
+
+
 class TranscriptConversion:
     """Class to convert transcription into lab instructions"""
 
-    def __init__(self, model, secret_key):
+    def __init__(
+        self, model, secret_key, structured_output=False, index=None, reuse_threshold=0.9, draft_threshold=0.6
+    ):
         """Constructor - sets up OpenAI API's settings
 
         Args:
-            model      (_type_): OpenAI model type used for conversion
-            secret_key (_type_): API keys
+            model             (_type_): OpenAI model type used for conversion
+            secret_key        (_type_): API keys
+            structured_output (bool): request the procedure through function calling constrained by
+                                      PROCEDURE_SCHEMA and repair invalid outputs instead of regenerating them
+            index             (similarity.ProcedureIndex, optional): procedures of previous transcripts. The
+                                      procedure of a near-duplicate transcript is returned without calling GPT,
+                                      or sent as a draft to edit, and every generated procedure is added to it
+            reuse_threshold   (float): similarity above which the procedure of a match is returned without calling
+                                      GPT, with its steps moved to the times of the transcript
+            draft_threshold   (float): similarity above which the procedure of a match is sent as a draft. Steps
+                                      kept from the draft are returned as references, which cuts completion tokens
         """
         self.secret_key = secret_key
         self.model = model
+        self.structured_output = structured_output
+        self.index = index
+        self.reuse_threshold = reuse_threshold
+        self.draft_threshold = draft_threshold
+        # closest match of the last transcript in the index, if any
+        self.match = None
         self.instr_set = None
         self.transcript = None
+        # number of full regenerations replaced by a local or fragment-only repair
+        self.regenerations_avoided = 0
+        # number of full regenerations after an invalid output
+        self.regenerations = 0
 
-        self.gpt_prompt = """The following is a timestamped transcript of a lab. Edit it into a clean and concise procedure instruction that would appear in a lab report. Return it as a JSON object with the fields {"Summary":, "Procedure": {"step", "start_time", "end_time"}}. Each step is its own object, can be more than one step per timestamp. Transcript: """
+        self.gpt_prompt = GPT_PROMPT
         # self.gpt_prompt = """The following is a timestamped transcript of a lab. Edit it into a clean and concise procedure instruction that would appear in a lab report. Include "Summary" concisely stating the lab's goals, separate with "Procedure", start with "-" for each step, and indicate which timestamp the step was from in "()". Transcript: """
 
         try:
-            self.encoding = tiktoken.get_encoding("cl100k_base")
-            self.encoding = tiktoken.encoding_for_model(model)
+            self.encoding = get_encoding(model)
         except Exception as e:
-            print("Error: Model or specified transcript location is invalid")
+            logger.error("Error: Model or specified transcript location is invalid")
 
-    def generateInstructions(self, transcript_path, encoding="cl100k_base"):
+    def _prompt_tokens(self, messages):
+        """Estimates the prompt tokens of a request, charged to the token quota before it is sent"""
+        text = "".join(message.get("content") or "" for message in messages)
+        encoding = getattr(self, "encoding", None)
+        # about 4 characters per token when the encoder is not available
+        return len(encoding.encode(text)) if encoding is not None else len(text) // 4
+
+    def _chat(self, messages, model="gpt-3.5-turbo", **kwargs):
         """
-        Generates Instruction set by applying the model on the
-        transcript.
-        Will keep generating until a valid JSON is returned or reach a max limit of 5 re-generations.
+        Sends a single chat completion request
 
             Args:
-                transcript_path      (_type_): location of transcript
-                encoding - optional (string): tiktoken encoder base
+                messages (list): chat messages sent to the model
+                model    (string): OpenAI model used for the completion
+                kwargs   (dict): extra arguments of the request (e.g. functions)
 
             Return:
-                instr_set      (json): formatted JSON object with fields {"Summary":, "Procedure": [{"Step", "Start_Time", "End_Time"}]}
+                raw_output (openai.ChatCompletion): response of the API
         """
+        from .replay import active_cassette, encode_chat_completion
 
-        # read in transcript txt file
-        with open(transcript_path, "r") as file:
-            self.transcript = file.read()
+        request = dict(
+            model=model,
+            messages=messages,
+            temperature=0.2,  # in range (0,2), higher = more creative
+            # chatcompletion doesn't need max_tokens parameter
+            **kwargs,
+        )
 
-        openai.api_key = self.secret_key
-        # count tokens to figure out a good max_tokens value
-        encoding = tiktoken.get_encoding(encoding)
-        encoding = tiktoken.encoding_for_model(self.model)
+        def send():
+            import openai
+
+            openai.api_key = self.secret_key
+            return openai.ChatCompletion.create(**request)
+
+        # record or replay the request when a replay cassette is active (see replay.py)
+        cassette = active_cassette()
+        if cassette is not None:
+            call = lambda: cassette.call("openai", "chat_completion", request, send, encode=encode_chat_completion)
+        else:
+            call = send
+
+        # the request waits for its share of the quotas, and is retried on rate limit errors
+        scheduler = get_scheduler("openai")
+        with tracing.span("gpt_attempt", model=model) as span:
+            response = scheduler.call(call, tokens=self._prompt_tokens(messages))
+            usage = response.get("usage") or {}
+            scheduler.charge(tokens=usage.get("completion_tokens"))
+            span.set(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+        return response
+
+    def _chat_stream(self, messages, model="gpt-3.5-turbo", **kwargs):
+        """
+        Sends a chat completion request with stream=True and yields the output as it is generated
+
+            Args:
+                messages (list): chat messages sent to the model
+                model    (string): OpenAI model used for the completion
+                kwargs   (dict): extra arguments of the request (e.g. functions)
+
+            Yields:
+                (text, finish_reason) (Tuple[string, string]): text of each chunk (the content, or the arguments of
+                                                               a function call), and the finish reason of the
+                                                               last chunk (None before)
+        """
+        from .replay import active_cassette, encode_chat_completion
+
+        request = dict(model=model, messages=messages, temperature=0.2, stream=True, **kwargs)
+
+        def send():
+            import openai
+
+            openai.api_key = self.secret_key
+            return openai.ChatCompletion.create(**request)
+
+        start = time.perf_counter()
+        first_chunk = None
+        chunks = 0
+        cassette = active_cassette()
+        if cassette is not None:
+            # recorded as the list of chunks, so recording does not stream
+            call = lambda: cassette.call(
+                "openai",
+                "chat_completion_stream",
+                request,
+                lambda: [encode_chat_completion(chunk) for chunk in send()],
+            )
+        else:
+            call = send
+        # rate limit errors are raised when the stream is opened, not while it is read
+        scheduler = get_scheduler("openai")
+        stream = scheduler.call(call, tokens=self._prompt_tokens(messages))
+        try:
+            for chunk in stream:
+                choice = chunk.get("choices")[0]
+                delta = choice.get("delta") or {}
+                text = delta.get("content") or (delta.get("function_call") or {}).get("arguments") or ""
+                if first_chunk is None and text:
+                    first_chunk = time.perf_counter() - start
+                chunks += 1
+                yield text, choice.get("finish_reason")
+        finally:
+            # streamed chunks hold about one token each
+            scheduler.charge(tokens=chunks)
+            # spans cannot be open across yields, the attempt is recorded once the stream is consumed
+            tracing.add_span(
+                "gpt_attempt",
+                time.perf_counter() - start,
+                model=model,
+                streaming=True,
+                chunks=chunks,
+                first_chunk_s=first_chunk,
+            )
+
+    def _lookup(self, transcript):
+        """
+        Looks up the closest transcript of the index
+
+            Args:
+                transcript (string): the whole transcript
+
+            Return:
+                reused (dict): procedure to return without calling GPT, retimed to the transcript, or None
+                draft  (dict): procedure to send as a draft, or None
+                signature (array): MinHash signature of the transcript, reused when it is added to the index
+        """
+        if self.index is None:
+            return None, None, None
+        with tracing.span("procedure_index", stored=len(self.index)) as span:
+            signature = self.index.signature(transcript)
+            self.match = self.index.query(signature=signature, min_similarity=min(self.draft_threshold, 1.0))
+            similarity = self.match.similarity if self.match else 0.0
+            reused = None
+            if similarity >= self.reuse_threshold:
+                # the steps point at the times of the other recording. Without aligned lines, the match is a draft
+                reused = retime(self.match.procedure, self.match.transcript, transcript)
+            span.set(similarity=similarity, cache_hit=int(reused is not None))
+        if reused is not None:
+            return reused, None, signature
+        if self.match is not None and not self.structured_output:
+            # function calling is constrained to PROCEDURE_SCHEMA, which has no draft references
+            return None, self.match.procedure, signature
+        return None, None, signature
+
+    def _remember(self, transcript, json_instr, signature=None):
+        """Adds a generated procedure to the index, if any"""
+        if self.index is not None:
+            self.index.add(transcript, json_instr, signature)
+
+    def _messages(self, transcript, draft=None):
+        """Returns the chat messages of a generation request, with the draft procedure if any"""
+        if draft is None:
+            return [
+                {"role": "system", "content": self.gpt_prompt},
+                {"role": "user", "content": transcript},
+            ]
+        steps = [{"draft": i, "step": step["step"]} for i, step in enumerate(draft["Procedure"], 1)]
+        return [
+            {"role": "system", "content": DRAFT_PROMPT},
+            {"role": "user", "content": f"Draft: {json.dumps(steps)}\nTranscript: {transcript}"},
+        ]
+
+    def _repair_fragment(self, fragment, schema):
+        """
+        Asks the model to fix only a broken fragment of its previous output
+
+            Args:
+                fragment (string): invalid JSON text
+                schema   (dict): JSON schema the fixed fragment must match
+
+            Return:
+                fixed (dict|list): the parsed fragment, or None if the repair failed
+        """
+        msg = [
+            {"role": "system", "content": REPAIR_PROMPT.format(schema=json.dumps(schema))},
+            {"role": "user", "content": fragment},
+        ]
+        raw_output = self._chat(msg, model=self.model)
+        content = raw_output.get("choices")[0].get("message").get("content") or ""
+        starts = [i for i in (content.find("{"), content.find("[")) if i != -1]
+        if not starts:
+            return None
+        try:
+            # ignores any prose or markdown fence around the fixed JSON
+            return json.JSONDecoder().raw_decode(content[min(starts):])[0]
+        except ValueError:
+            return None
+
+    def _generate_structured(self, transcript):
+        """
+        Applies the model on a transcript through function calling constrained by PROCEDURE_SCHEMA.
+        Invalid outputs are repaired locally (unclosed brackets, trailing commas, key casing), then by a
+        repair-only request for the broken fragment, and only regenerated from the transcript as a last resort.
+
+            Args:
+                transcript (string): timestamped transcript, one segment per line
+
+            Return:
+                json_instr (dict): parsed JSON object with fields {"Summary":, "Procedure": [...]}, or an
+                                   error response with a "statusCode" if no valid JSON could be generated
+        """
+        maxCalls = 5
+        callCount = 0
+        while callCount < maxCalls:
+            msg = [
+                {"role": "system", "content": self.gpt_prompt},
+                {"role": "user", "content": transcript},
+            ]
+            raw_output = self._chat(
+                msg,
+                model=self.model,
+                functions=[PROCEDURE_FUNCTION],
+                function_call={"name": PROCEDURE_FUNCTION["name"]},
+            )
+            choice = raw_output.get("choices")[0]
+            message = choice.get("message")
+            function_call = message.get("function_call")
+            raw_instr = (function_call.get("arguments") if function_call else message.get("content")) or ""
+
+            # truncated outputs are closed locally, so "length" is recoverable here
+            stop_reason = choice.get("finish_reason")
+            if stop_reason not in ("stop", "function_call", "length"):
+                return {
+                    "statusCode": 500,
+                    "body": "GPT was stopped early because of "
+                    + stop_reason
+                    + ". Please try again.",
+                }
+
+            json_instr, invalid, repaired = parse_procedure(raw_instr)
+            if json_instr is None:
+                # the structure itself is broken, only the model output is sent back, not the transcript
+                fixed = self._repair_fragment(raw_instr, PROCEDURE_SCHEMA)
+                if fixed is not None:
+                    json_instr, invalid, _ = parse_procedure(json.dumps(fixed))
+                    repaired = True
+
+            if json_instr is not None and invalid:
+                # only the steps that are still invalid are sent back
+                broken = [json_instr["Procedure"][i] for i in invalid]
+                fixed = self._repair_fragment(
+                    json.dumps(broken), {"type": "array", "items": STEP_SCHEMA}
+                )
+                if isinstance(fixed, list) and len(fixed) == len(broken):
+                    for i, step in zip(invalid, fixed):
+                        json_instr["Procedure"][i] = step
+                    invalid = []
+                    repaired = True
+
+            if json_instr is not None and not invalid:
+                try:
+                    validate_procedure(json_instr)
+                    if repaired:
+                        self.regenerations_avoided += 1
+                    return json_instr
+                except Exception as e:
+                    logger.warning(f"Repaired JSON does not match the schema. {e}")
+
+            logger.warning("Cannot repair JSON. Trying again")
+            callCount += 1
+            self.regenerations += 1
+
+        return {
+            "statusCode": 500,
+            "body": f"GPT did not return valid JSON after {maxCalls} attempts. Please try again.",
+        }
+
+    def _generate_json(self, transcript, draft=None):
+        """
+        Applies the model on a transcript until a valid JSON is returned or reach a max limit of 5 re-generations.
+        Uses _generate_structured instead when structured_output is enabled.
+
+            Args:
+                transcript (string): timestamped transcript, one segment per line
+                draft      (dict, optional): procedure of a similar transcript, edited by the model
+
+            Return:
+                json_instr (dict): parsed JSON object with fields {"Summary":, "Procedure": [...]}, or an
+                                   error response with a "statusCode" if no valid JSON could be generated
+        """
+        if self.structured_output:
+            return self._generate_structured(transcript)
 
-        # Call GPT4
         raw_instr = None
         json_instr = None
 
@@ -68,27 +424,23 @@ class TranscriptConversion:
         maxCalls = 5
         callCount = 0
 
-        # TODO: discuss with team if we should limit to only 4000 tokens for the input and skip the summary when calls are split up.
         while not validJson and callCount < maxCalls:
-            msg = [
-                {"role": "system", "content": self.gpt_prompt},
-                {"role": "user", "content": self.transcript},
-            ]
-            raw_output = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=msg,
-                temperature=0.2,  # in range (0,2), higher = more creative
-                # chatcompletion doesn't need max_tokens parameter
-            )
+            msg = self._messages(transcript, draft)
+            raw_output = self._chat(msg, model=self.model)
             raw_instr = raw_output.get("choices")[0].get("message").get("content")
             try:  # check valid json with the appropriate fields
                 json_instr = json.loads(raw_instr)
                 json_instr["Summary"]
                 json_instr["Procedure"]
+                if draft is not None:
+                    # every reference must point to a step of the draft
+                    if invalid_steps(expand_draft(json_instr, draft)):
+                        raise Exception("Error: invalid reference to a draft step")
                 validJson = True
             except Exception as e:
-                print(f"Cannot parse JSON. {e} Trying again")
+                logger.warning(f"Cannot parse JSON. {e} Trying again")
                 callCount += 1
+                self.regenerations += 1
             stop_reason = raw_output.get("choices")[0].get("finish_reason")
             if stop_reason != "stop":
                 return {
@@ -97,17 +449,268 @@ class TranscriptConversion:
                     + stop_reason
                     + ". Please try again.",
                 }
-            
-        metadata = {
-            "version": "Autolab v1.1.0-alpha",
-            "author": "Altum Labs",
-            "date-generated": date.today().strftime("%Y-%m-%d"),
-            "description": "These generated results are a product of Autolab by Altum Labs. It contains private data and is not for distribution. Unauthorized use of this data for any other purposes is strictly prohibited. ",
-        }
 
-        result = {
-            "metadata": metadata,
-            "summary": json_instr["Summary"],
-            "procedure": json_instr["Procedure"],
-        }
-        return result
+        if not validJson:
+            return {
+                "statusCode": 500,
+                "body": f"GPT did not return valid JSON after {maxCalls} attempts. Please try again.",
+            }
+        return json_instr
+
+    def streamInstructions(self, transcript_path=None, transcript=None):
+        """
+        Generates the Instruction set like generateInstructions, but streams the completion and yields partial
+        results as soon as they are complete: the Summary once its string is closed and each Procedure step once
+        its object is closed. The whole transcript is sent in one request (no map-reduce).
+
+        If the completed output is not valid JSON even after a local repair, it is generated again (at most 5
+        times). Partial results of the failed attempt must then be discarded.
+
+            Args:
+                transcript_path - optional (string): location of transcript
+                transcript - optional (Iterable[string]): lines of the transcript, used instead of reading
+                                                          transcript_path
+
+            Yields:
+                event (dict): {"type": "summary", "summary"}, {"type": "step", "index", "step"},
+                              {"type": "retry", "attempt"} before a new attempt, then the last event:
+                              {"type": "result", "result": formatted instructions (see generateInstructions)}
+                              or {"type": "error", "result": error response with a "statusCode"}
+        """
+        if transcript is None:
+            with open(transcript_path, "r") as file:
+                transcript = file.read()
+        self.transcript = transcript if isinstance(transcript, str) else "".join(transcript)
+
+        reused, draft, signature = self._lookup(self.transcript)
+        if reused is not None:
+            yield {"type": "summary", "summary": reused["Summary"]}
+            for index, step in enumerate(reused["Procedure"]):
+                yield {"type": "step", "index": index, "step": step}
+            yield {"type": "result", "result": format_result(reused)}
+            return
+
+        kwargs = {}
+        if self.structured_output:
+            kwargs = {"functions": [PROCEDURE_FUNCTION], "function_call": {"name": PROCEDURE_FUNCTION["name"]}}
+
+        import jsonschema
+
+        # steps are only yielded once they are complete
+        step_validator = jsonschema.Draft7Validator(STEP_SCHEMA)
+        maxCalls = 5
+        start = time.perf_counter()
+        regenerations = self.regenerations
+        try:
+            for callCount in range(maxCalls):
+                if callCount:
+                    yield {"type": "retry", "attempt": callCount}
+                msg = self._messages(self.transcript, draft)
+                parser = IncrementalProcedureParser()
+                stop_reason = None
+                steps = 0
+                for text, stop_reason in self._chat_stream(msg, model=self.model, **kwargs):
+                    for kind, value in parser.feed(text):
+                        if kind == "summary":
+                            yield {"type": "summary", "summary": value}
+                            continue
+                        if draft is not None:
+                            value = expand_draft_step(value, draft)
+                        if step_validator.is_valid(value):
+                            yield {"type": "step", "index": steps, "step": value}
+                            steps += 1
+
+                if stop_reason not in ("stop", "function_call", "length"):
+                    yield {
+                        "type": "error",
+                        "result": {
+                            "statusCode": 500,
+                            "body": f"GPT was stopped early because of {stop_reason}. Please try again.",
+                        },
+                    }
+                    return
+
+                json_instr, invalid, repaired = parse_procedure(parser.text, draft)
+                if json_instr is not None and not invalid:
+                    try:
+                        validate_procedure(json_instr)
+                        if repaired:
+                            self.regenerations_avoided += 1
+                        self._remember(self.transcript, json_instr, signature)
+                        yield {"type": "result", "result": format_result(json_instr)}
+                        return
+                    except Exception as e:
+                        logger.warning(f"Repaired JSON does not match the schema. {e}")
+
+                logger.warning("Cannot parse JSON. Trying again")
+                self.regenerations += 1
+
+            yield {
+                "type": "error",
+                "result": {
+                    "statusCode": 500,
+                    "body": f"GPT did not return valid JSON after {maxCalls} attempts. Please try again.",
+                },
+            }
+        finally:
+            tracing.add_span(
+                "gpt_generate", time.perf_counter() - start, streaming=True, retries=self.regenerations - regenerations
+            )
+
+    def _split_transcript(self, transcript, window_tokens, encoding):
+        """
+        Splits a transcript on segment (line) boundaries into windows of at most window_tokens tokens.
+        A single segment longer than window_tokens is kept whole in its own window.
+
+            Args:
+                transcript    (string or Iterable[string]): timestamped transcript, one segment per line,
+                                                            or an iterable of its lines
+                window_tokens (int): token budget of each window
+                encoding      (tiktoken.Encoding): encoder used to count tokens
+
+            Return:
+                windows (List[string]): consecutive parts of the transcript, in order
+        """
+        if isinstance(transcript, str):
+            transcript = transcript.splitlines(keepends=True)
+
+        windows = []
+        window = []
+        window_size = 0
+        tokens = 0
+        with tracing.span("token_count") as span:
+            for line in transcript:
+                line_size = len(encoding.encode(line))
+                tokens += line_size
+                if window and window_size + line_size > window_tokens:
+                    windows.append("".join(window))
+                    window = []
+                    window_size = 0
+                window.append(line)
+                window_size += line_size
+            if window:
+                windows.append("".join(window))
+            span.set(tokens=tokens, windows=len(windows))
+        return windows
+
+    def _map_reduce(self, transcript, window_tokens, max_workers, encoding, merge_model):
+        """
+        Generates procedure steps for each token-budgeted window of the transcript in parallel,
+        then merges them into one Summary and a single ordered Procedure.
+
+            Args:
+                transcript    (string or Iterable[string]): timestamped transcript, one segment per line,
+                                                            or an iterable of its lines
+                window_tokens (int): token budget of each window
+                max_workers   (int): maximum number of windows generated concurrently
+                encoding      (tiktoken.Encoding): encoder used to count tokens
+                merge_model   (string): OpenAI model used for the summary merge pass
+
+            Return:
+                json_instr (dict): JSON object with fields {"Summary":, "Procedure": [...]}, or an
+                                   error response with a "statusCode" if any window failed
+        """
+        windows = self._split_transcript(transcript, window_tokens, encoding)
+        if len(windows) <= 1:
+            # the single window is the whole transcript
+            return self._generate_json(windows[0] if windows else "")
+
+        # map: windows are independent, results keep the order of the windows
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            partials = list(executor.map(tracing.propagate(self._generate_json), windows))
+
+        for partial in partials:
+            if "statusCode" in partial:
+                return partial
+
+        # reduce: windows are consecutive so the steps are already in order,
+        # only the per-window summaries need a (cheap) model call to be merged
+        procedure = []
+        for partial in partials:
+            procedure.extend(partial["Procedure"])
+
+        summaries = "\n".join(f"- {partial['Summary']}" for partial in partials)
+        msg = [
+            {"role": "system", "content": MERGE_PROMPT},
+            {"role": "user", "content": summaries},
+        ]
+        raw_output = self._chat(msg, model=merge_model)
+        summary = raw_output.get("choices")[0].get("message").get("content").strip()
+
+        return {"Summary": summary, "Procedure": procedure}
+
+    def generateInstructions(
+        self,
+        transcript_path=None,
+        encoding="cl100k_base",
+        map_reduce=False,
+        window_tokens=3000,
+        max_workers=4,
+        merge_model="gpt-3.5-turbo",
+        transcript=None,
+    ):
+        """
+        Generates Instruction set by applying the model on the
+        transcript.
+        Will keep generating until a valid JSON is returned or reach a max limit of 5 re-generations.
+
+        In map-reduce mode the transcript is split on segment boundaries into windows of at most
+        window_tokens tokens, each window is converted in parallel and the results are merged, so long
+        labs no longer overflow the context window and latency depends on the largest window.
+
+        With an index, the procedure of a near-duplicate transcript is returned without calling GPT, with the
+        times of this transcript (see similarity.retime), and
+        the procedure of a similar one is sent as a draft to edit (not in map-reduce mode).
+
+            Args:
+                transcript_path      (_type_): location of transcript
+                encoding - optional (string): tiktoken encoder base
+                map_reduce - optional (bool): split long transcripts into windows generated in parallel
+                window_tokens - optional (int): token budget of each window in map-reduce mode
+                max_workers - optional (int): maximum number of windows generated concurrently
+                merge_model - optional (string): model used to merge the window summaries
+                transcript - optional (Iterable[string]): lines of the transcript (e.g. TranscriptStore.lines()),
+                                                          used instead of reading transcript_path
+
+            Return:
+                instr_set      (json): formatted JSON object with fields {"Summary":, "Procedure": [{"Step", "Start_Time", "End_Time"}]}
+        """
+
+        # count tokens to figure out a good max_tokens value
+        # reuse the encoder loaded by the constructor when it is available
+        encoding = getattr(self, "encoding", None) or get_encoding(self.model, encoding)
+
+        if transcript is None:
+            # read in transcript txt file
+            with open(transcript_path, "r") as file:
+                transcript = file.read()
+
+        draft = signature = None
+        if self.index is not None:
+            # the lookup needs the whole transcript
+            self.transcript = transcript = transcript if isinstance(transcript, str) else "".join(transcript)
+            reused, draft, signature = self._lookup(transcript)
+            if reused is not None:
+                return format_result(reused)
+            if map_reduce:
+                # windows are generated from scratch, a draft of the whole procedure does not fit them
+                draft = None
+
+        # Call GPT4
+        with tracing.span("gpt_generate", map_reduce=map_reduce, draft=draft is not None) as span:
+            regenerations = self.regenerations
+            if map_reduce:
+                # windows are built from the lines as they are read, the whole transcript is never joined
+                json_instr = self._map_reduce(transcript, window_tokens, max_workers, encoding, merge_model)
+            else:
+                self.transcript = transcript if isinstance(transcript, str) else "".join(transcript)
+                json_instr = self._generate_json(self.transcript, draft)
+            span.set(retries=self.regenerations - regenerations)
+
+        if "statusCode" in json_instr:
+            return json_instr
+
+        if self.index is not None:
+            self._remember(transcript, json_instr, signature)
+
+        return format_result(json_instr)
@@ -0,0 +1,295 @@
+"""
+jobs.py
+
+This module contains the asynchronous job model of Autolab. A video uid is submitted as a job and a job id
+is returned right away; workers claim jobs from the queue and run the pipeline, reporting the progress of
+each stage (and the transcript as soon as it is complete) while the client polls the job status.
+
+The queue is a SQLite database, shared by every worker and API process that can open the same file. It is
+the development stand-in for a managed queue: another backend only needs the methods of JobQueue.
+
+Created: 10/18/2026
+
+"""
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from .cache import ResultCache
+from .manifest import DONE, FAILED, RunManifest
+
+QUEUED = "queued"
+RUNNING = "running"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    dedupe_key TEXT NOT NULL UNIQUE,
+    uid TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stages TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created);
+"""
+
+
+class JobQueue:
+    """Queue and status store of pipeline jobs, backed by a SQLite database.
+
+    A job is identified by its uid and parameters, so submitting the same video again while its job is
+    queued, running or done returns the existing job instead of processing it twice. A running job is
+    leased to its worker; if the worker dies, the job is claimed again once the lease expires.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 900, max_attempts: int = 3):
+        """Constructor - creates the database at path if needed
+
+        Args:
+            path          (str): SQLite database file
+            lease_seconds (float): time a worker can hold a job without reporting progress before it is
+                                   given to another worker
+            max_attempts  (int): number of times a job is run before it is marked failed
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._connect(write=False) as db:
+            # readers polling the status of jobs do not block the workers
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self, write: bool = True):
+        """Opens a connection. With write set, its with block is one transaction holding the write lock"""
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            if write:
+                db.execute("BEGIN IMMEDIATE")
+            yield db
+            if write:
+                db.execute("COMMIT")
+        except BaseException:
+            if write:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        del job["dedupe_key"]
+        job["params"] = json.loads(job["params"])
+        job["stages"] = json.loads(job["stages"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def submit(self, uid: str, **params) -> str:
+        """
+            Queues the processing of a video
+
+        Args:
+            uid    (str): unique identifier of the video
+            params (dict): JSON serializable parameters of the job, passed to the worker's handler
+
+        Return:
+            job_id (str): id of the new job, or of the existing job of the same uid and parameters.
+                          A failed job is queued again.
+        """
+        dedupe_key = ResultCache.make_key("job", uid, **params)
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute("SELECT id, status FROM jobs WHERE dedupe_key = ?", (dedupe_key,)).fetchone()
+            if row is None:
+                job_id = uuid.uuid4().hex
+                db.execute(
+                    "INSERT INTO jobs (id, dedupe_key, uid, params, status, created, updated)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, dedupe_key, uid, json.dumps(params), QUEUED, now, now),
+                )
+                return job_id
+            if row["status"] == FAILED:
+                db.execute(
+                    "UPDATE jobs SET status = ?, error = NULL, attempts = 0, updated = ? WHERE id = ?",
+                    (QUEUED, now, row["id"]),
+                )
+            return row["id"]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+            Returns the status of a job
+
+        Return:
+            job (dict): {"id", "uid", "params", "status", "stages", "result", "error", "attempts", "worker",
+                         "lease_until", "created", "updated"}, or None if there is no such job. "stages" maps
+                         each stage of the pipeline to its status and partial results
+        """
+        with self._connect(write=False) as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """
+            Takes the oldest queued job, or a running job whose lease expired
+
+        Args:
+            worker (str): id of the claiming worker
+
+        Return:
+            job (dict): the claimed job (see get), or None if there is nothing to do
+        """
+        now = time.time()
+        with self._connect() as db:
+            while True:
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?)"
+                    " ORDER BY created LIMIT 1",
+                    (QUEUED, RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                if row["attempts"] >= self.max_attempts:
+                    # the worker died (or timed out) on every attempt
+                    db.execute(
+                        "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                        (FAILED, f"Error: Lease expired after {row['attempts']} attempt(s)", now, row["id"]),
+                    )
+                    continue
+                db.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, updated = ?"
+                    " WHERE id = ?",
+                    (RUNNING, worker, now + self.lease_seconds, now, row["id"]),
+                )
+                return self._job(db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def update_stage(self, job_id: str, stage: str, status: str, **fields):
+        """Records the status and partial results of a stage of a running job, and extends its lease"""
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            stages = json.loads(row["stages"])
+            stages.setdefault(stage, {}).update(status=status, updated=now, **fields)
+            db.execute(
+                "UPDATE jobs SET stages = ?, lease_until = ?, updated = ? WHERE id = ?",
+                (json.dumps(stages), now + self.lease_seconds, now, job_id),
+            )
+
+    def complete(self, job_id: str, result: dict):
+        """Marks a job done with its result"""
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_until = NULL, updated = ? WHERE id = ?",
+                (DONE, json.dumps(result), time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str, retry: bool = True):
+        """Queues a job again after an error, or marks it failed once it ran max_attempts times"""
+        with self._connect() as db:
+            row = db.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            status = QUEUED if retry and row["attempts"] < self.max_attempts else FAILED
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+
+class Worker:
+    """Runs the jobs of a JobQueue with a handler, reporting the progress of each stage to the queue"""
+
+    def __init__(self, queue: JobQueue, handler: Callable[[dict, Callable], dict], worker_id: str = None):
+        """Constructor
+
+        Args:
+            queue     (JobQueue): queue the jobs are claimed from
+            handler   (Callable[[dict, Callable], dict]): runs a job. Called with the job (see JobQueue.get)
+                                                         and a progress callback to pass to
+                                                         Autolab.generate_procedure_batch(progress=...),
+                                                         returns the result of the job
+            worker_id (str, optional): id of the worker in the queue. Defaults to the host name and thread
+        """
+        self.queue = queue
+        self.handler = handler
+        self.worker_id = worker_id or f"{socket.gethostname()}:{threading.get_ident()}"
+
+    def progress(self, job_id: str) -> Callable[[RunManifest, dict], None]:
+        """Returns the RunManifest listener that reports the stages of a job to the queue"""
+
+        def report(manifest: RunManifest, record: dict):
+            try:
+                if "stage" in record:
+                    # results are stored once the job is done, only partial results are reported here
+                    fields = {key: value for key, value in record.items() if key not in ("stage", "status", "result")}
+                    if record["stage"] == "transcribe" and record["status"] == DONE:
+                        fields["transcript"] = [list(segment) for segment in manifest.transcript()]
+                    self.queue.update_stage(job_id, record["stage"], record["status"], **fields)
+                else:
+                    statuses = [segment.get("status") for segment in manifest.segments.values()]
+                    self.queue.update_stage(
+                        job_id,
+                        "transcribe",
+                        RUNNING,
+                        segments=len(statuses),
+                        segments_done=statuses.count(DONE),
+                        segments_failed=statuses.count(FAILED),
+                    )
+            except Exception as e:
+                # progress is informative, the run goes on without it
+                logging.getLogger(__name__).warning(f"Could not report the progress of job {job_id}. {e}")
+
+        return report
+
+    def run_once(self) -> bool:
+        """Claims and runs one job, returns False if the queue was empty"""
+        job = self.queue.claim(self.worker_id)
+        if job is None:
+            return False
+
+        logging.getLogger(__name__).info(f"Running job {job['id']} ({job['uid']}), attempt {job['attempts']}")
+        try:
+            result = self.handler(job, self.progress(job["id"]))
+        except Exception as e:
+            self.queue.fail(job["id"], str(e))
+        else:
+            self.queue.complete(job["id"], result)
+        return True
+
+    def run(
+        self, stop: threading.Event = None, drain: bool = False, poll_interval: float = 1.0, deadline: float = None
+    ) -> int:
+        """
+            Runs jobs until stopped
+
+        Args:
+            stop          (threading.Event, optional): stops the worker after its current job once set
+            drain         (bool): return as soon as the queue is empty instead of waiting for new jobs
+            poll_interval (float): seconds between two polls of an empty queue
+            deadline      (float, optional): time.time() after which no new job is claimed
+
+        Return:
+            jobs (int): number of jobs run
+        """
+        stop = stop or threading.Event()
+        jobs = 0
+        while not stop.is_set() and (deadline is None or time.time() < deadline):
+            if self.run_once():
+                jobs += 1
+            elif drain:
+                break
+            else:
+                stop.wait(poll_interval)
+        return jobs
@@ -0,0 +1,135 @@
+"""
+manifest.py
+
+This module contains the run manifest of Autolab.generate_procedure_batch, a checkpoint of every stage
+and audio segment of a run, so that a failed or timed out run resumes where it stopped instead of
+converting and transcribing the whole recording again.
+
+Created: 10/18/2026
+
+"""
+import json
+import threading
+from typing import Callable, Iterator, List, Optional, Tuple
+
+PENDING = "pending"
+CONVERTED = "converted"
+DONE = "done"
+FAILED = "failed"
+
+
+class RunManifest:
+    """Append-only JSONL log of the stage and segment updates of a run.
+
+    The first line identifies the run (its fingerprint covers the input and every setting that
+    changes the result). Each following line is an update of a stage or a segment, applied in order
+    when the manifest is loaded, so a run killed mid-write loses at most its last update.
+    Segment transcripts are not kept in memory, only the offset of the update that holds them.
+    """
+
+    def __init__(self, path: str, fingerprint: str, listener: Callable[["RunManifest", dict], None] = None):
+        """Constructor - loads the manifest at path, or starts a new one if it belongs to another run
+
+        Args:
+            path        (str): manifest file, e.g. "{temp_dir}/{uid}.manifest.jsonl"
+            fingerprint (str): identifies the input and settings of the run
+            listener    (Callable, optional): called with the manifest and each new stage or segment update
+                                              once it is recorded (e.g. to report the progress of a job)
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.listener = listener
+        self._lock = threading.Lock()
+        # name -> {"status": ..., other fields}
+        self.stages = {}
+        # segment index -> {"status": ..., "start": ..., "duration": ..., other fields}
+        self.segments = {}
+
+        if not self._load():
+            self.stages, self.segments = {}, {}
+            with open(self.path, "w") as fd:
+                fd.write(json.dumps({"fingerprint": fingerprint}) + "\n")
+
+    def _load(self) -> bool:
+        """Replays the updates of an existing manifest of the same run, returns False if there is none"""
+        try:
+            fd = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+
+        with fd:
+            try:
+                if json.loads(fd.readline()).get("fingerprint") != self.fingerprint:
+                    return False
+            except ValueError:
+                return False
+
+            offset = fd.tell()
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the run was interrupted while writing this update
+                    break
+                self._apply(record, offset)
+                offset += len(line)
+        return True
+
+    def _apply(self, record: dict, offset: int):
+        """Applies an update read from (or written to) offset in the manifest file"""
+        fields = {key: value for key, value in record.items() if key not in ("stage", "segment")}
+        if "stage" in record:
+            self.stages.setdefault(record["stage"], {}).update(fields)
+        else:
+            if "transcript" in fields:
+                del fields["transcript"]
+                fields["transcript_offset"] = offset
+            self.segments.setdefault(record["segment"], {}).update(fields)
+
+    def _append(self, record: dict):
+        line = (json.dumps(record) + "\n").encode()
+        with self._lock:
+            with open(self.path, "ab") as fd:
+                offset = fd.tell()
+                fd.write(line)
+            self._apply(record, offset)
+        if self.listener is not None:
+            self.listener(self, record)
+
+    def stage_status(self, name: str) -> str:
+        """Returns the status of a stage ("pending" if it never ran)"""
+        return self.stages.get(name, {}).get("status", PENDING)
+
+    def stage(self, name: str) -> dict:
+        """Returns the fields recorded for a stage"""
+        return self.stages.get(name, {})
+
+    def set_stage(self, name: str, status: str, **fields):
+        """Records the status of a stage along with extra JSON serializable fields (e.g. its result)"""
+        self._append({"stage": name, "status": status, **fields})
+
+    def segment_status(self, index: int) -> str:
+        """Returns the status of a segment ("pending" if it was never recorded)"""
+        return self.segments.get(index, {}).get("status", PENDING)
+
+    def set_segment(self, index: int, status: str, **fields):
+        """Records the status of a segment; fields that are not given keep their previous value"""
+        self._append({"segment": index, "status": status, **fields})
+
+    def segment_transcript(self, index: int) -> Optional[List[Tuple[str, float, float]]]:
+        """Returns the transcript of a segment that was transcribed, or None"""
+        if self.segment_status(index) != DONE:
+            return None
+        with open(self.path, "rb") as fd:
+            fd.seek(self.segments[index]["transcript_offset"])
+            transcript = json.loads(fd.readline())["transcript"]
+        return [(text, start, end) for text, start, end in transcript]
+
+    def transcript(self) -> Iterator[Tuple[str, float, float]]:
+        """Yields the transcripts of every transcribed segment, in segment order"""
+        for index in sorted(self.segments):
+            yield from self.segment_transcript(index) or []
+
+    def failed_segments(self) -> List[int]:
+        """Returns the indices of the segments whose transcription failed"""
+        return sorted(index for index, segment in self.segments.items() if segment.get("status") == FAILED)
@@ -0,0 +1,343 @@
+"""
+procedure_json.py
+
+This module contains the JSON schema of the procedures generated by GPT and a local repair
+stage for model outputs that are truncated or slightly invalid, so they can be fixed without
+sending the whole transcript to the model again.
+
+Created: 10/18/2026
+
+"""
+import json
+import re
+from typing import List, Optional, Tuple
+
+STEP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "step": {"type": "string"},
+        "start_time": {"type": ["number", "string"]},
+        "end_time": {"type": ["number", "string"]},
+    },
+    "required": ["step", "start_time", "end_time"],
+}
+
+PROCEDURE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "Summary": {"type": "string"},
+        "Procedure": {"type": "array", "items": STEP_SCHEMA},
+    },
+    "required": ["Summary", "Procedure"],
+}
+
+# lower case, separator free spelling -> expected key
+_KEY_NAMES = {
+    "summary": "Summary",
+    "procedure": "Procedure",
+    "procedures": "Procedure",
+    "steps": "Procedure",
+    "step": "step",
+    "starttime": "start_time",
+    "start": "start_time",
+    "endtime": "end_time",
+    "end": "end_time",
+}
+
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+def _canonical_key(key: str) -> str:
+    return _KEY_NAMES.get(re.sub(r"[\s_\-]", "", key).lower(), key)
+
+
+def _close_brackets(text: str) -> str:
+    """Closes an unterminated string and every object or array left open at the end of text"""
+    stack = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+
+    if in_string:
+        text += '"'
+    return text + "".join(reversed(stack))
+
+
+def close_json(text: str) -> Tuple[str, bool]:
+    """
+        Closes a truncated JSON document, dropping the partial member it was cut off in if needed
+
+    Args:
+        text (str): JSON text, possibly cut off mid-value
+
+    Return:
+        closed    (str): parseable JSON text, or text unchanged if it could not be recovered
+        truncated (bool): True if anything had to be closed or dropped
+
+    """
+    text = text.rstrip()
+    candidate = text
+    while candidate:
+        closed = _TRAILING_COMMA.sub(r"\1", _close_brackets(candidate.rstrip()))
+        try:
+            json.loads(closed)
+            return closed, closed != text
+        except ValueError:
+            pass
+
+        # drop the last (partial) member and try again
+        cut = max(candidate.rfind(","), candidate.rfind("{"), candidate.rfind("["))
+        if cut <= 0:
+            break
+        shorter = candidate[:cut] if candidate[cut] == "," else candidate[: cut + 1]
+        candidate = shorter if shorter != candidate else candidate[:cut]
+
+    return text, False
+
+
+def repair_json_text(text: str) -> Tuple[str, bool]:
+    """
+        Applies local, textual repairs to a model output
+
+    Args:
+        text (str): raw model output
+
+    Return:
+        repaired  (str): markdown fences and surrounding prose stripped, trailing commas removed and
+                         unclosed brackets closed
+        truncated (bool): True if the output was cut off and had to be closed
+
+    """
+    start = text.find("{")
+    if start == -1:
+        return text, False
+    text = text[start:]
+    end = text.rfind("}")
+    if end != -1:
+        try:
+            json.loads(_TRAILING_COMMA.sub(r"\1", text[: end + 1]))
+            text = text[: end + 1]
+        except ValueError:
+            pass
+
+    return close_json(_TRAILING_COMMA.sub(r"\1", text))
+
+
+def normalize_procedure(instr) -> dict:
+    """
+        Normalizes the key casing and shape of a parsed procedure
+        (e.g. "summary" -> "Summary", "Start_Time" -> "start_time", a single step object -> a list)
+
+    Args:
+        instr (dict): parsed model output
+
+    Return:
+        instr (dict): the normalized procedure
+
+    """
+    if not isinstance(instr, dict):
+        return instr
+
+    instr = {_canonical_key(key): value for key, value in instr.items()}
+    procedure = instr.get("Procedure")
+    if isinstance(procedure, dict):
+        procedure = [procedure]
+    if isinstance(procedure, list):
+        instr["Procedure"] = [
+            {_canonical_key(key): value for key, value in step.items()} if isinstance(step, dict) else step
+            for step in procedure
+        ]
+    return instr
+
+
+def invalid_steps(instr: dict) -> List[int]:
+    """Returns the indices of the steps of a procedure that do not match STEP_SCHEMA"""
+    import jsonschema
+
+    validator = jsonschema.Draft7Validator(STEP_SCHEMA)
+    return [i for i, step in enumerate(instr.get("Procedure", [])) if not validator.is_valid(step)]
+
+
+def validate_procedure(instr: dict):
+    """
+        Validates a procedure against PROCEDURE_SCHEMA
+
+    Throws:
+        jsonschema.ValidationError if the procedure does not match the schema
+    """
+    import jsonschema
+
+    jsonschema.validate(instr, PROCEDURE_SCHEMA)
+
+
+def parse_procedure(text: str, draft: dict = None) -> Tuple[Optional[dict], List[int], bool]:
+    """
+        Parses a model output into a procedure, repairing it locally where possible
+
+    Args:
+        text  (str): raw model output
+        draft (dict, optional): draft procedure the output was edited from, whose step references are expanded
+
+    Return:
+        instr    (dict): the normalized procedure, or None if it could not be recovered locally
+        invalid  (List[int]): indices of steps that are still invalid and need a repair request
+        repaired (bool): True if the output was not valid as returned by the model
+
+    """
+    repaired = False
+    truncated = False
+    try:
+        instr = json.loads(text)
+    except ValueError:
+        repaired = True
+        repaired_text, truncated = repair_json_text(text)
+        try:
+            instr = json.loads(repaired_text)
+        except ValueError:
+            return None, [], True
+
+    normalized = normalize_procedure(instr)
+    repaired = repaired or normalized != instr
+    instr = normalized
+    if draft is not None:
+        instr = expand_draft(instr, draft)
+    if (
+        not isinstance(instr, dict)
+        or not isinstance(instr.get("Summary"), str)
+        or not isinstance(instr.get("Procedure"), list)
+    ):
+        return None, [], True
+
+    invalid = invalid_steps(instr)
+    # the last step of a truncated output is usually incomplete, everything before it is intact
+    if truncated and invalid and invalid[-1] == len(instr["Procedure"]) - 1:
+        instr["Procedure"].pop()
+        invalid.pop()
+
+    return instr, invalid, repaired
+
+
+def expand_draft_step(step, draft: dict):
+    """
+        Replaces a reference to a step of a draft procedure ({"draft": n, "start_time":, "end_time":}, n from 1)
+        by the text of that step, with the times of the reference
+
+    Args:
+        step  (dict): step of a procedure edited from a draft (see TranscriptConversion)
+        draft (dict): the draft procedure {"Summary":, "Procedure": [...]}
+
+    Return:
+        step (dict): the expanded step, or step unchanged if it is not a valid reference
+    """
+    if not isinstance(step, dict) or "step" in step:
+        return step
+    number = step.get("draft")
+    steps = draft.get("Procedure") or []
+    if not isinstance(number, int) or not 1 <= number <= len(steps):
+        return step
+    expanded = {key: value for key, value in step.items() if key != "draft"}
+    expanded["step"] = steps[number - 1].get("step")
+    return expanded
+
+
+def expand_draft(instr: dict, draft: dict) -> dict:
+    """Expands the references to draft steps of a procedure (see expand_draft_step)"""
+    if isinstance(instr, dict) and isinstance(instr.get("Procedure"), list):
+        instr["Procedure"] = [expand_draft_step(step, draft) for step in instr["Procedure"]]
+    return instr
+
+
+class IncrementalProcedureParser:
+    """Parses a procedure while the model is still writing it.
+
+    Text is fed as it arrives. The Summary is returned as soon as its string is closed and each Procedure
+    step as soon as its object is closed, long before the whole output can be parsed. Keys are normalized
+    like normalize_procedure; anything outside the top level object (e.g. a markdown fence) is ignored.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        # top level key whose value is being read, and the last string read where a key is expected
+        self._key = None
+        self._in_value = False
+        self._last_string = None
+        self._step_start = None
+        self.summary = None
+        self.steps = []
+
+    def feed(self, text: str) -> List[Tuple[str, object]]:
+        """
+            Parses the next part of the output
+
+        Args:
+            text (str): text received since the last call
+
+        Return:
+            events (List[Tuple[str, object]]): ("summary", str) and ("step", dict) of everything completed by text
+        """
+        events = []
+        self.text += text
+        for position in range(self._position, len(self.text)):
+            char = self.text[position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._top_level_string(json.loads(self.text[self._string_start : position + 1]), events)
+            elif char == '"':
+                self._in_string = True
+                self._string_start = position
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 3 and char == "{" and self._key == "Procedure":
+                    self._step_start = position
+            elif char in "}]":
+                if self._depth == 3 and char == "}" and self._step_start is not None:
+                    try:
+                        step = json.loads(self.text[self._step_start : position + 1])
+                    except ValueError:
+                        # e.g. a trailing comma, left to parse_procedure once the output is complete
+                        step = None
+                    if isinstance(step, dict):
+                        step = {_canonical_key(key): value for key, value in step.items()}
+                        self.steps.append(step)
+                        events.append(("step", step))
+                    self._step_start = None
+                self._depth -= 1
+            elif self._depth == 1 and char == ":":
+                self._key = _canonical_key(self._last_string or "")
+                self._in_value = True
+            elif self._depth == 1 and char == ",":
+                self._key = None
+                self._in_value = False
+        self._position = len(self.text)
+        return events
+
+    def _top_level_string(self, value: str, events: list):
+        if not self._in_value:
+            self._last_string = value
+        elif self._key == "Summary" and self.summary is None:
+            self.summary = value
+            events.append(("summary", value))
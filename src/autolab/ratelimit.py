@@ -0,0 +1,353 @@
+"""
+ratelimit.py
+
+This module contains the scheduler every remote call of Autolab goes through (Speech-to-Text, OpenAI, and the
+Cloud Storage and Supabase storage calls). Each service has one scheduler per process, shared by every thread:
+
+- token buckets keep the requests, tokens and audio seconds sent per minute just under the quota, so that
+  many videos or chunks processed in parallel do not run into 429s
+- a call that fails with a rate limit, quota or transient server error is retried with jittered exponential
+  backoff, or after the delay the service asked for (retry-after). The whole service pauses meanwhile
+- interactive calls are admitted before batch calls waiting for the same capacity
+
+Created: 10/18/2026
+
+Usage:
+- AUTOLAB_<SERVICE>_RPM, AUTOLAB_<SERVICE>_TPM and AUTOLAB_<SERVICE>_AUDIO_SPM set the requests, tokens and
+  audio seconds per minute of a service ("OPENAI", "SPEECH", "STORAGE"). Unset limits are not enforced
+- with ratelimit.priority(ratelimit.BATCH): ... runs the calls of the block as batch work
+"""
+import functools
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional, Tuple
+
+# priority classes, lower is admitted first
+INTERACTIVE = 0
+BATCH = 1
+
+# units a call can cost, with the suffix of their environment variable
+UNITS = {"requests": "RPM", "tokens": "TPM", "audio_seconds": "AUDIO_SPM"}
+
+# HTTP statuses worth retrying
+RETRYABLE_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+
+_priority = ContextVar("autolab_priority", default=INTERACTIVE)
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def priority(level: int):
+    """Runs the remote calls of the with block (and of the threads it propagates to) with a priority class"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class TokenBucket:
+    """Refills per_minute units per minute, up to capacity.
+
+    A cost larger than the capacity is admitted once the bucket is full, leaving the bucket in debt, so that
+    a large request (e.g. a long prompt) is delayed rather than refused.
+    """
+
+    def __init__(self, per_minute: float, capacity: float = None, clock: Callable[[], float] = time.monotonic):
+        """Constructor
+
+        Args:
+            per_minute (float): units added per minute
+            capacity   (float, optional): burst size. Defaults to 10 seconds of refill, which spreads the calls
+                                          over the minute instead of sending a minute of quota at once
+            clock      (Callable[[], float]): monotonic time in seconds
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute / 6.0
+        self.clock = clock
+        self.level = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """Returns the seconds until cost can be taken from the bucket"""
+        self._refill()
+        missing = min(cost, self.capacity) - self.level
+        return max(missing / self.rate, 0.0)
+
+    def take(self, cost: float):
+        """Takes cost from the bucket, even if it goes into debt"""
+        self._refill()
+        self.level -= cost
+
+
+@functools.lru_cache(maxsize=None)
+def _retryable_errors() -> tuple:
+    """Exception types of the installed clients that are worth retrying"""
+    errors = []
+    try:
+        from google.api_core import exceptions
+
+        errors += [
+            exceptions.TooManyRequests,
+            exceptions.ResourceExhausted,
+            exceptions.ServiceUnavailable,
+            exceptions.DeadlineExceeded,
+            exceptions.InternalServerError,
+            exceptions.BadGateway,
+            exceptions.GatewayTimeout,
+        ]
+    except ImportError:
+        pass
+    try:
+        import openai.error
+
+        errors += [
+            openai.error.RateLimitError,
+            openai.error.ServiceUnavailableError,
+            openai.error.APIConnectionError,
+            openai.error.Timeout,
+            openai.error.TryAgain,
+        ]
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def _status(error: Exception) -> Optional[int]:
+    """Returns the HTTP status of an error of any client, if it has one"""
+    for attribute in ("http_status", "status_code", "status", "code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    # e.g. storage3.StorageException({"statusCode": 429, ...})
+    if error.args and isinstance(error.args[0], dict):
+        value = error.args[0].get("statusCode")
+        if str(value).isdigit():
+            return int(value)
+    return None
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Returns the delay in seconds a service asked for before the next call, if any"""
+    headers = getattr(error, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                return float(value) * scale
+            except ValueError:
+                # an HTTP date, rare enough to be handled by the backoff
+                pass
+    # gRPC errors carry a google.rpc.RetryInfo detail
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            if hasattr(delay, "total_seconds"):
+                return delay.total_seconds()
+            return delay.seconds + delay.nanos / 1e9
+    return None
+
+
+def classify_error(error: Exception) -> Tuple[bool, Optional[float]]:
+    """
+        Decides if a failed call is retried
+
+    Args:
+        error (Exception): error raised by the call
+
+    Return:
+        retryable (bool): the error is a rate limit, quota or transient server error
+        delay     (float): the delay asked for by the service, or None
+    """
+    retryable = isinstance(error, _retryable_errors()) or _status(error) in RETRYABLE_STATUSES
+    return retryable, retry_after(error) if retryable else None
+
+
+class Scheduler:
+    """Admits the calls to one remote service within its per-minute limits, and retries them with backoff"""
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = None,
+        tokens_per_minute: float = None,
+        audio_seconds_per_minute: float = None,
+        headroom: float = 0.9,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Constructor
+
+        Args:
+            name                     (str): service name, used in logs
+            requests_per_minute      (float, optional): request quota. None does not limit requests
+            tokens_per_minute        (float, optional): token quota (prompt and completion tokens)
+            audio_seconds_per_minute (float, optional): audio quota
+            headroom                 (float): fraction of the quotas used, so that throughput stays just under
+                                              them despite the calls of other processes and clock skew
+            max_retries              (int): retries of a failed call before its error is raised
+            base_delay               (float): backoff of the first retry, doubled at each retry
+            max_delay                (float): maximum backoff
+            clock                    (Callable[[], float]): monotonic time in seconds
+        """
+        self.name = name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        limits = {
+            "requests": requests_per_minute,
+            "tokens": tokens_per_minute,
+            "audio_seconds": audio_seconds_per_minute,
+        }
+        self.buckets = {
+            unit: TokenBucket(limit * headroom, clock=clock) for unit, limit in limits.items() if limit is not None
+        }
+        # number of retries and total seconds spent backing off, for reporting
+        self.retries = 0
+        self.backoff_seconds = 0.0
+        self._paused_until = 0.0
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls, name: str, **options) -> "Scheduler":
+        """Creates the scheduler of a service with the limits set in AUTOLAB_<NAME>_RPM/_TPM/_AUDIO_SPM"""
+        limits = {}
+        for unit, suffix in UNITS.items():
+            value = os.getenv(f"AUTOLAB_{name.upper()}_{suffix}")
+            if value:
+                limits[f"{unit}_per_minute"] = float(value)
+        return cls(name, **limits, **options)
+
+    def acquire(self, priority: int = None, **cost):
+        """
+            Waits until the call can be sent: the service is not paused, every earlier waiter of the same or a
+            higher priority was admitted, and the buckets hold its cost
+
+        Args:
+            priority (int, optional): INTERACTIVE or BATCH. Defaults to the priority of the calling context
+            cost     (dict): units the call costs, e.g. tokens=1200. Every call costs one request
+        """
+        cost = {"requests": 1, **cost}
+        ticket = (current_priority() if priority is None else priority, next(self._tickets))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    timeout = None
+                    if self._waiting[0] == ticket:
+                        waits = [self._paused_until - self.clock()]
+                        waits += [bucket.wait_time(cost[unit]) for unit, bucket in self.buckets.items() if unit in cost]
+                        timeout = max(waits)
+                        if timeout <= 0:
+                            break
+                    self._condition.wait(timeout)
+                for unit, amount in cost.items():
+                    if unit in self.buckets:
+                        self.buckets[unit].take(amount)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+    def limits(self, unit: str) -> bool:
+        """Returns True if the calls are admitted within a quota of unit (e.g. "audio_seconds")"""
+        return unit in self.buckets
+
+    def charge(self, **cost):
+        """Takes the cost of a call that was only known once it completed (e.g. completion tokens)"""
+        with self._condition:
+            for unit, amount in cost.items():
+                if unit in self.buckets and amount:
+                    self.buckets[unit].take(amount)
+
+    def backoff(self, attempt: int, delay: float = None) -> float:
+        """
+            Pauses the service after a failed call
+
+        Args:
+            attempt (int): number of the retry, from 0
+            delay   (float, optional): delay asked for by the service
+
+        Return:
+            delay (float): seconds until the next call is admitted
+        """
+        if delay is None:
+            # full jitter, so that the waiting threads do not retry together
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        else:
+            delay *= random.uniform(1.0, 1.1)
+        with self._condition:
+            self._paused_until = max(self._paused_until, self.clock() + delay)
+            self.retries += 1
+            self.backoff_seconds += delay
+            self._condition.notify_all()
+        return delay
+
+    def call(self, fn: Callable, priority: int = None, **cost):
+        """
+            Sends a call through the scheduler, retrying it on rate limit, quota and transient errors
+
+        Args:
+            fn       (Callable): sends the call
+            priority (int, optional): INTERACTIVE or BATCH. Defaults to the priority of the calling context
+            cost     (dict): units the call costs (see acquire)
+
+        Return:
+            response: the return value of fn
+
+        Throws:
+            the error of the last attempt, or any error that is not worth retrying
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority, **cost)
+            try:
+                return fn()
+            except Exception as e:
+                retryable, delay = classify_error(e)
+                if not retryable or attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt, delay)
+                logger.warning(f"{self.name} call failed ({type(e).__name__}), retrying in {delay:.1f}s. {e}")
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name: str) -> Scheduler:
+    """Returns the scheduler of a service shared by the whole process, created from the environment on first use"""
+    with _schedulers_lock:
+        if name not in _schedulers:
+            _schedulers[name] = Scheduler.from_env(name)
+        return _schedulers[name]
+
+
+def set_scheduler(name: str, scheduler: Optional[Scheduler]):
+    """Replaces the scheduler of a service (None recreates it from the environment on next use)"""
+    with _schedulers_lock:
+        if scheduler is None:
+            _schedulers.pop(name, None)
+        else:
+            _schedulers[name] = scheduler
@@ -0,0 +1,332 @@
+"""
+replay.py
+
+This module records the responses of the remote services the pipeline calls (Google Speech, OpenAI and
+Supabase storage) into a fixture file, and replays them deterministically, so the pipeline can be run and
+benchmarked without credentials or network. Replays can add delays and inject errors.
+
+Created: 10/18/2026
+
+Usage:
+- AUTOLAB_REPLAY=fixtures/run.json AUTOLAB_REPLAY_MODE=record   runs against the real services and records them
+- AUTOLAB_REPLAY=fixtures/run.json                              replays the recorded responses
+- replay.use_cassette(path, delay_scale=1.0, error_rate={"speech": 0.1}) does the same from code
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+RECORD = "record"
+REPLAY = "replay"
+
+CASSETTE_VERSION = 1
+
+
+class InjectedError(Exception):
+    """Error raised by a replayed call to simulate a failure of the remote service"""
+
+
+class Cassette:
+    """Recorded calls of one or more pipeline runs, stored as a JSON fixture.
+
+    In record mode each call goes to the real service and its response and latency are appended to the
+    fixture. In replay mode calls are matched to recordings by a hash of their request. Requests that do not
+    match exactly (e.g. audio re-encoded by another ffmpeg version) fall back to the next unused recording of
+    the same method, unless strict is set.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = REPLAY,
+        delay_scale: float = 0.0,
+        extra_delay: float = 0.0,
+        error_rate: dict = None,
+        error_calls: dict = None,
+        seed: int = 0,
+        strict: bool = False,
+        capture_media: bool = True,
+    ):
+        """Constructor - loads the fixture at path
+
+        Args:
+            path          (str): fixture file. Large binary responses are kept next to it in {path}.blobs/
+            mode          (str): "record" or "replay"
+            delay_scale   (float): replayed calls sleep for their recorded latency times delay_scale
+                                   (0 replays instantly, 1 at recorded speed)
+            extra_delay   (float): seconds added to every replayed call
+            error_rate    (dict): probability that a replayed call of a service ("speech", "openai",
+                                  "supabase") raises InjectedError
+            error_calls   (dict): call numbers (counted from 0, per service) that raise InjectedError
+            seed          (int): seed of the injected errors, which are deterministic for a given seed
+            strict        (bool): fail on requests that were not recorded instead of replaying by order
+            capture_media (bool): when recording a signed URL, also record the object so the replay can
+                                  read it from disk
+        """
+        if mode not in (RECORD, REPLAY):
+            raise Exception("Error: Unknown cassette mode {}".format(mode))
+        self.path = path
+        self.mode = mode
+        self.delay_scale = delay_scale
+        self.extra_delay = extra_delay
+        self.error_rate = error_rate or {}
+        self.error_calls = {service: set(calls) for service, calls in (error_calls or {}).items()}
+        self.seed = seed
+        self.strict = strict
+        self.capture_media = capture_media
+        self.blob_dir = f"{path}.blobs"
+
+        self._lock = threading.Lock()
+        self._calls = defaultdict(int)
+        self._wrappers = {}
+        self.interactions = []
+        if os.path.isfile(path):
+            with open(path) as fd:
+                self.interactions = json.load(fd)["interactions"]
+        elif mode == REPLAY:
+            raise Exception("Error: Cannot find the replay fixture {}".format(path))
+
+        # recordings by request key and by method, in recording order
+        self._by_key = defaultdict(list)
+        self._by_method = defaultdict(list)
+        self._used = set()
+        for i, interaction in enumerate(self.interactions):
+            self._by_key[interaction["key"]].append(i)
+            self._by_method[(interaction["service"], interaction["method"])].append(i)
+
+    @staticmethod
+    def request_key(service: str, method: str, request) -> str:
+        """Hashes a JSON serializable description of a request"""
+        payload = json.dumps([service, method, request], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def call(
+        self,
+        service: str,
+        method: str,
+        request,
+        send: Callable[[], object],
+        encode: Callable[[object], object] = lambda response: response,
+        decode: Callable[[object], object] = lambda recorded: recorded,
+    ):
+        """
+            Runs a remote call through the cassette
+
+        Args:
+            service (str): remote service, e.g. "speech"
+            method  (str): remote method, e.g. "recognize"
+            request (object): JSON serializable description of the request, matched against the recordings
+            send    (Callable): sends the request to the real service (record mode only)
+            encode  (Callable): converts a response to JSON serializable data
+            decode  (Callable): converts recorded data back to a response
+
+        Return:
+            response: the real response when recording, the recorded one when replaying
+
+        Throws:
+            InjectedError if an error is injected into this call
+        """
+        key = self.request_key(service, method, request)
+        if self.mode == RECORD:
+            start = time.perf_counter()
+            response = send()
+            latency = time.perf_counter() - start
+            self._record(
+                {"service": service, "method": method, "key": key, "response": encode(response), "latency": latency}
+            )
+            return response
+
+        with self._lock:
+            call_number = self._calls[service]
+            self._calls[service] += 1
+            interaction = self._take(service, method, key)
+
+        time.sleep(interaction.get("latency", 0.0) * self.delay_scale + self.extra_delay)
+        injected = call_number in self.error_calls.get(service, ())
+        injected = injected or self._draw(service, call_number) < self.error_rate.get(service, 0.0)
+        if injected:
+            raise InjectedError(f"Injected error in {service}.{method} (call {call_number})")
+        return decode(interaction["response"])
+
+    def _draw(self, service: str, call_number: int) -> float:
+        """Returns a random number that only depends on the seed, the service and the call number"""
+        return random.Random(f"{self.seed}:{service}:{call_number}").random()
+
+    def _take(self, service: str, method: str, key: str) -> dict:
+        """Returns the first unused recording of a request (lock must be held)"""
+        recorded = self._by_key.get(key, [])
+        candidates = [index for index in recorded if index not in self._used]
+        if not candidates and recorded:
+            # the same request made again (e.g. a retry) replays its last recording
+            candidates = recorded[-1:]
+        if not candidates:
+            if self.strict:
+                raise Exception("Error: No recording of {}.{} for this request".format(service, method))
+            candidates = [index for index in self._by_method.get((service, method), []) if index not in self._used]
+            if not candidates:
+                raise Exception("Error: No recording of {}.{} left to replay".format(service, method))
+            logging.warning(f"Replaying {service}.{method} by order, the request does not match a recording")
+
+        self._used.add(candidates[0])
+        return self.interactions[candidates[0]]
+
+    def _record(self, interaction: dict):
+        with self._lock:
+            self.interactions.append(interaction)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as fd:
+                json.dump({"version": CASSETTE_VERSION, "interactions": self.interactions}, fd, indent=1)
+            os.replace(tmp_path, self.path)
+
+    def save_blob(self, data: bytes) -> str:
+        """Stores binary data next to the fixture, returns its name"""
+        name = hashlib.sha256(data).hexdigest()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        path = os.path.join(self.blob_dir, name)
+        if not os.path.isfile(path):
+            with open(path, "wb") as fd:
+                fd.write(data)
+        return name
+
+    def blob_path(self, name: str) -> str:
+        return os.path.join(self.blob_dir, name)
+
+    def wrap(self, name: str, factory: Callable[[], object]):
+        """Returns the wrapper of a client for this cassette, creating it once"""
+        with self._lock:
+            if name not in self._wrappers:
+                self._wrappers[name] = factory()
+            return self._wrappers[name]
+
+
+class ReplaySpeechClient:
+    """Stands in for speech_v2.SpeechClient under SpeechToText, recording or replaying `recognize`"""
+
+    def __init__(self, cassette: Cassette, client=None):
+        """Constructor
+
+        Args:
+            cassette (Cassette): cassette the calls go through
+            client   (speech_v2.SpeechClient, optional): real client, required in record mode
+        """
+        self.cassette = cassette
+        self.client = client
+
+    def recognize(self, request):
+        from google.cloud import speech_v2
+
+        description = {
+            "recognizer": request.recognizer,
+            "config": json.loads(speech_v2.RecognitionConfig.to_json(request.config)),
+            "content_sha256": hashlib.sha256(request.content).hexdigest(),
+        }
+        return self.cassette.call(
+            "speech",
+            "recognize",
+            description,
+            lambda: self.client.recognize(request=request),
+            encode=lambda response: speech_v2.RecognizeResponse.to_json(response),
+            decode=lambda recorded: speech_v2.RecognizeResponse.from_json(recorded),
+        )
+
+    def __getattr__(self, name):
+        if self.cassette.mode == RECORD:
+            return getattr(self.client, name)
+        raise Exception("Error: SpeechClient.{} cannot be replayed".format(name))
+
+
+class _ReplayBucket:
+    def __init__(self, cassette: Cassette, bucket_name: str, bucket=None):
+        self.cassette = cassette
+        self.bucket_name = bucket_name
+        self.bucket = bucket
+
+    def download(self, path: str) -> bytes:
+        return self.cassette.call(
+            "supabase",
+            "download",
+            {"bucket": self.bucket_name, "path": path},
+            lambda: self.bucket.download(path),
+            encode=self.cassette.save_blob,
+            decode=lambda name: open(self.cassette.blob_path(name), "rb").read(),
+        )
+
+    def create_signed_url(self, path: str, expires_in: int) -> dict:
+        def send():
+            response = self.bucket.create_signed_url(path, expires_in)
+            if self.cassette.capture_media:
+                # the signed URL is expired when the fixture is replayed, the object itself is replayed instead
+                response = {**response, "blob": self.cassette.save_blob(self.bucket.download(path))}
+            return response
+
+        def decode(recorded):
+            if "blob" in recorded:
+                return {**recorded, "signedURL": self.cassette.blob_path(recorded["blob"])}
+            return recorded
+
+        return self.cassette.call(
+            "supabase", "create_signed_url", {"bucket": self.bucket_name, "path": path}, send, decode=decode
+        )
+
+
+class _ReplayStorage:
+    def __init__(self, cassette: Cassette, storage=None):
+        self.cassette = cassette
+        self.storage = storage
+
+    def from_(self, bucket_name: str) -> _ReplayBucket:
+        bucket = self.storage.from_(bucket_name) if self.storage is not None else None
+        return _ReplayBucket(self.cassette, bucket_name, bucket)
+
+
+class ReplaySupabase:
+    """Stands in for the Supabase client of lambda_function, recording or replaying storage downloads and signed URLs"""
+
+    def __init__(self, cassette: Cassette, client=None):
+        """Constructor
+
+        Args:
+            cassette (Cassette): cassette the calls go through
+            client   (supabase.Client, optional): real client, required in record mode
+        """
+        self.storage = _ReplayStorage(cassette, client.storage if client is not None else None)
+
+
+def encode_chat_completion(response) -> dict:
+    """Converts an openai.ChatCompletion response (a dict subclass) to plain JSON data"""
+    return json.loads(json.dumps(response))
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def use_cassette(path: str, mode: str = REPLAY, **options) -> Cassette:
+    """Routes every remote call of the process through a cassette (see Cassette for the options)"""
+    global _active
+    with _active_lock:
+        _active = Cassette(path, mode, **options)
+        return _active
+
+
+def stop_cassette():
+    """Sends remote calls to the real services again"""
+    global _active
+    with _active_lock:
+        _active = None
+
+
+def active_cassette() -> Optional[Cassette]:
+    """Returns the cassette remote calls go through, loading the one named by $AUTOLAB_REPLAY on first use"""
+    global _active
+    if _active is None and os.getenv("AUTOLAB_REPLAY"):
+        with _active_lock:
+            if _active is None:
+                _active = Cassette(os.getenv("AUTOLAB_REPLAY"), os.getenv("AUTOLAB_REPLAY_MODE", REPLAY))
+    return _active
@@ -0,0 +1,260 @@
+"""
+similarity.py
+
+This module contains the near-duplicate index of transcripts and the procedures generated from them. Students of
+the same section record the same protocol, so a new transcript often has a close match whose procedure can be
+reused outright or given to GPT as a draft to edit (see TranscriptConversion).
+
+Transcripts are compared by the Jaccard similarity of their word shingles, estimated with MinHash signatures.
+Signatures are split into bands and indexed by locality-sensitive hashing, so a lookup only compares the few
+transcripts that share a band with the query instead of every stored transcript.
+
+The steps of a reused procedure point at times of the other recording, retime moves them to the times of the same
+lines in the new transcript.
+
+Created: 10/18/2026
+
+"""
+import bisect
+import difflib
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Iterable, List, NamedTuple, Optional
+
+from .transcript_store import SEGMENT_LINE
+
+# timestamps of the transcript lines, which differ between recordings of the same protocol
+TIMESTAMP = re.compile(r"\[[\d.]+-[\d.]+\]")
+WORD = re.compile(r"[a-z0-9]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS procedures (
+    key TEXT PRIMARY KEY,
+    signature BLOB NOT NULL,
+    transcript TEXT NOT NULL,
+    procedure TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+class Match(NamedTuple):
+    """A stored transcript similar to the query"""
+
+    key: str
+    # estimated Jaccard similarity of the shingles, in [0, 1]
+    similarity: float
+    # procedure generated from the stored transcript, {"Summary":, "Procedure": [...]}
+    procedure: dict
+    # the stored transcript, to retime its procedure
+    transcript: str
+
+
+def shingles(transcript: str, size: int = 3) -> set:
+    """Returns the hashes of the word shingles of a transcript, ignoring timestamps, case and punctuation"""
+    words = WORD.findall(TIMESTAMP.sub(" ", transcript).lower())
+    if 0 < len(words) < size:
+        # a transcript shorter than a shingle is a single shingle
+        words += [""] * (size - len(words))
+    return {
+        int.from_bytes(hashlib.blake2b(" ".join(words[i : i + size]).encode(), digest_size=8).digest(), "little")
+        for i in range(max(len(words) - size + 1, 0))
+    }
+
+
+def _segments(transcript: str) -> list:
+    """Returns the (words, start, end) of each line of a transcript"""
+    segments = []
+    for line in transcript.splitlines():
+        match = SEGMENT_LINE.match(line.strip())
+        if match:
+            words = " ".join(WORD.findall(match.group(1).lower()))
+            segments.append((words, float(match.group(2)), float(match.group(3))))
+    return segments
+
+
+def retime(procedure: dict, matched_transcript: str, transcript: str) -> Optional[dict]:
+    """
+        Moves the steps of a procedure generated from another transcript to the times of this one. The lines of
+        both transcripts are aligned on their words, and the times of each step are interpolated between the
+        times of the aligned lines around it
+
+    Args:
+        procedure          (dict): {"Summary":, "Procedure": [...]} generated from matched_transcript
+        matched_transcript (str): transcript the procedure was generated from
+        transcript         (str): the new transcript
+
+    Return:
+        procedure (dict): the procedure with the times of transcript, or None if no line of the transcripts match
+                          or a step time is not a number of seconds
+    """
+    old, new = _segments(matched_transcript), _segments(transcript)
+    matcher = difflib.SequenceMatcher(None, [words for words, _, _ in old], [words for words, _, _ in new], False)
+    anchors = []
+    for block in matcher.get_matching_blocks():
+        for i in range(block.size):
+            _, old_start, old_end = old[block.a + i]
+            _, new_start, new_end = new[block.b + i]
+            anchors += [(old_start, new_start), (old_end, new_end)]
+    if not anchors:
+        return None
+    anchors.sort()
+    times = [old_time for old_time, _ in anchors]
+
+    def move(value):
+        t = float(value)
+        i = bisect.bisect_left(times, t)
+        if i < len(times) and times[i] == t:
+            return anchors[i][1]
+        if i == 0 or i == len(times):
+            # before the first or after the last aligned line, keep the offset of the closest one
+            old_time, new_time = anchors[min(i, len(times) - 1)]
+            return round(t + new_time - old_time, 2)
+        (old_before, new_before), (old_after, new_after) = anchors[i - 1], anchors[i]
+        return round(new_before + (t - old_before) * (new_after - new_before) / (old_after - old_before), 2)
+
+    try:
+        steps = [
+            {**step, "start_time": move(step["start_time"]), "end_time": move(step["end_time"])}
+            for step in procedure["Procedure"]
+        ]
+    except (KeyError, TypeError, ValueError):
+        return None
+    return {**procedure, "Procedure": steps}
+
+
+class ProcedureIndex:
+    """MinHash/LSH index of transcripts and their procedures, stored in a SQLite database.
+
+    Signatures and band buckets are kept in memory (about 1 KB per transcript), procedures are read from the
+    database when they are matched. The index can be shared by the threads of a process.
+    """
+
+    def __init__(self, path: str = ":memory:", num_perm: int = 100, bands: int = 20, shingle_size: int = 3):
+        """Constructor - opens (or creates) the database at path and loads its signatures
+
+        Args:
+            path         (str): SQLite database file. The default keeps the index in memory
+            num_perm     (int): MinHash functions per signature
+            bands        (int): LSH bands, num_perm / bands rows each. With 20 bands of 5 rows, transcripts
+                                with a similarity of 0.7 are found 97% of the time and 0.5 about half the time
+            shingle_size (int): words per shingle
+        """
+        if num_perm % bands:
+            raise Exception("Error: num_perm must be a multiple of bands")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # the same seed in every process, so that stored signatures stay comparable
+        generator = random.Random(1)
+        self._masks = [generator.getrandbits(64) for _ in range(num_perm)]
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._keys = []
+        self._signatures = []
+        self._positions = {}
+        self._buckets = {}
+        for key, signature in self._db.execute("SELECT key, signature FROM procedures ORDER BY created"):
+            self._insert(key, array("Q", signature))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def signature(self, transcript: str) -> array:
+        """Returns the MinHash signature of a transcript"""
+        hashes = shingles(transcript, self.shingle_size)
+        if not hashes:
+            return array("Q", [2**64 - 1] * self.num_perm)
+        # each mask permutes the 64-bit hash values, the signature keeps the minimum of each permutation
+        return array("Q", [min(value ^ mask for value in hashes) for mask in self._masks])
+
+    def _band_keys(self, signature: array) -> List[int]:
+        rows = self.rows
+        return [hash((band, signature[band * rows : (band + 1) * rows].tobytes())) for band in range(self.bands)]
+
+    def _insert(self, key: str, signature: array):
+        if key in self._positions:
+            self._signatures[self._positions[key]] = signature
+            return
+        self._positions[key] = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(self._positions[key])
+
+    @staticmethod
+    def key(transcript: str) -> str:
+        """Identifies a transcript in the index"""
+        return hashlib.sha256(transcript.encode()).hexdigest()
+
+    def add(self, transcript: str, procedure: dict, signature: array = None) -> str:
+        """
+            Stores the procedure generated from a transcript
+
+        Args:
+            transcript (str): the transcript, as sent to GPT
+            procedure  (dict): {"Summary":, "Procedure": [...]} generated from it
+            signature  (array, optional): signature of the transcript, if it was already computed
+
+        Return:
+            key (str): key of the transcript in the index
+        """
+        key = self.key(transcript)
+        signature = signature if signature is not None else self.signature(transcript)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO procedures (key, signature, transcript, procedure, created)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, signature.tobytes(), transcript, json.dumps(procedure), time.time()),
+            )
+            self._db.commit()
+            self._insert(key, signature)
+        return key
+
+    def candidates(self, signature: array) -> Iterable[int]:
+        """Returns the positions of the transcripts that share at least one band with a signature"""
+        found = set()
+        for band_key in self._band_keys(signature):
+            found.update(self._buckets.get(band_key, ()))
+        return found
+
+    def query(self, transcript: str = None, min_similarity: float = 0.5, signature: array = None) -> Optional[Match]:
+        """
+            Finds the stored transcript most similar to a transcript
+
+        Args:
+            transcript     (str, optional): the new transcript
+            min_similarity (float): matches below this estimated similarity are ignored
+            signature      (array, optional): signature of the transcript, used instead of computing it
+
+        Return:
+            match (Match): the closest stored transcript and its procedure, or None
+        """
+        signature = signature if signature is not None else self.signature(transcript)
+        best, best_similarity = None, min_similarity
+        with self._lock:
+            for position in self.candidates(signature):
+                stored = self._signatures[position]
+                similarity = sum(a == b for a, b in zip(signature, stored)) / self.num_perm
+                if similarity >= best_similarity:
+                    best, best_similarity = position, similarity
+            if best is None:
+                return None
+            key = self._keys[best]
+            transcript, procedure = self._db.execute(
+                "SELECT transcript, procedure FROM procedures WHERE key = ?", (key,)
+            ).fetchone()
+        return Match(key, best_similarity, json.loads(procedure), transcript)
+
+    def close(self):
+        self._db.close()
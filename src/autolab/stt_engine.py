@@ -0,0 +1,167 @@
+"""
+stt_engine.py
+
+This module contains the interface of the speech-to-text engines Autolab transcribes audio with,
+and a local CPU engine built on Vosk for bulk reprocessing without per-minute API costs.
+
+Created: 10/18/2026
+
+"""
+import io
+import json
+import os
+import threading
+import wave
+from typing import Iterable, List, Tuple
+
+
+class SpeechEngine:
+    """Interface of a speech-to-text backend.
+
+    An engine transcribes one encoded audio segment at a time and may be called from several
+    threads at once. Times are in seconds from the start of the segment.
+    """
+
+    # name used to select the engine, see create_engine
+    name = None
+
+    # encodings of the audio the engine accepts (see vid_converter.AUDIO_PROFILES)
+    SUPPORTED_ENCODINGS = frozenset()
+
+    @property
+    def engine_id(self) -> str:
+        """Identifies the engine and model in cache keys, so transcripts of different engines never mix"""
+        return self.name
+
+    def transcribe(self, content: bytes, duration: float = None) -> List[Tuple[str, float, float]]:
+        """
+            Transcribes an encoded audio segment
+
+        Args:
+            content  (bytes): encoded audio in one of SUPPORTED_ENCODINGS
+            duration (float, optional): seconds of audio in content, when the caller knows it (e.g. from the
+                                        converter), for engines that meter audio
+
+        Return:
+            transcript_time (List[Tuple[str, float, float]]): (text, start, end) of each utterance
+        """
+        raise NotImplementedError
+
+
+# Vosk models take seconds to load and hundreds of MB, they are shared by every VoskEngine of the process
+_vosk_models = {}
+_vosk_lock = threading.Lock()
+
+
+def get_vosk_model(model_path: str):
+    """Returns the vosk.Model at model_path, loading it on first use"""
+    with _vosk_lock:
+        if model_path not in _vosk_models:
+            try:
+                import vosk
+            except ImportError:
+                raise Exception("Error: The vosk engine needs the vosk package (pip install vosk)")
+
+            vosk.SetLogLevel(-1)
+            _vosk_models[model_path] = vosk.Model(model_path)
+        return _vosk_models[model_path]
+
+
+def utterances_from_results(results: Iterable[dict]) -> List[Tuple[str, float, float]]:
+    """
+        Converts the JSON results of a Vosk recognizer with word times enabled into transcript segments
+
+    Args:
+        results (Iterable[dict]): parsed Result() and FinalResult() outputs, in order
+
+    Return:
+        transcript_time (List[Tuple[str, float, float]]): (text, start, end) of each non-empty utterance
+    """
+    transcript_time = []
+    for result in results:
+        words = result.get("result") or []
+        text = result.get("text", "").strip()
+        if not text or not words:
+            continue
+        transcript_time.append((text, float(words[0]["start"]), float(words[-1]["end"])))
+    return transcript_time
+
+
+class VoskEngine(SpeechEngine):
+    """Transcribes 16-bit mono WAV audio on the local CPU with a Vosk (Kaldi) model.
+
+    Recognition runs in native code without the GIL, so segments transcribed by concurrent threads
+    use one core each.
+    """
+
+    name = "vosk"
+    SUPPORTED_ENCODINGS = frozenset(("linear16",))
+
+    def __init__(self, model_path: str = None, chunk_frames: int = 4000):
+        """Constructor
+
+        Args:
+            model_path   (str, optional): directory of an unpacked Vosk model. Defaults to $VOSK_MODEL_PATH
+            chunk_frames (int, optional): number of frames fed to the recognizer at a time
+        """
+        model_path = model_path or os.getenv("VOSK_MODEL_PATH")
+        if not model_path or not os.path.isdir(model_path):
+            raise Exception("Error: Cannot find the Vosk model {} (set VOSK_MODEL_PATH)".format(model_path))
+        self.model_path = model_path
+        self.chunk_frames = chunk_frames
+
+    @property
+    def engine_id(self) -> str:
+        return f"{self.name}:{os.path.basename(os.path.normpath(self.model_path))}"
+
+    def transcribe(self, content: bytes, duration: float = None) -> List[Tuple[str, float, float]]:
+        import vosk
+
+        with wave.open(io.BytesIO(content), "rb") as wav:
+            if wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+                raise Exception("Error: The vosk engine needs 16-bit mono WAV audio")
+
+            recognizer = vosk.KaldiRecognizer(get_vosk_model(self.model_path), wav.getframerate())
+            recognizer.SetWords(True)
+
+            results = []
+            for frames in iter(lambda: wav.readframes(self.chunk_frames), b""):
+                # True at the end of each utterance
+                if recognizer.AcceptWaveform(frames):
+                    results.append(json.loads(recognizer.Result()))
+            results.append(json.loads(recognizer.FinalResult()))
+
+        return utterances_from_results(results)
+
+
+def engine_class(engine) -> type:
+    """Returns the SpeechEngine class of an engine name or instance"""
+    if isinstance(engine, SpeechEngine):
+        return type(engine)
+    if engine == "google":
+        from .googlestt import SpeechToText
+
+        return SpeechToText
+    if engine == "vosk":
+        return VoskEngine
+    raise Exception("Error: Unknown speech-to-text engine {}".format(engine))
+
+
+def create_engine(engine, project_id: str = None, recognizer_id: str = None) -> SpeechEngine:
+    """
+        Returns the speech-to-text engine selected by name
+
+    Args:
+        engine        (str or SpeechEngine): "google", "vosk", or an engine instance (returned as is)
+        project_id    (str, optional): Google Project ID, used by the google engine
+        recognizer_id (str, optional): Speech Recognizer, used by the google engine
+
+    Return:
+        engine (SpeechEngine): the engine
+    """
+    if isinstance(engine, SpeechEngine):
+        return engine
+    cls = engine_class(engine)
+    if engine == "google":
+        return cls(project_id=project_id, recognizer_id=recognizer_id)
+    return cls()
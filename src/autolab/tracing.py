@@ -0,0 +1,273 @@
+"""
+tracing.py
+
+This module contains the per-stage tracing of Autolab runs. Each stage of a run (download, convert, every
+STT chunk, token counting, every GPT attempt, serialization) is recorded as a span carrying its duration and
+what it processed (bytes, audio seconds, tokens, retries, cache hits). The spans of a run are exported as
+CloudWatch Embedded Metric Format log lines or OpenTelemetry spans, and summarized in a timings block.
+
+Created: 10/18/2026
+
+Usage:
+- AUTOLAB_TRACE=emf   prints one EMF record per stage when a run ends (picked up by CloudWatch on Lambda)
+- AUTOLAB_TRACE=otel  sends the spans to the OpenTelemetry tracer provider of the process
+- Autolab.generate_procedure*(..., timings=True) attaches trace.timings() to the result
+"""
+import json
+import os
+import threading
+import time
+import uuid
+import contextvars
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+# span attributes that are summed per stage in timings() and exported as metrics, with their EMF unit
+METRICS = {
+    "bytes": "Bytes",
+    "audio_seconds": "Seconds",
+    "tokens": "Count",
+    "tokens_saved": "Count",
+    "prompt_tokens": "Count",
+    "completion_tokens": "Count",
+    "retries": "Count",
+    "cache_hit": "Count",
+    # path taken by audio conversions, see vid_converter.plan_conversion
+    "audio_copy": "Count",
+    "audio_remux": "Count",
+    "audio_transcode": "Count",
+}
+
+_trace = ContextVar("autolab_trace", default=None)
+_span = ContextVar("autolab_span", default=None)
+
+
+class Span:
+    """A timed stage of a run"""
+
+    __slots__ = ("name", "parent", "start_ns", "duration", "attributes")
+
+    def __init__(self, name: str, parent: "Span" = None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.start_ns = time.time_ns()
+        self.duration = 0.0
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """Sets attributes of the span, e.g. span.set(bytes=len(content))"""
+        self.attributes.update(attributes)
+
+
+class _NoSpan:
+    """Span returned when no trace is active, so instrumented code never checks for one"""
+
+    def set(self, **attributes):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Trace:
+    """The spans of one run, recorded from any thread"""
+
+    def __init__(self, name: str, exporter: Callable[["Trace"], None] = None, **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.exporter = exporter
+        self.root = Span(name, **attributes)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def timings(self) -> dict:
+        """
+            Summarizes the spans by stage
+
+        Return:
+            timings (dict): {"trace_id", "total_s", "stages": {name: {"count", "duration_s", <summed METRICS>}}}.
+                            Stages run concurrently (e.g. STT chunks) add up to more than their wall time
+        """
+        stages = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            stage = stages.setdefault(span.name, {"count": 0, "duration_s": 0.0})
+            stage["count"] += 1
+            stage["duration_s"] += span.duration
+            for metric in METRICS:
+                value = span.attributes.get(metric)
+                if value is not None:
+                    stage[metric] = stage.get(metric, 0) + value
+        for stage in stages.values():
+            stage["duration_s"] = round(stage["duration_s"], 6)
+        # a trace that is still running (e.g. Autolab called inside lambda_handler) reports its elapsed time
+        total = self.root.duration or (time.time_ns() - self.root.start_ns) / 1e9
+        return {"trace_id": self.trace_id, "total_s": round(total, 6), "stages": stages}
+
+
+def current_trace() -> Optional[Trace]:
+    """Returns the trace of the running run, or None"""
+    return _trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+        Records the code in the with block as a span of the current trace
+
+    Args:
+        name       (str): stage name, spans with the same name are summed in timings()
+        attributes (dict): initial attributes, more can be set with the yielded span's set()
+
+    Yields:
+        span (Span): the span, or a no-op stand-in when no trace is active
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield _NO_SPAN
+        return
+
+    current = Span(name, _span.get() or trace.root, **attributes)
+    token = _span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _span.reset(token)
+        trace.record(current)
+
+
+def add_span(name: str, duration: float, **attributes):
+    """Records a stage timed by the caller, e.g. in a generator where a with block cannot span its yields"""
+    trace = _trace.get()
+    if trace is None:
+        return
+    current = Span(name, _span.get() or trace.root, **attributes)
+    current.start_ns -= int(duration * 1e9)
+    current.duration = duration
+    trace.record(current)
+
+
+@contextmanager
+def start_trace(name: str, exporter=None, **attributes):
+    """
+        Traces a run. Runs started inside another trace (e.g. Autolab called from lambda_handler) are recorded
+        as a span of it, and only the outermost trace is exported.
+
+    Args:
+        name       (str): name of the run
+        exporter   (str or Callable, optional): "emf", "otel" or a function called with the finished trace.
+                                                Defaults to $AUTOLAB_TRACE, no export if it is not set
+        attributes (dict): attributes of the run, e.g. uid
+
+    Yields:
+        trace (Trace): the trace the run is recorded in
+    """
+    trace = _trace.get()
+    if trace is not None:
+        with span(name, **attributes):
+            yield trace
+        return
+
+    trace = Trace(name, get_exporter(exporter), **attributes)
+    trace_token = _trace.set(trace)
+    span_token = _span.set(trace.root)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.root.duration = time.perf_counter() - start
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+        if trace.exporter is not None:
+            trace.exporter(trace)
+
+
+def propagate(fn: Callable) -> Callable:
+    """
+    Wraps fn so its spans belong to the current trace when it runs on another thread (e.g. an executor).
+    The other context variables of the caller (e.g. the ratelimit priority) are propagated as well.
+    """
+    context = contextvars.copy_context()
+
+    def traced(*args, **kwargs):
+        # each call runs in its own copy, so concurrent calls do not share their spans
+        return context.copy().run(fn, *args, **kwargs)
+
+    return traced
+
+
+def emf_exporter(trace: Trace):
+    """Prints one CloudWatch Embedded Metric Format record per stage, dimensioned by stage name"""
+    namespace = os.getenv("AUTOLAB_METRICS_NAMESPACE", "Autolab")
+    timestamp = trace.root.start_ns // 1_000_000
+    timings = trace.timings()
+    stages = {trace.root.name: {"count": 1, "duration_s": timings["total_s"]}, **timings["stages"]}
+    for name, stage in stages.items():
+        values = {"Duration": stage["duration_s"] * 1000, "Count": stage["count"]}
+        units = {"Duration": "Milliseconds", "Count": "Count"}
+        for metric, unit in METRICS.items():
+            if metric in stage:
+                metric_name = "".join(part.capitalize() for part in metric.split("_"))
+                values[metric_name] = stage[metric]
+                units[metric_name] = unit
+        record = {
+            "_aws": {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": namespace,
+                        "Dimensions": [["Stage"]],
+                        "Metrics": [{"Name": metric, "Unit": unit} for metric, unit in units.items()],
+                    }
+                ],
+            },
+            "Stage": name,
+            "TraceId": trace.trace_id,
+            **{key: value for key, value in trace.root.attributes.items() if isinstance(value, (str, int, float))},
+            **values,
+        }
+        print(json.dumps(record), flush=True)
+
+
+def otel_exporter(trace: Trace):
+    """Sends the spans of the trace to the OpenTelemetry tracer provider of the process"""
+    try:
+        from opentelemetry import trace as otel
+    except ImportError:
+        raise Exception("Error: AUTOLAB_TRACE=otel needs the opentelemetry-api package")
+
+    tracer = otel.get_tracer("autolab")
+    otel_spans = {}
+    # parents start before their children
+    for span in sorted([trace.root] + trace.spans, key=lambda span: span.start_ns):
+        parent = otel_spans.get(id(span.parent))
+        context = otel.set_span_in_context(parent) if parent is not None else None
+        attributes = {key: value for key, value in span.attributes.items() if isinstance(value, (str, bool, int, float))}
+        otel_spans[id(span)] = tracer.start_span(
+            span.name, context=context, start_time=span.start_ns, attributes=attributes
+        )
+    for span in [trace.root] + trace.spans:
+        otel_spans[id(span)].end(end_time=span.start_ns + int(span.duration * 1e9))
+
+
+EXPORTERS = {"emf": emf_exporter, "otel": otel_exporter}
+
+
+def get_exporter(exporter=None) -> Optional[Callable[[Trace], None]]:
+    """Returns the exporter function of a name (or $AUTOLAB_TRACE), callables are returned as is"""
+    exporter = exporter or os.getenv("AUTOLAB_TRACE")
+    if not exporter or callable(exporter):
+        return exporter or None
+    if exporter not in EXPORTERS:
+        raise Exception("Error: Unknown trace exporter {}".format(exporter))
+    return EXPORTERS[exporter]
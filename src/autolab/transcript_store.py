@@ -0,0 +1,105 @@
+"""
+transcript_store.py
+
+This module contains the transcript store of the Autolab pipeline. Transcript segments are appended
+to the transcript .txt file as soon as their audio is transcribed, and only their offsets and times are
+kept in memory, so memory use does not grow with the length of the recording.
+
+Created: 10/18/2026
+
+"""
+import re
+from array import array
+from typing import Iterable, Iterator, Tuple
+
+SEGMENT_LINE = re.compile(r"^(.*) \[([\d.]+)-([\d.]+)\]$")
+
+
+def format_segment(text: str, start: float, end: float) -> str:
+    """Returns the line of the transcript file of a segment: its text followed by [start-end]"""
+    return f"{text} [{start}-{end}]\n"
+
+
+def parse_segment(line: str) -> Tuple[str, float, float]:
+    """Returns the (text, start, end) of a line of a transcript file, the inverse of format_segment"""
+    match = SEGMENT_LINE.match(line.rstrip("\n"))
+    if match is None:
+        raise Exception("Error: Invalid transcript line {!r}".format(line))
+    return match.group(1), float(match.group(2)), float(match.group(3))
+
+
+class TranscriptStore:
+    """Append-only transcript backed by a text file, one segment per line.
+
+    The text of each segment lives only in the file. In memory the store keeps a struct of arrays:
+    the byte offset and text length of each line and the start and end time of each segment.
+    """
+
+    def __init__(self, path: str):
+        """Constructor - creates (or truncates) the transcript file
+
+        Args:
+            path (str): transcript .txt file, read by TranscriptConversion.generateInstructions
+        """
+        self.path = path
+        self._file = open(path, "wb")
+        self._size = 0
+        self.offsets = array("Q")
+        self.text_lengths = array("L")
+        self.starts = array("d")
+        self.ends = array("d")
+
+    def append(self, text: str, start: float, end: float):
+        """Appends a segment to the end of the transcript file"""
+        # one segment per line
+        text = text.replace("\n", " ")
+        line = format_segment(text, start, end).encode()
+        self._file.write(line)
+        self.offsets.append(self._size)
+        self.text_lengths.append(len(text.encode()))
+        self.starts.append(start)
+        self.ends.append(end)
+        self._size += len(line)
+
+    def extend(self, segments: Iterable[Tuple[str, float, float]]):
+        """Appends (text, start, end) segments in order"""
+        for text, start, end in segments:
+            self.append(text, start, end)
+
+    def flush(self):
+        """Writes buffered segments to the file so it can be read"""
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> Tuple[str, float, float]:
+        """Returns the (text, start, end) of a segment, reading only its text from the file"""
+        self.flush()
+        with open(self.path, "rb") as fd:
+            fd.seek(self.offsets[index])
+            text = fd.read(self.text_lengths[index]).decode()
+        return text, self.starts[index], self.ends[index]
+
+    def lines(self) -> Iterator[str]:
+        """Yields the formatted lines of the transcript one at a time, streaming them from the file"""
+        self.flush()
+        with open(self.path, "rb") as fd:
+            for _, line in zip(self.offsets, fd):
+                yield line.decode()
+
+    def __iter__(self) -> Iterator[Tuple[str, float, float]]:
+        """Yields the (text, start, end) of every segment in order, streaming their text from the file"""
+        self.flush()
+        with open(self.path, "rb") as fd:
+            for length, start, end, line in zip(self.text_lengths, self.starts, self.ends, fd):
+                yield line[:length].decode(), start, end
@@ -0,0 +1,270 @@
+"""
+vad.py
+
+This module contains an energy based voice activity detector used to send only the speech
+regions of a recording to SpeechToText, packed into chunks that fit the synchronous recognizer.
+Frame energies can be computed over streamed PCM (see FrameEnergy), so long recordings are never
+decoded into memory as a whole.
+
+Created: 10/18/2026
+
+"""
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# (start, end) of a speech region in seconds of the original recording
+Region = Tuple[float, float]
+
+# (chunk_offset, source_start, duration): a region placed at chunk_offset seconds inside a chunk,
+# see AudioSegment.source_time for the mapping back to the original recording
+RegionMap = Tuple[float, float, float]
+
+
+# frames quieter than this are never speech, whatever the noise floor of the recording
+MIN_THRESHOLD_DB = -50.0
+# frames louder than this are always speech, so a recording that is speech in most frames keeps it
+MAX_THRESHOLD_DB = -35.0
+# below this spread between the loud (90th percentile) and quiet (10th percentile) frames, a recording is all
+# silence or all speech and its quiet frames are not a noise floor
+MIN_SPREAD_DB = 6.0
+
+
+def frame_energy_db(samples: np.ndarray, frame_length: int) -> np.ndarray:
+    """
+        Computes the RMS energy of consecutive, non-overlapping frames in dB relative to full scale
+
+    Args:
+        samples      (np.ndarray): 16-bit PCM samples
+        frame_length (int): number of samples per frame (a trailing partial frame is dropped)
+
+    Return:
+        energy (np.ndarray): energy of each frame in dBFS
+    """
+    n_frames = len(samples) // frame_length
+    if n_frames == 0:
+        return np.empty(0)
+    frames = samples[: n_frames * frame_length].reshape(n_frames, frame_length).astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-10))
+
+
+class FrameEnergy:
+    """Frame energies of 16-bit mono PCM that arrives in chunks (e.g. from an ffmpeg pipe), so a recording is
+    analysed without holding its samples in memory. Only the energies are kept, 4 bytes per frame."""
+
+    def __init__(self, sample_rate: int, frame_ms: int = 30):
+        """Constructor
+
+        Args:
+            sample_rate (int): sample rate of the PCM in Hz
+            frame_ms    (int): length of the analysis frames
+        """
+        self.sample_rate = sample_rate
+        self.frame_length = max(1, sample_rate * frame_ms // 1000)
+        self.bytes = 0
+        # bytes of the frame cut by the end of the last chunk
+        self._rest = b""
+        self._energy = []
+
+    def update(self, pcm: bytes):
+        """Adds the next chunk of PCM, of any length"""
+        self.bytes += len(pcm)
+        data = self._rest + pcm
+        frame_bytes = self.frame_length * 2
+        end = len(data) // frame_bytes * frame_bytes
+        self._rest = data[end:]
+        if end:
+            samples = np.frombuffer(data, dtype=np.int16, count=end // 2)
+            self._energy.append(frame_energy_db(samples, self.frame_length).astype(np.float32))
+
+    @property
+    def energy(self) -> np.ndarray:
+        """Energy of each complete frame so far, in dBFS"""
+        return np.concatenate(self._energy) if self._energy else np.empty(0, dtype=np.float32)
+
+    @property
+    def duration(self) -> float:
+        """Seconds of PCM added so far"""
+        return self.bytes // 2 / self.sample_rate
+
+
+def speech_threshold(energy: np.ndarray) -> float:
+    """
+        Picks the energy above which a frame is speech: 12 dB above the noise floor (10th percentile of the frame
+        energies), between MIN_THRESHOLD_DB and MAX_THRESHOLD_DB. A recording with a single level throughout has
+        no noise floor to measure, its frames louder than MIN_THRESHOLD_DB are speech.
+
+    Args:
+        energy (np.ndarray): energy of each frame in dBFS
+
+    Return:
+        threshold_db (float): threshold in dBFS
+    """
+    quiet, loud = np.percentile(energy, [10, 90])
+    if loud - quiet < MIN_SPREAD_DB:
+        return MIN_THRESHOLD_DB
+    return float(np.clip(quiet + 12.0, MIN_THRESHOLD_DB, MAX_THRESHOLD_DB))
+
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the start (inclusive) and end (exclusive) indices of the runs of True in mask"""
+    padded = np.concatenate(([False], mask, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    return changes[0::2], changes[1::2]
+
+
+def detect_speech(
+    samples: np.ndarray,
+    sample_rate: int,
+    frame_ms: int = 30,
+    threshold_db: float = None,
+    min_speech_ms: int = 250,
+    min_silence_ms: int = 500,
+    padding_ms: int = 200,
+) -> List[Region]:
+    """
+        Finds the speech regions of a recording held in memory (see speech_regions for streamed audio)
+
+    Args:
+        samples        (np.ndarray): 16-bit mono PCM samples
+        sample_rate    (int): sample rate of samples in Hz
+        frame_ms       (int): length of the analysis frames
+        threshold_db   (float): energy above which a frame is speech. Defaults to speech_threshold
+        min_speech_ms  (int): speech runs shorter than this are dropped as clicks or bumps
+        min_silence_ms (int): silences shorter than this do not split a region (pauses between words)
+        padding_ms     (int): silence kept around each region so words are not clipped
+
+    Return:
+        regions (List[Region]): sorted, non-overlapping (start, end) speech regions in seconds
+    """
+    meter = FrameEnergy(sample_rate, frame_ms)
+    energy = frame_energy_db(samples, meter.frame_length)
+    return speech_regions(
+        energy,
+        len(samples) / sample_rate,
+        meter.frame_length / sample_rate,
+        threshold_db=threshold_db,
+        min_speech_ms=min_speech_ms,
+        min_silence_ms=min_silence_ms,
+        padding_ms=padding_ms,
+    )
+
+
+def speech_regions(
+    energy: np.ndarray,
+    duration: float,
+    frame_seconds: float,
+    threshold_db: float = None,
+    min_speech_ms: int = 250,
+    min_silence_ms: int = 500,
+    padding_ms: int = 200,
+) -> List[Region]:
+    """
+        Finds the speech regions of a recording from the energies of its frames (see FrameEnergy)
+
+    Args:
+        energy         (np.ndarray): energy of each frame in dBFS
+        duration       (float): length of the recording in seconds
+        frame_seconds  (float): length of a frame in seconds
+        threshold_db   (float): energy above which a frame is speech. Defaults to speech_threshold
+        min_speech_ms  (int): speech runs shorter than this are dropped as clicks or bumps
+        min_silence_ms (int): silences shorter than this do not split a region (pauses between words)
+        padding_ms     (int): silence kept around each region so words are not clipped
+
+    Return:
+        regions (List[Region]): sorted, non-overlapping (start, end) speech regions in seconds
+    """
+    if len(energy) == 0:
+        return []
+
+    if threshold_db is None:
+        threshold_db = speech_threshold(energy)
+    speech = energy > threshold_db
+    frame_ms = frame_seconds * 1000
+
+    # fill short silences between speech frames
+    starts, ends = _runs(~speech)
+    short = (ends - starts) * frame_ms < min_silence_ms
+    interior = (starts > 0) & (ends < len(speech))
+    for start, end in zip(starts[short & interior], ends[short & interior]):
+        speech[start:end] = True
+
+    # drop short bursts
+    starts, ends = _runs(speech)
+    keep = (ends - starts) * frame_ms >= min_speech_ms
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return []
+
+    padding = padding_ms / 1000.0
+    region_starts = np.maximum(starts * frame_seconds - padding, 0.0)
+    region_ends = np.minimum(ends * frame_seconds + padding, duration)
+
+    # padding can make neighbouring regions overlap
+    regions = []
+    for start, end in zip(region_starts.tolist(), region_ends.tolist()):
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], max(regions[-1][1], end))
+        else:
+            regions.append((start, end))
+    return regions
+
+
+def pack_regions(
+    regions: Sequence[Region], max_chunk_seconds: float = 55.0, gap_seconds: float = 0.25
+) -> List[List[RegionMap]]:
+    """
+        Packs speech regions into chunks no longer than max_chunk_seconds, in order.
+        Regions longer than a chunk are split across chunks.
+
+    Args:
+        regions           (Sequence[Region]): sorted speech regions in seconds
+        max_chunk_seconds (float): maximum length of a chunk (below the recognizer's sync limit)
+        gap_seconds       (float): silence inserted between regions inside a chunk
+
+    Return:
+        chunks (List[List[RegionMap]]): for each chunk, where each region is placed inside it
+    """
+    chunks = []
+    chunk = []
+    offset = 0.0
+    for start, end in regions:
+        while end - start > 1e-6:
+            if chunk:
+                offset += gap_seconds
+            available = max_chunk_seconds - offset
+            if available <= 0:
+                chunks.append(chunk)
+                chunk, offset = [], 0.0
+                available = max_chunk_seconds
+            piece = min(end - start, available)
+            chunk.append((offset, start, piece))
+            offset += piece
+            start += piece
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def extract_chunk(samples: np.ndarray, sample_rate: int, region_map: Sequence[RegionMap]) -> np.ndarray:
+    """
+        Builds the audio of a chunk from the regions placed in it, with silence in the gaps
+
+    Args:
+        samples     (np.ndarray): 16-bit mono PCM samples of the whole recording, e.g. a np.memmap of decoded audio
+        sample_rate (int): sample rate of samples in Hz
+        region_map  (Sequence[RegionMap]): regions of the chunk, as returned by pack_regions
+
+    Return:
+        chunk (np.ndarray): 16-bit mono PCM samples of the chunk
+    """
+    last_offset, _, last_duration = region_map[-1]
+    chunk = np.zeros(int(round((last_offset + last_duration) * sample_rate)), dtype=np.int16)
+    for offset, start, duration in region_map:
+        source = samples[int(round(start * sample_rate)) : int(round((start + duration) * sample_rate))]
+        destination = int(round(offset * sample_rate))
+        source = source[: len(chunk) - destination]
+        chunk[destination : destination + len(source)] = source
+    return chunk
+
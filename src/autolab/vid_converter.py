@@ -3,18 +3,282 @@ vid_converter.py
 
 This module has the code to convert input video files into a specified audio file.
 
-NOTE: This module only does flac conversion at the moment, and needs to be
-      updated to handle other conversion types
+NOTE: The encodings tuned for SpeechToText are listed in AUDIO_PROFILES
 
 Created: 07/11/2023
 """
 
+import bisect
 import ffmpeg
+import io
+import math
 import os
+import re
+import threading
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
 
+# length of the slices sent to the synchronous SpeechToText recognizer
+SEGMENT_SECONDS = 60
 
-# TODO this does not allow for any other type of audio conversion other than .flac.
-#      Further implementation is required
+
+class AudioProfile(NamedTuple):
+    """An audio encoding used for the files sent to SpeechToText"""
+
+    name: str
+    # file extension of the encoded audio, also selects ffmpeg's muxer
+    extension: str
+    # encoding as named by the recognizer, see SpeechToText.SUPPORTED_ENCODINGS
+    encoding: str
+    # approximate size of the encoded audio, used to rank profiles
+    kbps: int
+    # ffmpeg output arguments, -vn and the first audio stream are always added
+    output_args: dict = {}
+
+
+# Speech recognition does not use anything above 16 kHz mono, so resampling and downmixing
+# before upload is free accuracy-wise and cuts the uploaded bytes several times over
+AUDIO_PROFILES = {
+    profile.name: profile
+    for profile in (
+        AudioProfile(
+            "stt-16k-mono-flac", "flac", "flac", 180, {"acodec": "flac", "ar": 16000, "ac": 1}
+        ),
+        AudioProfile(
+            "stt-16k-mono-wav", "wav", "linear16", 256, {"acodec": "pcm_s16le", "ar": 16000, "ac": 1}
+        ),
+        AudioProfile(
+            "stt-opus-low",
+            "ogg",
+            "ogg_opus",
+            24,
+            {"acodec": "libopus", "audio_bitrate": "24k", "ar": 16000, "ac": 1, "application": "voip"},
+        ),
+    )
+}
+
+
+# ffmpeg encoders whose output is reported by ffprobe under another codec name
+DECODED_CODECS = {"libopus": "opus", "libmp3lame": "mp3", "libvorbis": "vorbis"}
+
+# paths a conversion can take, from cheapest to most expensive
+COPY = "copy"  # the audio track is copied into the container it is already in
+REMUX = "remux"  # the audio track is copied into another container, e.g. out of the mp4
+TRANSCODE = "transcode"  # the audio is decoded and encoded again
+
+
+class ConversionPlan(NamedTuple):
+    """How the audio of an input is converted to the requested encoding"""
+
+    path: str
+    # ffmpeg output arguments, always selecting the first audio stream only
+    output_args: dict
+    extension: str
+    # why the audio cannot be copied, for TRANSCODE
+    reason: str = None
+
+    def metrics(self) -> dict:
+        """Span attributes counting the path taken, see tracing.METRICS"""
+        return {"conversion": self.path, f"audio_{self.path}": 1}
+
+
+def _bit_rate(value) -> Optional[int]:
+    """Parses an ffmpeg bit rate such as "24k" or 24000"""
+    if value is None:
+        return None
+    value = str(value).lower()
+    if value.endswith("k"):
+        return int(float(value[:-1]) * 1000)
+    return int(float(value))
+
+
+def plan_conversion(info: dict, codec: str = "flac", profile=None, allow_copy: bool = True) -> ConversionPlan:
+    """
+        Picks the cheapest way to convert an input to the requested encoding
+
+    The audio track is stream copied when ffprobe reports that it already has the codec, sample rate and channels
+    of the requested encoding (and, for lossy profiles, no higher bit rate), otherwise it is transcoded. The video
+    stream is never read past the demuxer.
+
+    Args:
+        info       (dict): ffprobe output of the input (see probe)
+        codec      (str): audio codec to convert to when profile is None
+        profile    (str or AudioProfile, optional): AUDIO_PROFILES entry to convert to
+        allow_copy (bool): False always transcodes, e.g. for outputs cut by seeking, since a stream copy can only
+                           be cut on packet boundaries
+
+    Return:
+        plan (ConversionPlan): the path taken and its ffmpeg output arguments
+    """
+    if profile is None:
+        target_args, extension = {"acodec": codec}, codec
+    else:
+        profile = get_profile(profile)
+        target_args, extension = profile.output_args, profile.extension
+    transcode_args = {"vn": None, "map": "0:a:0", **target_args}
+    if not allow_copy:
+        return ConversionPlan(TRANSCODE, transcode_args, extension, "sample accurate cuts")
+
+    audio = next((stream for stream in info.get("streams", []) if stream.get("codec_type") == "audio"), None)
+    if audio is None:
+        return ConversionPlan(TRANSCODE, transcode_args, extension, "no audio stream")
+
+    encoder = target_args.get("acodec")
+    checks = (
+        ("codec", DECODED_CODECS.get(encoder, encoder), audio.get("codec_name"), lambda want, have: want == have),
+        ("sample rate", target_args.get("ar"), audio.get("sample_rate"), lambda want, have: int(have) == int(want)),
+        ("channels", target_args.get("ac"), audio.get("channels"), lambda want, have: int(have) == int(want)),
+        (
+            "bit rate",
+            _bit_rate(target_args.get("audio_bitrate")),
+            audio.get("bit_rate"),
+            lambda want, have: int(have) <= want,
+        ),
+    )
+    for name, want, have, matches in checks:
+        if want is not None and (have is None or not matches(want, have)):
+            return ConversionPlan(TRANSCODE, transcode_args, extension, f"{name} {have} instead of {want}")
+
+    copy_args = {"vn": None, "map": "0:a:0", "acodec": "copy"}
+    # ffprobe lists the names of the demuxer, e.g. "mov,mp4,m4a,3gp,3g2,mj2"
+    formats = info.get("format", {}).get("format_name", "").split(",")
+    return ConversionPlan(COPY if extension in formats else REMUX, copy_args, extension)
+
+
+def smallest_profile(supported_encodings) -> AudioProfile:
+    """
+        Picks the audio profile with the smallest output among those the recognizer accepts
+
+    Args:
+        supported_encodings (Iterable[str]): encodings accepted by the recognizer
+
+    Return:
+        profile (AudioProfile): the smallest accepted profile
+    """
+    accepted = [profile for profile in AUDIO_PROFILES.values() if profile.encoding in supported_encodings]
+    if not accepted:
+        raise Exception("Error: No audio profile matches the encodings {}".format(sorted(supported_encodings)))
+    return min(accepted, key=lambda profile: profile.kbps)
+
+
+def get_profile(profile) -> AudioProfile:
+    """Returns the AudioProfile named profile (AudioProfile instances are returned as is)"""
+    if isinstance(profile, AudioProfile):
+        return profile
+    if profile not in AUDIO_PROFILES:
+        raise Exception("Error: Unknown audio profile {}".format(profile))
+    return AUDIO_PROFILES[profile]
+
+
+class AudioSegment(NamedTuple):
+    """A slice of the input audio, either held in memory or stored on disk"""
+
+    index: int
+    start: float
+    duration: float
+    path: str = None
+    content: bytes = None
+    # set for segments built from speech regions, see vad.pack_regions
+    region_map: tuple = None
+
+    def read(self) -> bytes:
+        """Returns the encoded audio of this segment, reading it from disk if needed"""
+        if self.content is not None:
+            return self.content
+        with open(self.path, "rb") as fd:
+            return fd.read()
+
+    def source_time(self, segment_time: float) -> float:
+        """
+        Maps a time inside this segment (e.g. a transcript offset) to the time in the original recording.
+        For segments packed from speech regions, times in the gap after a region are clamped to its end.
+        """
+        if self.region_map is None:
+            return self.start + segment_time
+
+        offsets = [offset for offset, _, _ in self.region_map]
+        i = max(bisect.bisect_right(offsets, segment_time) - 1, 0)
+        offset, start, duration = self.region_map[i]
+        return start + min(max(segment_time - offset, 0.0), duration)
+
+
+def encode_wav(pcm: bytes, sample_rate: int) -> bytes:
+    """Wraps 16-bit mono PCM in a WAV header so that SpeechToText can auto detect its encoding"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+# ffprobe results of recently probed inputs, see probe
+PROBE_CACHE_SIZE = 256
+_probe_cache = OrderedDict()
+_probe_lock = threading.Lock()
+
+
+def probe(path: str) -> dict:
+    """
+        Returns the ffprobe output of a media file. Results are cached per input: local files by path, size and
+        modification time, so a rewritten file is probed again, and URLs by URL.
+    """
+    if is_url(path):
+        key = path
+    else:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _probe_lock:
+        if key in _probe_cache:
+            _probe_cache.move_to_end(key)
+            return _probe_cache[key]
+
+    info = ffmpeg.probe(path)
+    with _probe_lock:
+        _probe_cache[key] = info
+        if len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return info
+
+
+def probe_duration(path: str) -> float:
+    """Returns the duration of a media file in seconds, as reported by ffprobe"""
+    return float(probe(path)["format"]["duration"])
+
+
+def available_cores() -> int:
+    """Returns the number of cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def plan_segments(duration: float, segment_seconds: int = SEGMENT_SECONDS) -> List[Tuple[float, Optional[float]]]:
+    """
+        Plans the seek-based segments of an input of the given duration
+
+    Args:
+        duration        (float): duration of the input in seconds
+        segment_seconds (int): length of each segment
+
+    Return:
+        segments (List[Tuple[float, Optional[float]]]): (start, length) of each segment. Segments start exactly
+                                                        where the previous one ends, the last one has no length
+                                                        and runs to the end of the input
+    """
+    # a duration a hair above a multiple of segment_seconds does not deserve a segment of its own
+    count = max(1, math.ceil(round(duration / segment_seconds, 6)))
+    return [(index * segment_seconds, segment_seconds if index < count - 1 else None) for index in range(count)]
+
+
+def is_url(path: str) -> bool:
+    """Returns True if path is an http(s) URL rather than a local file path"""
+    return urlparse(path).scheme in ("http", "https")
 
 
 class VideoConverter:
@@ -24,15 +288,53 @@ class VideoConverter:
         """Constructor
 
         Args:
-            input_dir   (string): input file path for video that we want to convert
+            input_dir   (string): input file path for video that we want to convert, or an
+                                  http(s) URL (e.g. a signed Supabase URL) that ffmpeg reads
+                                  directly with range requests instead of staging it on disk
         """
         self.cwd = os.getcwd()
 
-        if not os.path.isfile(input_dir):
+        self.is_remote = is_url(input_dir)
+        if not self.is_remote and not os.path.isfile(input_dir):
             raise Exception("Error: Cannot validate existence of {}".format(input_dir))
         self.input_dir = input_dir
 
-    def generateAudio(self, output_dir, codec="flac", quiet=True):
+        # name of the input without its extension (or URL query string), used to name outputs
+        path = urlparse(input_dir).path if self.is_remote else input_dir
+        self.base_name = os.path.splitext(os.path.basename(path))[0]
+
+        # plan of the last conversion, see plan_conversion
+        self.conversion = None
+
+    def _input(self, **input_args):
+        """Returns the ffmpeg input node of the video, with extra input options (e.g. ss)"""
+        if self.is_remote:
+            # ffmpeg only fetches the byte ranges it needs to demux and reconnects on dropped connections
+            return ffmpeg.input(self.input_dir, reconnect=1, reconnect_delay_max=5, **input_args)
+        return ffmpeg.input(self.input_dir, **input_args)
+
+    def plan_conversion(self, codec: str = "flac", profile=None, allow_copy: bool = True) -> ConversionPlan:
+        """
+            Probes the input and picks the cheapest conversion to a codec or an audio profile (see plan_conversion).
+            Inputs that cannot be probed, or that must be transcoded (allow_copy=False), are transcoded.
+        """
+        if not allow_copy:
+            self.conversion = plan_conversion({}, codec, profile, allow_copy=False)
+            return self.conversion
+        try:
+            info = probe(self.input_dir)
+        except Exception as e:
+            info = {}
+            reason = f"probe failed: {e}"
+        else:
+            reason = None
+        plan = plan_conversion(info, codec, profile)
+        if reason is not None:
+            plan = plan._replace(reason=reason)
+        self.conversion = plan
+        return plan
+
+    def generateAudio(self, output_dir, codec="flac", quiet=True, profile=None):
         """
             Converts our video into specified audio format
 
@@ -42,20 +344,27 @@ class VideoConverter:
             quiet       (bool): controls ffmpeg's console output
                                     True: silence output
                                     False: allow output to print
+            profile     (string): name of an AUDIO_PROFILES entry, overrides codec with the
+                                  profile's codec, sample rate and channels (output_dir should
+                                  use the profile's extension)
 
         Return:
-            None
+            plan        (ConversionPlan): how the audio was converted. The audio track is stream copied when it
+                                          already has the requested encoding
 
         """
+        plan = self.plan_conversion(codec, profile)
 
-        {ffmpeg.input(self.input_dir).output(output_dir, acodec=codec).run(quiet=quiet)}
+        {self._input().output(output_dir, **plan.output_args).run(quiet=quiet)}
+        return plan
 
     def split_and_convert(
-        self, output_dir: str, codec: str = "flac", quiet: bool = True
-    ):
+        self, output_dir: str, codec: str = "flac", quiet: bool = True, profile: str = None, max_workers: int = 1
+    ) -> List[str]:
         """
         Splits the input .mp4 file into 60-second segments and converts them to the specified audio codec. The output
         files will be named like the original file with an appended sequence number and stored in `output_dir`.
+        The plan of the conversion is left in `self.conversion`.
 
         Parameters
         ----------
@@ -65,23 +374,235 @@ class VideoConverter:
             The audio codec to which the .mp4 file will be converted (default is "flac").
         quiet : bool, optional
             A flag to control if console output occurs (default is True).
+        profile : str, optional
+            Name of an AUDIO_PROFILES entry. When set it replaces `codec`, and the segments use the
+            profile's extension.
+        max_workers : int, optional
+            Number of segments converted at once. 1 (the default) decodes the input sequentially with one ffmpeg
+            process. Above 1, or None for one per available core, the duration is probed and each segment is
+            converted by its own single-threaded ffmpeg process that seeks to its start (see
+            `split_and_convert_parallel`).
+
+        Returns
+        -------
+        List[str]
+            Paths of the generated segments, ordered by segment index.
 
         Raises
         ------
         ffmpeg.Error
             If an error occurs while splitting and converting the .mp4 file.
         """
-        base_name = os.path.splitext(os.path.basename(self.input_dir))[0]
-        output_file_template = os.path.join(output_dir, f"{base_name}_%03d.{codec}")
+        if max_workers != 1:
+            return self.split_and_convert_parallel(output_dir, codec, quiet, profile, max_workers)
+
+        # audio already in the requested encoding is stream copied into the segments (see plan_conversion)
+        output_args, extension = self.plan_conversion(codec, profile)[1:3]
+        output_file_template = os.path.join(output_dir, f"{self.base_name}_%03d.{extension}")
 
         {
-            ffmpeg.input(self.input_dir)
+            self._input()
             .output(
                 output_file_template,
                 f="segment",
-                segment_time="60",
-                vn=None,
-                acodec=codec,
+                segment_time=str(SEGMENT_SECONDS),
+                **output_args,
             )
             .run(quiet=quiet)
         }
+        return self.list_segments(output_dir, codec=extension)
+
+    def split_and_convert_parallel(
+        self, output_dir: str, codec: str = "flac", quiet: bool = True, profile: str = None, max_workers: int = None
+    ) -> List[str]:
+        """
+        Converts the 60-second segments of the input concurrently, one single-threaded ffmpeg process per segment,
+        so that long recordings use every core instead of one. Segments are named and ordered like those of
+        `split_and_convert`.
+
+        Each process seeks to the start of its segment in the input and decodes from there. Seeking while
+        transcoding is sample accurate, so segment i covers exactly [60 * i, 60 * (i + 1)) seconds of the input
+        and the segments have no gap or overlap. The audio is therefore always transcoded, even when it already
+        has the requested encoding: a stream copy would be cut on packet boundaries.
+
+        Parameters
+        ----------
+        output_dir : str
+            The path to the directory where the output audio files will be saved.
+        codec : str, optional
+            The audio codec to which the .mp4 file will be converted (default is "flac").
+        quiet : bool, optional
+            A flag to control if console output occurs (default is True).
+        profile : str, optional
+            Name of an AUDIO_PROFILES entry. When set it replaces `codec`.
+        max_workers : int, optional
+            Maximum number of ffmpeg processes running at once (default is one per available core).
+
+        Returns
+        -------
+        List[str]
+            Paths of the generated segments, ordered by segment index.
+
+        Raises
+        ------
+        ffmpeg.Error
+            If the input cannot be probed or a segment cannot be converted.
+        """
+        output_args, extension = self.plan_conversion(codec, profile, allow_copy=False)[1:3]
+        plan = plan_segments(probe_duration(self.input_dir))
+
+        def convert(index: int) -> str:
+            start, length = plan[index]
+            path = os.path.join(output_dir, f"{self.base_name}_{index:03d}.{extension}")
+            segment_args = dict(output_args, threads=1)
+            if length is not None:
+                segment_args["t"] = length
+            self._input(ss=start, threads=1).output(path, **segment_args).run(quiet=quiet)
+            return path
+
+        # the threads only wait on their ffmpeg process, the conversions run in parallel in the processes
+        workers = max(1, min(len(plan), max_workers or available_cores()))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(convert, range(len(plan))))
+
+    def list_segments(self, output_dir: str, codec: str = "flac") -> List[str]:
+        """
+        Lists the segments previously generated by `split_and_convert` for this input.
+
+        Segments are ordered by the sequence number ffmpeg appended to their name rather than
+        by directory listing order, which is arbitrary.
+
+        Parameters
+        ----------
+        output_dir : str
+            The directory the segments were written to.
+        codec : str, optional
+            The audio codec (and file extension) of the segments (default is "flac").
+
+        Returns
+        -------
+        List[str]
+            Paths of the segments, ordered by segment index.
+        """
+        pattern = re.compile(rf"^{re.escape(self.base_name)}_(\d+)\.{re.escape(codec)}$")
+
+        segments = []
+        for filename in os.listdir(output_dir):
+            match = pattern.match(filename)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(output_dir, filename)))
+
+        return [path for _, path in sorted(segments)]
+
+    def stream_segments(
+        self,
+        segment_seconds: int = SEGMENT_SECONDS,
+        sample_rate: int = 16000,
+        quiet: bool = True,
+    ) -> Iterator[AudioSegment]:
+        """
+        Decodes the audio track through a pipe and yields it as in-memory segments. Nothing is written to disk.
+
+        ffmpeg writes 16-bit mono PCM to stdout, which is cut into `segment_seconds` slices and wrapped in a WAV
+        header so that SpeechToText can auto detect the encoding. Segment durations are computed from the number
+        of samples read, so the last (shorter) segment reports its exact length.
+
+        Parameters
+        ----------
+        segment_seconds : int, optional
+            Length of each yielded segment in seconds (default is 60).
+        sample_rate : int, optional
+            Sample rate of the decoded audio in Hz (default is 16000).
+        quiet : bool, optional
+            A flag to control if console output occurs (default is True).
+
+        Yields
+        ------
+        AudioSegment
+            In-memory WAV segments with their index, start time and duration, in order.
+
+        Raises
+        ------
+        ffmpeg.Error
+            If ffmpeg exits with an error while decoding the input.
+        """
+        bytes_per_second = sample_rate * 2  # 16-bit mono
+        start = 0.0
+        for index, pcm in enumerate(self._pipe_pcm(segment_seconds * bytes_per_second, sample_rate, quiet)):
+            duration = len(pcm) / bytes_per_second
+            yield AudioSegment(index=index, start=start, duration=duration, content=encode_wav(pcm, sample_rate))
+            start += duration
+
+    def stream_pcm(self, chunk_seconds: float = 10, sample_rate: int = 16000, quiet: bool = True) -> Iterator[bytes]:
+        """
+        Decodes the audio track to 16-bit mono PCM through a pipe and yields it in chunks, so that the whole
+        recording is never held in memory (e.g. for voice activity detection).
+
+        Parameters
+        ----------
+        chunk_seconds : float, optional
+            Seconds of audio in each chunk, the last one can be shorter (default is 10).
+        sample_rate : int, optional
+            Sample rate of the decoded audio in Hz (default is 16000).
+        quiet : bool, optional
+            A flag to control if console output occurs (default is True).
+
+        Yields
+        ------
+        bytes
+            Raw little-endian 16-bit mono samples, in order.
+
+        Raises
+        ------
+        ffmpeg.Error
+            If ffmpeg exits with an error while decoding the input.
+        """
+        return self._pipe_pcm(int(chunk_seconds * sample_rate) * 2, sample_rate, quiet)
+
+    def _pipe_pcm(self, chunk_bytes: int, sample_rate: int, quiet: bool) -> Iterator[bytes]:
+        """
+            Decodes the audio track to 16-bit mono PCM through a pipe, yielding chunk_bytes at a time (the last
+            chunk can be shorter). stderr is drained by a thread while stdout is read, so ffmpeg never blocks on
+            a full stderr pipe.
+
+        Args:
+            chunk_bytes (int): bytes in each chunk
+            sample_rate (int): sample rate of the decoded audio in Hz
+            quiet       (bool): capture ffmpeg's messages for the error instead of printing them
+
+        Return:
+            chunks (Iterator[bytes]): raw little-endian 16-bit mono samples, in order
+
+        Throws:
+            ffmpeg.Error if ffmpeg exits with an error
+        """
+        process = (
+            self._input()
+            .output("pipe:", format="s16le", acodec="pcm_s16le", ac=1, ar=sample_rate, vn=None)
+            .global_args("-nostats", "-loglevel", "error" if quiet else "info")
+            .run_async(pipe_stdout=True, pipe_stderr=quiet)
+        )
+        stderr = []
+        drain = None
+        if quiet:
+            drain = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+            drain.start()
+
+        try:
+            while True:
+                pcm = process.stdout.read(chunk_bytes)
+                if not pcm:
+                    break
+                yield pcm
+
+            if process.wait() != 0:
+                if drain is not None:
+                    drain.join()
+                raise ffmpeg.Error("ffmpeg", None, b"".join(stderr) if quiet else None)
+        finally:
+            # consumer stopped early or decoding failed
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            if drain is not None:
+                drain.join()
@@ -9,22 +9,183 @@ Usage:
 - At the moment, this file is not used directly. It is used by AWS Lambda to process a GET request containing a uid of a video file.
 """
 
-from autolab.autolab import Autolab
 import json
-from supabase import create_client, Client
 from dotenv import load_dotenv
 import os
 
+# tiktoken reads its BPE files from here instead of downloading them (bundled by build.sh)
+os.environ.setdefault(
+    "TIKTOKEN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiktoken_cache")
+)
+
 load_dotenv()
 url: str = os.getenv("SUPABASE_URL")
 service_key: str = os.getenv("SUPABASE_SERVICE_KEY")
-supabase: Client = create_client(url, service_key)
 bucket_name: str = os.getenv("SUPABASE_BUCKET_NAME")
 project_id: str = os.getenv("PROJECT_ID")
 recognizer_id: str = os.getenv("RECOGNIZER_ID")
 tmp_dir: str = os.getenv("TMP_DIR")
 config_path: str = f"{tmp_dir}/config.json"
-gpt_model: str = "gpt-4"
+# procedures have always been generated with gpt-3.5-turbo, switching models is a change of its own
+gpt_model: str = "gpt-3.5-turbo"
+# "download": the whole video is downloaded to tmp_dir before conversion
+# "stream": ffmpeg reads the video from a signed URL while it is being transcribed, nothing is staged in /tmp
+ingest_mode: str = os.getenv("INGEST_MODE", "download")
+signed_url_expires_in: int = int(os.getenv("SIGNED_URL_EXPIRES_IN", "3600"))
+# recordings longer than LONG_AUDIO_SECONDS are transcribed with BatchRecognize from this bucket
+gcs_bucket: str = os.getenv("GCS_BUCKET")
+long_audio_seconds: float = float(os.getenv("LONG_AUDIO_SECONDS", "900"))
+# speech-to-text engine used when a request does not pick one ("google" or "vosk")
+stt_engine: str = os.getenv("STT_ENGINE", "google")
+# SQLite job queue of asynchronous requests, it must be on storage shared by the API and the workers (e.g. an EFS
+# mount): a queue in the /tmp of one container is never seen by the others
+jobs_db: str = os.getenv("JOBS_DB")
+if not jobs_db:
+    raise Exception("Error: JOBS_DB must point at the job queue database on storage shared by the API and the workers")
+
+# Heavy modules and clients are created on first use and kept for warm invocations
+_supabase = None
+# one Autolab per speech-to-text engine
+_autolabs = {}
+_jobs = None
+
+
+def get_supabase():
+    """Returns the Supabase client, creating it on the first invocation of this container.
+    When a replay cassette is active (AUTOLAB_REPLAY) storage calls are recorded or replayed."""
+    global _supabase
+    if _supabase is None:
+        from autolab.replay import RECORD, ReplaySupabase, active_cassette
+
+        cassette = active_cassette()
+        if cassette is None or cassette.mode == RECORD:
+            from supabase import create_client
+
+            _supabase = create_client(url, service_key)
+        if cassette is not None:
+            _supabase = ReplaySupabase(cassette, _supabase)
+    return _supabase
+
+
+def signed_video_url(uid: str) -> str:
+    """Returns a signed URL of the video of a uid, that ffmpeg can read with range requests"""
+    from autolab.ratelimit import get_scheduler
+
+    storage = get_supabase().storage.from_(bucket_name)
+    return get_scheduler("storage").call(lambda: storage.create_signed_url(f"{uid}.mp4", signed_url_expires_in))[
+        "signedURL"
+    ]
+
+
+def get_autolab(engine: str = None):
+    """Returns the Autolab instance of an engine, creating it on the first invocation of this container that uses it"""
+    engine = engine or stt_engine
+    if engine not in _autolabs:
+        from autolab.autolab import Autolab
+
+        _autolabs[engine] = Autolab(
+            project_id,
+            recognizer_id,
+            gpt_model,
+            gcs_bucket=gcs_bucket,
+            long_audio_seconds=long_audio_seconds,
+            engine=engine,
+        )
+    return _autolabs[engine]
+
+
+def get_jobs():
+    """Returns the job queue of asynchronous requests, opening it on first use"""
+    global _jobs
+    if _jobs is None:
+        from autolab.jobs import JobQueue
+
+        _jobs = JobQueue(jobs_db)
+    return _jobs
+
+
+def process_job(job: dict, progress) -> dict:
+    """Runs the pipeline on the video of a job (see autolab.jobs.Worker), reporting each stage with progress.
+    Jobs are batch work, their remote calls wait for those of interactive requests (see autolab.ratelimit)."""
+    from autolab import ratelimit
+
+    uid = job["uid"]
+    autolab = get_autolab(job["params"].get("engine"))
+    with ratelimit.priority(ratelimit.BATCH):
+        result = autolab.generate_procedure_batch(
+            uid, tmp_dir, video_path=signed_video_url(uid), enable_logging=False, streaming=True, progress=progress
+        )
+    if "statusCode" in result:
+        # instruction generation failed, the job is retried
+        raise Exception(result["body"])
+    return result
+
+
+def _json_response(status_code: int, body: dict) -> dict:
+    return {"statusCode": status_code, "body": json.dumps(body), "headers": {"Content-Type": "application/json"}}
+
+
+def sse_event(event: dict) -> str:
+    """Encodes an event of Autolab.generate_procedure_stream as a Server-Sent Event"""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def stream_procedure(uid: str, engine: str = None, timings: bool = False):
+    """
+    Generates the procedure of a video as Server-Sent Events: the summary and each step as soon as GPT has written
+    them, then the whole result. stream_app sends each event as it is yielded; errors are sent as an "error" event.
+
+    Parameters:
+    uid (str): The supabase uid of the video
+    engine (str): speech-to-text engine, defaults to STT_ENGINE
+    timings (bool): attach the per-stage timings of the run to the result
+
+    Yields:
+    str: encoded events
+    """
+    from autolab import tracing
+
+    autolab = get_autolab(engine)
+    try:
+        with tracing.start_trace("lambda_handler", autolab.trace_exporter, uid=uid, streaming=True):
+            with tracing.span("download", mode="stream"):
+                signed_url = signed_video_url(uid)
+            for event in autolab.generate_procedure_stream(
+                uid, tmp_dir, video_path=signed_url, enable_logging=False, streaming=True, timings=timings
+            ):
+                yield sse_event(event)
+    except Exception as e:
+        yield sse_event({"type": "error", "error": str(e)})
+
+
+def stream_app(environ, start_response):
+    """
+    WSGI application that streams the procedure of a video as Server-Sent Events (see stream_procedure). The Python
+    Lambda runtime buffers the whole response of lambda_handler, so streaming runs behind a WSGI server instead,
+    e.g. gunicorn with the Lambda Web Adapter in response stream mode (AWS_LWA_INVOKE_MODE=response_stream).
+    Each event is sent as soon as it is yielded.
+
+    Parameters:
+    environ (dict): WSGI environment of a GET request with `uid`, and optionally `engine` and `timings`, in its
+                    query string
+    start_response (Callable): WSGI callback
+
+    Returns:
+    Iterable[bytes]: the encoded events
+    """
+    from urllib.parse import parse_qs
+
+    params = {name: values[0] for name, values in parse_qs(environ.get("QUERY_STRING", "")).items()}
+    if "uid" not in params:
+        start_response("400 Bad Request", [("Content-Type", "application/json")])
+        return [json.dumps({"error": "Missing uid"}).encode()]
+    timings = params.get("timings", "").lower() in ("1", "true")
+    # no buffering by proxies (X-Accel-Buffering) or caches, each event is sent as soon as it is written
+    start_response(
+        "200 OK",
+        [("Content-Type", "text/event-stream"), ("Cache-Control", "no-cache"), ("X-Accel-Buffering", "no")],
+    )
+    return (event.encode() for event in stream_procedure(params["uid"], params.get("engine"), timings))
 
 
 def generate_config(uid: str, storage_dir: str = tmp_dir):
@@ -56,9 +217,14 @@ def lambda_handler(event, context):
     This function is used as the AWS Lambda handler. It processes a GET request containing a uid of a video file,
     fetches the video file from a Supabase bucket, transcribes the video, and returns the transcript.
 
+    With `async=true` in the query string the video is queued instead (see autolab.jobs) and the response is
+    a 202 with the job id. A request with `job_id` instead of `uid` returns the status of that job.
+    Streamed responses (`stream=true`) are served by stream_app, since this runtime only sends complete responses.
+
     Parameters:
     event (dict): The event object passed by AWS Lambda. This should contain the video uid in
-                  event['queryStringParameters']['uid'].
+                  event['queryStringParameters']['uid'], and optionally the speech-to-text engine
+                  in event['queryStringParameters']['engine'].
 
     context (LambdaContext): The context object passed by AWS Lambda. It provides methods and properties
                              that provide information about the invocation, function, and execution environment.
@@ -68,21 +234,52 @@ def lambda_handler(event, context):
           if the processing was successful or an error message if an error occurred.
     """
 
+    from autolab import tracing
+    from autolab.ratelimit import get_scheduler
+
     try:
+        params = event["queryStringParameters"]
+        if "job_id" in params:
+            job = get_jobs().get(params["job_id"])
+            if job is None:
+                return _json_response(404, {"error": f"No job {params['job_id']}"})
+            return _json_response(200, job)
+        if params.get("async", "").lower() in ("1", "true"):
+            # submitting returns at once, a worker (worker_handler) runs the pipeline
+            engine = params.get("engine") or stt_engine
+            job_id = get_jobs().submit(params["uid"], engine=engine)
+            return _json_response(202, {"job_id": job_id, "status": get_jobs().get(job_id)["status"]})
+
         # Parse the uid from incoming event
         uid = event["queryStringParameters"]["uid"]
+        # ?timings=true attaches the per-stage timings of the run to the response
+        timings = event["queryStringParameters"].get("timings", "").lower() in ("1", "true")
+        if params.get("stream", "").lower() in ("1", "true"):
+            return _json_response(400, {"error": "Streamed responses are served by lambda_function.stream_app"})
 
-        # Fetch the video from Supabase and store it in tmp/
-        tmp_path = f"{tmp_dir}/{uid}.mp4"
-        with open(tmp_path, "wb") as f:
-            response = supabase.storage.from_(bucket_name).download(f"{uid}.mp4")
-            f.write(response)
+        autolab = get_autolab(event["queryStringParameters"].get("engine"))
+        with tracing.start_trace("lambda_handler", autolab.trace_exporter, uid=uid):
+            if ingest_mode == "stream":
+                # ffmpeg fetches the video over HTTP range requests, so conversion and transcription
+                # overlap with the download and the video size is not limited by /tmp
+                with tracing.span("download", mode="stream"):
+                    signed_url = signed_video_url(uid)
+                transcript_response = autolab.generate_procedure_batch(
+                    uid, tmp_dir, video_path=signed_url, enable_logging=False, streaming=True, timings=timings
+                )
+            else:
+                # Fetch the video from Supabase and store it in tmp/
+                tmp_path = f"{tmp_dir}/{uid}.mp4"
+                with tracing.span("download", mode="download") as span, open(tmp_path, "wb") as f:
+                    storage = get_supabase().storage.from_(bucket_name)
+                    response = get_scheduler("storage").call(lambda: storage.download(f"{uid}.mp4"))
+                    f.write(response)
+                    span.set(bytes=len(response))
 
-        # Generate transcript from autolab.py and return response
-        autolab = Autolab(project_id, recognizer_id, gpt_model)
-        transcript_response = autolab.generate_procedure(
-            uid, tmp_dir, enable_logging=False
-        )
+                # Generate transcript from autolab.py and return response
+                transcript_response = autolab.generate_procedure(
+                    uid, tmp_dir, enable_logging=False, timings=timings
+                )
         return {
             "statusCode": 200,
             "body": transcript_response,
@@ -93,3 +290,26 @@ def lambda_handler(event, context):
     # the error code (if its from supabase), but probably not worth it.
     except Exception as e:
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+
+
+def worker_handler(event, context):
+    """
+    AWS Lambda handler of the job workers (e.g. run on a schedule). Runs queued jobs until the queue is empty
+    or the invocation is about to time out.
+
+    Parameters:
+    event (dict): ignored
+    context (LambdaContext): used to stop claiming jobs before the invocation times out. None runs
+                             until the queue is empty.
+
+    Returns:
+    dict: number of jobs run
+    """
+    import time
+    from autolab.jobs import Worker
+
+    deadline = None
+    if context is not None:
+        # leave time for the last job, which resumes from its manifest if it is cut short
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000 * 0.5
+    return {"jobs": Worker(get_jobs(), process_job).run(drain=True, deadline=deadline)}
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+from autolab.vid_converter import VideoConverter
+
+# lambda_function refuses to start without a job queue on shared storage
+os.environ.setdefault("JOBS_DB", os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"))
+
+
+class FakeFFmpeg:
+    """Stands in for the ffmpeg node returned by VideoConverter._input, running a Python script as ffmpeg"""
+
+    def __init__(self, script):
+        self.script = script
+
+    def output(self, *args, **kwargs):
+        return self
+
+    def global_args(self, *args):
+        return self
+
+    def run_async(self, pipe_stdout=False, pipe_stderr=False):
+        return subprocess.Popen(
+            [sys.executable, "-c", self.script],
+            stdout=subprocess.PIPE if pipe_stdout else None,
+            stderr=subprocess.PIPE if pipe_stderr else None,
+        )
+
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    """fake_ffmpeg(script) makes the ffmpeg pipes of VideoConverter run a Python script instead"""
+
+    def install(script):
+        monkeypatch.setattr(VideoConverter, "_input", lambda self, **input_args: FakeFFmpeg(script))
+
+    return install
@@ -0,0 +1,80 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse
+
+from autolab.cache import LocalDirectoryStore, ResultCache
+
+
+def test_local_store_evicts_least_recently_used(tmp_path):
+    store = LocalDirectoryStore(str(tmp_path), max_bytes=10)
+    store.put("a", b"1234")
+    store.put("b", b"1234")
+    # reading "a" makes "b" the least recently used entry
+    assert store.get("a") == b"1234"
+    store.put("c", b"1234")
+
+    assert store.get("b") is None
+    assert store.get("a") == b"1234"
+    assert store.get("c") == b"1234"
+
+
+def test_local_store_reindexes_existing_entries(tmp_path):
+    LocalDirectoryStore(str(tmp_path)).put("a", b"value")
+    assert LocalDirectoryStore(str(tmp_path)).get("a") == b"value"
+
+
+def test_result_cache_round_trip(tmp_path):
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"not really a video")
+    cache = ResultCache(LocalDirectoryStore(str(tmp_path / "cache")))
+
+    content_hash = ResultCache.hash_file(str(video))
+    key = ResultCache.make_key("transcript", content_hash, recognizer_id="r1")
+    assert key != ResultCache.make_key("transcript", content_hash, recognizer_id="r2")
+
+    assert cache.get_transcript(key) is None
+    cache.put_transcript(key, [("hello", 0.0, 1.5)])
+    assert cache.get_transcript(key) == [("hello", 0.0, 1.5)]
+
+
+def serve(objects):
+    """Serves objects ({path: (body, headers)}) over HTTP, answering range requests, and returns the server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body, headers = objects[urlparse(self.path).path]
+            if "Range" in self.headers:
+                self.send_response(206)
+                body = body[:1]
+            else:
+                self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_hash_url_follows_the_version_of_the_object():
+    objects = {"/video.mp4": (b"video", {"ETag": '"v1"'}), "/plain.mp4": (b"plain video", {})}
+    server = serve(objects)
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        first = ResultCache.hash_url(f"{base}/video.mp4?token=a")
+        # signed URLs of the same object share a key
+        assert ResultCache.hash_url(f"{base}/video.mp4?token=b") == first
+        # replacing the object at the same location changes it
+        objects["/video.mp4"] = (b"other video", {"ETag": '"v2"'})
+        assert ResultCache.hash_url(f"{base}/video.mp4?token=a") != first
+        # without a version the whole object is hashed
+        assert ResultCache.hash_url(f"{base}/plain.mp4") == hashlib.sha256(b"plain video").hexdigest()
+    finally:
+        server.shutdown()
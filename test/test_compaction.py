@@ -0,0 +1,35 @@
+from autolab.compaction import CompactionSettings, compact_transcript, strip_fillers
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+
+def test_strip_fillers_keeps_content():
+    assert strip_fillers("Um, add the uh buffer") == "add the buffer"
+    assert strip_fillers("hmm") == ""
+    # units and words containing a filler are left alone
+    assert strip_fillers("pipette 5 mm from the umbrella") == "pipette 5 mm from the umbrella"
+
+
+def test_compaction_merges_short_segments_and_maps_them_back():
+    segments = [
+        ("um", 0.0, 0.8),
+        ("Add the buffer", 0.81234, 2.5),
+        ("add the buffer", 2.6, 4.1),
+        ("to the tube", 4.3, 6.0),
+        ("Now we vortex the sample for thirty seconds", 20.2, 35.4),
+        ("uh", 35.5, 36.0),
+    ]
+    compacted = compact_transcript(segments, WordEncoding(), CompactionSettings())
+
+    assert compacted.segments == [
+        ("Add the buffer to the tube", 0, 6),
+        ("Now we vortex the sample for thirty seconds", 20, 36),
+    ]
+    # every original segment belongs to one line
+    assert compacted.sources == [(0, 1, 2, 3), (4, 5)]
+    assert compacted.source_segments(19, 25) == [4, 5]
+    assert compacted.tokens_after < compacted.tokens_before
+    assert list(compacted.lines())[0] == "Add the buffer to the tube [0-6]\n"
@@ -0,0 +1,170 @@
+import os
+
+from autolab.autolab import Autolab
+from autolab.cache import LocalDirectoryStore, ResultCache
+from autolab.manifest import DONE
+from autolab.stt_engine import SpeechEngine
+
+
+class FakeEngine(SpeechEngine):
+    name = "fake"
+    SUPPORTED_ENCODINGS = frozenset(("flac",))
+
+
+def test_generate_procedures_yields_each_video_and_isolates_errors(tmp_path):
+    cache = ResultCache(LocalDirectoryStore(str(tmp_path / "cache")))
+    autolab = Autolab("project", "recognizer", "gpt-4", cache=cache, engine=FakeEngine())
+    autolab._generate_instructions = lambda store: {"procedure": [line for line in store.lines()]}
+
+    videos = {}
+    for uid in ("cached", "transcribed"):
+        videos[uid] = tmp_path / f"{uid}.mp4"
+        videos[uid].write_bytes(uid.encode())
+    keys = {uid: autolab._cache_keys(str(path), mode="batch", streaming=False, vad=False) for uid, path in videos.items()}
+    cache.put_instructions(keys["cached"]["instructions"], {"procedure": ["from cache"]})
+    cache.put_transcript(keys["transcribed"]["transcript"], [("add buffer", 0.0, 1.5)])
+
+    def fetch(uid, directory):
+        if uid == "missing":
+            raise Exception("Error: Object not found")
+        return str(videos[uid])
+
+    results = dict(
+        autolab.generate_procedures(
+            ["cached", "missing", "transcribed"], str(tmp_path / "tmp"), fetch=fetch, download_workers=1
+        )
+    )
+
+    assert results["cached"] == {"procedure": ["from cache"]}
+    assert results["transcribed"] == {"procedure": ["add buffer [0.0-1.5]\n"]}
+    assert isinstance(results["missing"], Exception)
+    assert (tmp_path / "tmp" / "transcribed" / "transcribed.txt").exists()
+
+
+def test_transcribe_segments_keeps_order_and_bounds_the_segments_in_flight():
+    import threading
+    import time
+
+    import pytest
+
+    from autolab.vid_converter import AudioSegment
+
+    lock = threading.Lock()
+    active, peak, pulled = [0], [0], [0]
+
+    class Engine(FakeEngine):
+        def transcribe(self, content, duration=None):
+            index = content[0]
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            # later segments of each window finish first
+            time.sleep(0.01 * (3 - index % 3))
+            with lock:
+                active[0] -= 1
+            if index == failing:
+                raise Exception(f"Error: segment {index} failed")
+            return [(f"segment {index}", 0.0, 1.0)]
+
+    def segments(count):
+        for index in range(count):
+            pulled[0] += 1
+            yield AudioSegment(index, float(index), 1.0, content=bytes([index]))
+
+    autolab = Autolab("project", "recognizer", "gpt-4", engine=Engine())
+    failing = None
+    received = []
+    for segment, transcript in autolab._transcribe_segments(autolab.stt_engine, segments(10), max_workers=3):
+        received.append(segment.index)
+        assert transcript == [(f"segment {segment.index}", 0.0, 1.0)]
+        # the segment just returned and at most two more are read ahead
+        assert pulled[0] - len(received) < 3
+    assert received == list(range(10))
+    assert peak[0] <= 3
+
+    failing = 4
+    with pytest.raises(Exception, match="segment 4 failed"):
+        list(autolab._transcribe_segments(autolab.stt_engine, segments(10), max_workers=3))
+
+
+def test_streaming_mode_transcribes_piped_segments_without_writing_audio(tmp_path, fake_ffmpeg):
+    import io
+    import wave
+
+    video = tmp_path / "lab.mp4"
+    video.write_bytes(b"video")
+    # 150.5 seconds of 16 kHz 16-bit mono PCM
+    fake_ffmpeg("import sys; sys.stdout.buffer.write(bytes(2 * 16000 * 150) + bytes(16000))")
+
+    class Engine(FakeEngine):
+        def transcribe(self, content, duration=None):
+            with wave.open(io.BytesIO(content)) as wav:
+                seconds = wav.getnframes() / wav.getframerate()
+            return [(f"{seconds} seconds", 1.0, seconds)]
+
+    autolab = Autolab("project", "recognizer", "gpt-4", engine=Engine())
+    autolab._generate_instructions = lambda store: {"procedure": [line for line in store.lines()]}
+    temp_dir = tmp_path / "tmp"
+    temp_dir.mkdir()
+    result = autolab.generate_procedure_batch("lab", str(temp_dir), video_path=str(video), streaming=True)
+
+    assert result == {
+        "procedure": ["60.0 seconds [1.0-60.0]\n", "60.0 seconds [61.0-120.0]\n", "30.5 seconds [121.0-150.5]\n"]
+    }
+    # only the manifest and the transcript, no audio segments
+    assert sorted(os.listdir(temp_dir)) == ["lab.manifest.jsonl", "lab.txt"]
+
+
+def test_generate_procedure_parts_offsets_parts_and_processes_appended_parts_only(tmp_path, monkeypatch):
+    import autolab.autolab as autolab_module
+
+    autolab = Autolab("project", "recognizer", "gpt-4", engine=FakeEngine())
+    autolab._generate_instructions = lambda store: {"procedure": [line for line in store.lines()]}
+
+    parts, durations = [], {}
+    for name, duration in (("sec1", 61.25), ("sec2", 30.5), ("sec3", 10.0)):
+        path = tmp_path / f"{name}.mp4"
+        path.write_bytes(name.encode())
+        parts.append(str(path))
+        durations[str(path)] = duration
+    monkeypatch.setattr(autolab_module, "probe_duration", lambda path: durations[path])
+
+    transcribed = []
+
+    def transcribe_batch(uid, temp_dir, video_path, cwd, store=None, **kwargs):
+        transcribed.append(video_path)
+        # every part starts at 0
+        store.append(video_path.rsplit("/", 1)[-1], 1.0, 2.5)
+
+    autolab._transcribe_batch = transcribe_batch
+    temp_dir = str(tmp_path / "tmp")
+
+    result = autolab.generate_procedure_parts("lab", parts[:2], temp_dir, part_workers=2)
+    assert sorted(transcribed) == parts[:2]
+    assert result == {"procedure": ["sec1.mp4 [1.0-2.5]\n", "sec2.mp4 [62.25-63.75]\n"]}
+
+    # a part uploaded later is the only one transcribed again
+    result = autolab.generate_procedure_parts("lab", parts, temp_dir)
+    assert transcribed[2:] == parts[2:]
+    assert result["procedure"][-1] == "sec3.mp4 [92.75-94.25]\n"
+    assert (tmp_path / "tmp" / "lab.txt").read_text().count("\n") == 3
+
+
+def test_audio_keeps_acodec_unless_the_smallest_profile_is_opted_in():
+    autolab = Autolab("project", "recognizer", "gpt-4", engine="google")
+    assert autolab.audio_profile is None and autolab.audio_extension == "flac"
+
+    autolab = Autolab("project", "recognizer", "gpt-4", engine="google", audio_profile="auto")
+    assert autolab.audio_profile == "stt-opus-low"
+
+
+def test_url_parts_are_compared_by_the_version_of_their_object(monkeypatch):
+    autolab = Autolab("project", "recognizer", "gpt-4", engine=FakeEngine())
+    versions = {"https://storage.example/sec1.mp4": "v1"}
+    monkeypatch.setattr(Autolab, "_content_hash", staticmethod(lambda url: versions[url.split("?")[0]]))
+    record = {"status": DONE, "part": "https://storage.example/sec1.mp4?token=a", "content": "v1"}
+
+    # a new signed URL of the same object
+    assert autolab._part_unchanged("https://storage.example/sec1.mp4?token=b", record)
+    versions["https://storage.example/sec1.mp4"] = "v2"
+    assert not autolab._part_unchanged("https://storage.example/sec1.mp4?token=a", record)
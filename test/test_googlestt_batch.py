@@ -0,0 +1,140 @@
+from concurrent import futures
+
+import grpc
+import pytest
+from google.cloud import speech_v2
+from google.cloud.speech_v2.services.speech.transports import SpeechGrpcTransport
+from google.longrunning import operations_pb2
+from google.protobuf import any_pb2
+
+from autolab.googlestt import SpeechToText
+
+AUDIO_URI = "gs://autolab-audio/uid.ogg"
+
+
+class FakeSpeechService:
+    """Serves BatchRecognize and GetOperation like the Speech v2 API, finishing after a few polls"""
+
+    def __init__(self, polls_until_done=2, error=None):
+        self.polls_until_done = polls_until_done
+        self.error = error
+        self.requests = []
+        self.polls = 0
+
+    def batch_recognize(self, request, context):
+        self.requests.append(request)
+        return operations_pb2.Operation(name="operations/batch-1")
+
+    def get_operation(self, request, context):
+        self.polls += 1
+        if self.polls < self.polls_until_done:
+            return operations_pb2.Operation(name=request.name)
+
+        file_result = speech_v2.BatchRecognizeFileResult()
+        if self.error:
+            file_result.error.code = 3
+            file_result.error.message = self.error
+        else:
+            file_result.transcript = speech_v2.BatchRecognizeResults(
+                results=[
+                    speech_v2.SpeechRecognitionResult(
+                        alternatives=[speech_v2.SpeechRecognitionAlternative(transcript="add the buffer")],
+                        result_end_offset={"seconds": 95},
+                    ),
+                    speech_v2.SpeechRecognitionResult(
+                        alternatives=[speech_v2.SpeechRecognitionAlternative(transcript="spin it down")],
+                        result_end_offset={"seconds": 3620},
+                    ),
+                ]
+            )
+        response = any_pb2.Any()
+        batch_response = speech_v2.BatchRecognizeResponse(results={AUDIO_URI: file_result})
+        response.Pack(speech_v2.BatchRecognizeResponse.pb(batch_response))
+        return operations_pb2.Operation(name=request.name, done=True, response=response)
+
+
+@pytest.fixture
+def fake_speech():
+    def serve(service):
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        server.add_generic_rpc_handlers(
+            (
+                grpc.method_handlers_generic_handler(
+                    "google.cloud.speech.v2.Speech",
+                    {
+                        "BatchRecognize": grpc.unary_unary_rpc_method_handler(
+                            service.batch_recognize,
+                            request_deserializer=speech_v2.BatchRecognizeRequest.deserialize,
+                            response_serializer=operations_pb2.Operation.SerializeToString,
+                        )
+                    },
+                ),
+                grpc.method_handlers_generic_handler(
+                    "google.longrunning.Operations",
+                    {
+                        "GetOperation": grpc.unary_unary_rpc_method_handler(
+                            service.get_operation,
+                            request_deserializer=operations_pb2.GetOperationRequest.FromString,
+                            response_serializer=operations_pb2.Operation.SerializeToString,
+                        )
+                    },
+                ),
+            )
+        )
+        port = server.add_insecure_port("127.0.0.1:0")
+        server.start()
+        servers.append(server)
+        channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+        client = speech_v2.SpeechClient(transport=SpeechGrpcTransport(channel=channel))
+        return SpeechToText("project", "recognizer", client=client)
+
+    servers = []
+    yield serve
+    for server in servers:
+        server.stop(None)
+
+
+def test_batch_recognize_polls_until_done(fake_speech):
+    service = FakeSpeechService(polls_until_done=3)
+    stt = fake_speech(service)
+
+    results = stt.batch_recognize(AUDIO_URI, dynamic_batching=True, poll_initial=0.01, poll_max=0.02)
+
+    assert service.polls == 3
+    request = service.requests[0]
+    assert request.recognizer == "projects/project/locations/global/recognizers/recognizer"
+    assert request.files[0].uri == AUDIO_URI
+    assert request.processing_strategy == speech_v2.BatchRecognizeRequest.ProcessingStrategy.DYNAMIC_BATCHING
+    assert "inline_response_config" in request.recognition_output_config
+    assert stt.get_transcript_list_and_times(results) == [
+        ("add the buffer", 0.0, 95.0),
+        ("spin it down", 95.0, 3620.0),
+    ]
+
+
+def test_batch_recognize_raises_file_error(fake_speech):
+    stt = fake_speech(FakeSpeechService(polls_until_done=1, error="audio could not be decoded"))
+    with pytest.raises(Exception, match="audio could not be decoded"):
+        stt.batch_recognize(AUDIO_URI, poll_initial=0.01)
+
+
+def test_batch_recognize_times_out(fake_speech):
+    stt = fake_speech(FakeSpeechService(polls_until_done=100))
+    with pytest.raises(Exception, match="did not finish"):
+        stt.batch_recognize(AUDIO_URI, timeout=0.05, poll_initial=0.02, poll_max=0.02)
+
+
+def test_batch_recognize_charges_the_recording_to_the_audio_quota(fake_speech, monkeypatch):
+    from autolab import googlestt
+
+    charged = []
+
+    class Scheduler:
+        def call(self, fn, **cost):
+            charged.append(cost)
+            return fn()
+
+    monkeypatch.setattr(googlestt, "get_scheduler", lambda name: Scheduler())
+    stt = fake_speech(FakeSpeechService(polls_until_done=1))
+    stt.batch_recognize(AUDIO_URI, poll_initial=0.01, duration=3620.0)
+    assert charged == [{"audio_seconds": 3620.0}]
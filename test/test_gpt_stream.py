@@ -0,0 +1,57 @@
+import openai
+
+from autolab.gpt_transcript import TranscriptConversion
+
+
+def chunks(text, size=7):
+    for i in range(0, len(text), size):
+        yield {"choices": [{"delta": {"content": text[i : i + size]}, "finish_reason": None}]}
+    yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+
+
+def test_stream_instructions_yields_steps_before_the_result(monkeypatch):
+    outputs = iter(
+        [
+            '{"Procedure": [{"step": "mix", "start_time": 0, "end_time": 4}, {"step": "spin"}]}',
+            '{"Summary": "Lab", "Procedure": [{"step": "mix", "start_time": 0, "end_time": 4},'
+            ' {"step": "spin", "start_time": 4, "end_time": 9}]}',
+        ]
+    )
+    requests = []
+
+    def create(**request):
+        requests.append(request)
+        return chunks(next(outputs))
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    events = list(TranscriptConversion("gpt-4", "key").streamInstructions(transcript=["mix [0.0-4.0]\n"]))
+
+    assert all(request["stream"] for request in requests)
+    # the first output has no summary, so it was generated again. Its incomplete step was never yielded
+    assert [event["type"] for event in events] == ["step", "retry", "summary", "step", "step", "result"]
+    assert events[3]["step"] == {"step": "mix", "start_time": 0, "end_time": 4}
+    assert events[4]["index"] == 1
+    assert [step["step"] for step in events[-1]["result"]["procedure"]] == ["mix", "spin"]
+
+
+def test_stream_app_sends_each_event_as_it_is_yielded(monkeypatch):
+    import lambda_function
+
+    sent = []
+
+    def stream_procedure(uid, engine=None, timings=False):
+        for event in ({"type": "summary", "summary": uid}, {"type": "result", "result": {}}):
+            sent.append(event["type"])
+            yield lambda_function.sse_event(event)
+
+    monkeypatch.setattr(lambda_function, "stream_procedure", stream_procedure)
+    responses = []
+    body = lambda_function.stream_app(
+        {"QUERY_STRING": "uid=lab1"}, lambda status, headers: responses.append((status, dict(headers)))
+    )
+    assert responses == [
+        ("200 OK", {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    ]
+    # the body is an iterator, the first event is sent before the next one is generated
+    assert next(body).startswith(b"event: summary\n") and sent == ["summary"]
+    assert list(body) == [b'event: result\ndata: {"type": "result", "result": {}}\n\n']
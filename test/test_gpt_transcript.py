@@ -0,0 +1,44 @@
+import json
+
+import openai
+
+from autolab import gpt_transcript, tracing
+from autolab.gpt_transcript import MERGE_PROMPT, TranscriptConversion
+from autolab.similarity import ProcedureIndex
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+
+def test_map_reduce_windows_use_the_model_and_the_merge_uses_the_merge_model(monkeypatch):
+    transcript = "".join(f"step number {i} of the lab [{i * 5}.0-{i * 5 + 4}.0]\n" for i in range(6))
+    requests = []
+
+    def create(**request):
+        requests.append(request)
+        if request["messages"][0]["content"] == MERGE_PROMPT:
+            content = "Lab"
+        else:
+            content = json.dumps({"Summary": "Window", "Procedure": [{"step": "Do", "start_time": 0, "end_time": 4}]})
+        return {"choices": [{"message": {"content": content}, "finish_reason": "stop"}]}
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    monkeypatch.setattr(gpt_transcript, "get_encoding", lambda *args: WordEncoding())
+    index = ProcedureIndex()
+    # a similar recording is in the index, but the windows are generated without its draft
+    index.add(transcript.replace("lab", "run"), {"Summary": "Run", "Procedure": [{"step": "Run", "start_time": 0}]})
+    conversion = TranscriptConversion("gpt-4", "key", index=index, draft_threshold=0.1)
+    with tracing.start_trace("test") as trace:
+        result = conversion.generateInstructions(
+            transcript=transcript, map_reduce=True, window_tokens=20, merge_model="gpt-3.5-turbo"
+        )
+
+    assert result["summary"] == "Lab"
+    windows = [request for request in requests if request["messages"][0]["content"] != MERGE_PROMPT]
+    assert len(windows) == 3 and {request["model"] for request in windows} == {"gpt-4"}
+    assert all(request["messages"][0]["content"] == gpt_transcript.GPT_PROMPT for request in windows)
+    assert [request["model"] for request in requests if request not in windows] == ["gpt-3.5-turbo"]
+    (generate,) = [span for span in trace.spans if span.name == "gpt_generate"]
+    assert generate.attributes["draft"] is False
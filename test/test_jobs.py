@@ -0,0 +1,69 @@
+import time
+
+from autolab.jobs import QUEUED, RUNNING, JobQueue, Worker
+from autolab.manifest import DONE, FAILED, RunManifest
+
+
+def test_submit_deduplicates_and_worker_reports_stages(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    job_id = queue.submit("uid", engine="google")
+    assert queue.submit("uid", engine="google") == job_id
+    assert queue.submit("uid", engine="vosk") != job_id
+    assert queue.get(job_id)["status"] == QUEUED
+
+    def handler(job, progress):
+        # the pipeline reports its checkpoints through the manifest listener
+        manifest = RunManifest(str(tmp_path / f"{job['id']}.manifest.jsonl"), "run", listener=progress)
+        manifest.set_stage("convert", DONE, segments=2)
+        manifest.set_segment(0, DONE, start=0.0, duration=60.0, transcript=[("add buffer", 1.0, 2.0)])
+        assert queue.get(job["id"])["stages"]["transcribe"]["segments_done"] == 1
+        manifest.set_segment(1, DONE, start=60.0, duration=60.0, transcript=[("vortex", 61.0, 62.0)])
+        manifest.set_stage("transcribe", DONE)
+        assert queue.get(job["id"])["status"] == RUNNING
+        return {"summary": "s", "procedure": []}
+
+    worker = Worker(queue, handler, worker_id="worker-1")
+    assert worker.run(drain=True) == 2
+
+    job = queue.get(job_id)
+    assert job["status"] == DONE
+    assert job["result"] == {"summary": "s", "procedure": []}
+    assert job["stages"]["convert"]["segments"] == 2
+    assert job["stages"]["transcribe"]["status"] == DONE
+    assert job["stages"]["transcribe"]["transcript"] == [["add buffer", 1.0, 2.0], ["vortex", 61.0, 62.0]]
+    # done jobs are not processed again
+    assert queue.submit("uid", engine="google") == job_id
+    assert queue.claim("worker-1") is None
+
+
+def test_failed_jobs_are_retried_then_failed(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=2)
+    job_id = queue.submit("uid")
+    calls = []
+
+    def handler(job, progress):
+        calls.append(job["attempts"])
+        raise Exception("Error: STT quota exceeded")
+
+    assert Worker(queue, handler).run(drain=True) == 2
+    assert calls == [1, 2]
+    job = queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["error"] == "Error: STT quota exceeded"
+
+    # submitting a failed job queues it again
+    assert queue.submit("uid") == job_id
+    assert queue.get(job_id)["status"] == QUEUED
+
+
+def test_expired_lease_is_claimed_by_another_worker(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=0.05)
+    job_id = queue.submit("uid")
+    assert queue.claim("worker-1")["id"] == job_id
+    assert queue.claim("worker-2") is None
+
+    time.sleep(0.1)
+    job = queue.claim("worker-2")
+    assert job["id"] == job_id
+    assert job["worker"] == "worker-2"
+    assert job["attempts"] == 2
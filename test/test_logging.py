@@ -0,0 +1,25 @@
+import logging
+import threading
+
+from autolab.autolab import _logging_enabled, logger
+
+
+def test_enable_logging_only_applies_to_its_run(caplog):
+    caplog.set_level(logging.INFO)
+    barrier = threading.Barrier(2)
+
+    def run(name, enable_logging):
+        with _logging_enabled(enable_logging):
+            barrier.wait()
+            logger.info(f"{name} info")
+            logger.warning(f"{name} warning")
+            barrier.wait()
+
+    threads = [threading.Thread(target=run, args=(name, name == "verbose")) for name in ("verbose", "quiet")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(caplog.messages) == ["quiet warning", "verbose info", "verbose warning"]
+    # the levels of the application are left alone
+    assert logger.level == logging.NOTSET
@@ -0,0 +1,73 @@
+from autolab.autolab import Autolab
+from autolab.cache import LocalDirectoryStore, ResultCache
+from autolab.manifest import DONE, FAILED, RunManifest
+from autolab.stt_engine import SpeechEngine
+
+
+def test_manifest_resumes_same_run(tmp_path):
+    path = str(tmp_path / "uid.manifest.jsonl")
+    manifest = RunManifest(path, "run-a")
+    manifest.set_segment(0, DONE, start=0.0, duration=60.2, transcript=[["mix the buffer", 1.0, 4.0]])
+    manifest.set_segment(1, FAILED, start=60.2, duration=59.8, error="deadline exceeded")
+    manifest.set_stage("transcribe", FAILED, failed_segments=[1])
+
+    resumed = RunManifest(path, "run-a")
+    assert resumed.segment_transcript(0) == [("mix the buffer", 1.0, 4.0)]
+    assert resumed.segment_transcript(1) is None
+    assert resumed.failed_segments() == [1]
+    assert resumed.segments[1]["start"] == 60.2
+    assert resumed.stage_status("transcribe") == FAILED
+    assert resumed.stage_status("instructions") == "pending"
+
+
+def test_manifest_of_other_run_is_discarded(tmp_path):
+    path = str(tmp_path / "uid.manifest.jsonl")
+    RunManifest(path, "run-a").set_stage("convert", DONE)
+
+    manifest = RunManifest(path, "run-b")
+    assert manifest.stage_status("convert") == "pending"
+    assert RunManifest(path, "run-b").stages == {}
+
+
+def test_manifest_ignores_interrupted_update(tmp_path):
+    path = str(tmp_path / "uid.manifest.jsonl")
+    manifest = RunManifest(path, "run-a")
+    manifest.set_segment(0, DONE, transcript=[])
+    with open(path, "a") as fd:
+        fd.write('{"segment": 1, "status": "do')
+
+    resumed = RunManifest(path, "run-a")
+    assert resumed.segment_status(0) == DONE
+    assert resumed.segment_status(1) == "pending"
+
+
+class FakeEngine(SpeechEngine):
+    name = "fake"
+    SUPPORTED_ENCODINGS = frozenset(("flac",))
+
+
+def test_failed_conversion_is_not_checkpointed_as_converted(tmp_path, monkeypatch):
+    from autolab.vid_converter import VideoConverter
+
+    def split_and_convert(self, *args, **kwargs):
+        raise Exception("Error: Invalid data found when processing input")
+
+    monkeypatch.setattr(VideoConverter, "split_and_convert", split_and_convert)
+    cache = ResultCache(LocalDirectoryStore(str(tmp_path / "cache")))
+    autolab = Autolab("project", "recognizer", "gpt-4", cache=cache, engine=FakeEngine())
+    video = tmp_path / "corrupt.mp4"
+    video.write_bytes(b"not a video")
+
+    for _ in range(2):
+        # the rerun converts again instead of resuming an empty conversion
+        try:
+            autolab.generate_procedure_batch("corrupt", str(tmp_path), video_path=str(video))
+            assert False, "the conversion error was swallowed"
+        except Exception as e:
+            assert "Invalid data" in str(e)
+
+    manifest = (tmp_path / "corrupt.manifest.jsonl").read_text()
+    assert '"stage": "convert", "status": "failed"' in manifest
+    assert '"status": "done"' not in manifest
+    keys = autolab._cache_keys(str(video), mode="batch", streaming=False, vad=False)
+    assert cache.get_transcript(keys["transcript"]) is None
@@ -0,0 +1,54 @@
+from autolab.procedure_json import IncrementalProcedureParser, parse_procedure, repair_json_text
+
+
+def test_valid_output_is_not_repaired():
+    text = '{"Summary": "s", "Procedure": [{"step": "a", "start_time": "0.0", "end_time": "1.0"}]}'
+    instr, invalid, repaired = parse_procedure(text)
+
+    assert instr["Procedure"][0]["step"] == "a"
+    assert invalid == []
+    assert not repaired
+
+
+def test_trailing_commas_and_key_casing_are_repaired():
+    text = '```json\n{"summary": "s", "Procedure": [{"Step": "a", "Start_Time": 0, "End_Time": 1},],}\n```'
+    instr, invalid, repaired = parse_procedure(text)
+
+    assert instr == {"Summary": "s", "Procedure": [{"step": "a", "start_time": 0, "end_time": 1}]}
+    assert invalid == []
+    assert repaired
+
+
+def test_truncated_output_keeps_complete_steps():
+    text = (
+        '{"Summary": "s", "Procedure": [{"step": "a, then b", "start_time": 0, "end_time": 1}, '
+        '{"step": "c", "start_ti'
+    )
+    instr, invalid, repaired = parse_procedure(text)
+
+    assert instr["Procedure"] == [{"step": "a, then b", "start_time": 0, "end_time": 1}]
+    assert invalid == []
+    assert repaired
+
+
+def test_invalid_steps_are_reported_for_fragment_repair():
+    text = '{"Summary": "s", "Procedure": [{"step": "a"}, {"step": "b", "start_time": 1, "end_time": 2}]}'
+    instr, invalid, _ = parse_procedure(text)
+
+    assert invalid == [0]
+
+
+def test_unrecoverable_output():
+    assert parse_procedure("I cannot do that.")[0] is None
+    assert repair_json_text('{"a": [1, 2') == ('{"a": [1, 2]}', True)
+
+
+def test_incremental_parser_returns_steps_once_closed():
+    parser = IncrementalProcedureParser()
+    assert parser.feed('```json\n{"summary": "Mini ') == []
+    assert parser.feed('prep", "Procedure": [{"Step": "add {buffer}", "start_time": 0,') == [("summary", "Mini prep")]
+    first = {"step": "add {buffer}", "start_time": 0, "end_time": 5}
+    assert parser.feed(' "end_time": 5}, {"step": "spin') == [("step", first)]
+    second = {"step": "spin", "start_time": 5, "end_time": 9}
+    assert parser.feed('", "start_time": 5, "end_time": 9}]}\n```') == [("step", second)]
+    assert parse_procedure(parser.text[8:-4])[0]["Procedure"] == parser.steps
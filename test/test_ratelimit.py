@@ -0,0 +1,134 @@
+import threading
+import time
+
+import openai
+import pytest
+
+from autolab import ratelimit
+from autolab.autolab import Autolab
+from autolab.ratelimit import BATCH, INTERACTIVE, Scheduler, TokenBucket
+from autolab.stt_engine import SpeechEngine
+
+
+def test_token_bucket_spreads_the_quota_and_admits_large_costs_in_debt():
+    now = [0.0]
+    bucket = TokenBucket(600, capacity=100, clock=lambda: now[0])
+    assert bucket.wait_time(100) == 0
+    bucket.take(100)
+    assert bucket.wait_time(10) == pytest.approx(1.0)
+    now[0] += 1.0
+    assert bucket.wait_time(10) == 0
+
+    # a cost above the capacity waits for a full bucket, then leaves it in debt
+    now[0] += 10.0
+    assert bucket.wait_time(250) == 0
+    bucket.take(250)
+    assert bucket.wait_time(1) == pytest.approx(15.1)
+
+
+def test_rate_limit_errors_are_retried_after_the_requested_delay():
+    scheduler = Scheduler("openai", max_retries=2)
+    calls = []
+
+    def send():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise openai.error.RateLimitError("Rate limit reached", headers={"retry-after-ms": "50"})
+        return "response"
+
+    assert scheduler.call(send) == "response"
+    assert scheduler.retries == 2
+    assert calls[1] - calls[0] >= 0.05
+
+    def invalid():
+        raise openai.error.InvalidRequestError("Bad request", None)
+
+    # other errors are not retried
+    with pytest.raises(openai.error.InvalidRequestError):
+        scheduler.call(invalid)
+    assert scheduler.retries == 2
+
+
+def test_interactive_calls_are_admitted_before_waiting_batch_calls():
+    scheduler = Scheduler("speech", requests_per_minute=600, headroom=1.0)
+    scheduler.buckets["requests"] = TokenBucket(600, capacity=1)
+    scheduler.acquire()
+    order = []
+
+    def call(level):
+        with ratelimit.priority(level):
+            scheduler.call(lambda: order.append(level))
+
+    batch = threading.Thread(target=call, args=(BATCH,))
+    batch.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=call, args=(INTERACTIVE,))
+    interactive.start()
+    batch.join()
+    interactive.join()
+    assert order == [INTERACTIVE, BATCH]
+
+
+class FakeEngine(SpeechEngine):
+    name = "fake"
+    SUPPORTED_ENCODINGS = frozenset(("flac",))
+
+
+def test_segments_are_charged_their_duration_to_the_speech_quota(monkeypatch):
+    from google.cloud import speech_v2
+
+    from autolab import googlestt
+    from autolab.googlestt import SpeechToText
+    from autolab.vid_converter import AudioSegment
+
+    charged = []
+
+    class Scheduler:
+        def call(self, fn, **cost):
+            charged.append(cost["audio_seconds"])
+            return fn()
+
+    class Client:
+        def recognize(self, request):
+            return speech_v2.RecognizeResponse()
+
+    monkeypatch.setattr(googlestt, "get_scheduler", lambda name: Scheduler())
+    autolab = Autolab("project", "recognizer", "gpt-4", engine=SpeechToText("project", "recognizer", Client()))
+    # opus segments, whose duration cannot be read from their header
+    segments = [AudioSegment(0, 0.0, 60.0, content=b"OggS..."), AudioSegment(1, 60.0, 12.5, content=b"OggS...")]
+    list(autolab._transcribe_segments(autolab.stt_engine, segments, max_workers=1))
+    assert charged == [60.0, 12.5]
+
+
+def test_single_requests_are_only_probed_for_a_speech_audio_quota(tmp_path, monkeypatch):
+    import autolab.autolab as autolab_module
+    from autolab.vid_converter import ConversionPlan
+
+    class Converter:
+        def __init__(self, video_path):
+            pass
+
+        def generateAudio(self, audio_path, **kwargs):
+            with open(audio_path, "wb") as fd:
+                fd.write(b"fLaC")
+            return ConversionPlan("transcode", {}, "flac")
+
+    class Engine(FakeEngine):
+        def transcribe(self, content, duration=None):
+            durations.append(duration)
+            return []
+
+    durations, probed = [], []
+    monkeypatch.setattr(autolab_module, "VideoConverter", Converter)
+    monkeypatch.setattr(autolab_module, "probe_duration", lambda path: probed.append(path) or 42.0)
+    autolab = Autolab("project", "recognizer", "gpt-4", engine=Engine())
+    try:
+        ratelimit.set_scheduler("speech", ratelimit.Scheduler("speech"))
+        autolab._transcribe_single("lab", str(tmp_path), "lab.mp4")
+        assert probed == [] and durations == [None]
+
+        ratelimit.set_scheduler("speech", ratelimit.Scheduler("speech", audio_seconds_per_minute=600))
+        autolab._transcribe_single("lab", str(tmp_path), "lab.mp4")
+        assert len(probed) == 1 and durations[-1] == 42.0
+    finally:
+        ratelimit.set_scheduler("speech", None)
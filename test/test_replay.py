@@ -0,0 +1,123 @@
+import openai
+import pytest
+from google.cloud import speech_v2
+
+from autolab import replay
+from autolab.googlestt import SpeechToText
+from autolab.gpt_transcript import TranscriptConversion
+from autolab.replay import RECORD, REPLAY, Cassette, InjectedError, ReplaySpeechClient, ReplaySupabase
+
+
+class FakeSpeechClient:
+    def __init__(self):
+        self.calls = 0
+
+    def recognize(self, request):
+        self.calls += 1
+        return speech_v2.RecognizeResponse(
+            results=[
+                speech_v2.SpeechRecognitionResult(
+                    alternatives=[speech_v2.SpeechRecognitionAlternative(transcript=f"step {self.calls}")],
+                    result_end_offset={"seconds": 5 * self.calls},
+                )
+            ]
+        )
+
+
+class FakeBucket:
+    def download(self, path):
+        return b"video bytes of " + path.encode()
+
+    def create_signed_url(self, path, expires_in):
+        return {"signedURL": f"https://storage.example/{path}?token=abc"}
+
+
+class FakeStorage:
+    def from_(self, bucket_name):
+        return FakeBucket()
+
+
+class FakeSupabase:
+    storage = FakeStorage()
+
+
+def record_speech(path):
+    stt = SpeechToText("project", "recognizer", client=ReplaySpeechClient(Cassette(path, RECORD), FakeSpeechClient()))
+    return [stt.transcribe(b"segment one"), stt.transcribe(b"segment two")]
+
+
+def test_speech_replays_recorded_responses(tmp_path):
+    path = str(tmp_path / "run.json")
+    recorded = record_speech(path)
+
+    # replayed out of order, without a real client
+    stt = SpeechToText("project", "recognizer", client=ReplaySpeechClient(Cassette(path, REPLAY)))
+    assert stt.transcribe(b"segment two") == recorded[1]
+    assert stt.transcribe(b"segment one") == recorded[0]
+
+    strict = SpeechToText("project", "recognizer", client=ReplaySpeechClient(Cassette(path, strict=True)))
+    with pytest.raises(Exception, match="No recording"):
+        strict.transcribe(b"other audio")
+
+
+def test_replay_injects_errors_and_delays(tmp_path):
+    path = str(tmp_path / "run.json")
+    recorded = record_speech(path)
+
+    cassette = Cassette(path, error_calls={"speech": [0]}, extra_delay=0.01)
+    stt = SpeechToText("project", "recognizer", client=ReplaySpeechClient(cassette))
+    with pytest.raises(InjectedError):
+        stt.transcribe(b"segment one")
+    # the retry replays the same recording
+    assert stt.transcribe(b"segment one") == recorded[0]
+
+    def outcomes(seed):
+        cassette = Cassette(path, error_rate={"speech": 0.5}, seed=seed)
+        stt = SpeechToText("project", "recognizer", client=ReplaySpeechClient(cassette))
+        failed = []
+        for content in (b"segment one", b"segment two") * 4:
+            try:
+                stt.transcribe(content)
+                failed.append(False)
+            except InjectedError:
+                failed.append(True)
+        return failed
+
+    # injected errors only depend on the seed
+    assert outcomes(seed=3) == outcomes(seed=3)
+    assert any(outcomes(seed=3)) or any(outcomes(seed=4))
+
+
+def test_chat_completion_goes_through_cassette(tmp_path, monkeypatch):
+    path = str(tmp_path / "run.json")
+    requests = []
+
+    def create(**request):
+        requests.append(request)
+        return {"choices": [{"message": {"role": "assistant", "content": "Summary"}, "finish_reason": "stop"}]}
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    conversion = TranscriptConversion("gpt-3.5-turbo", "secret")
+    try:
+        replay.use_cassette(path, RECORD)
+        recorded = conversion._chat([{"role": "user", "content": "hi"}])
+
+        monkeypatch.setattr(openai.ChatCompletion, "create", None)
+        replay.use_cassette(path, REPLAY)
+        assert conversion._chat([{"role": "user", "content": "hi"}]) == recorded
+    finally:
+        replay.stop_cassette()
+    assert len(requests) == 1
+    assert "secret" not in open(path).read()
+
+
+def test_supabase_download_and_signed_url_replay_from_blobs(tmp_path):
+    path = str(tmp_path / "run.json")
+    recording = ReplaySupabase(Cassette(path, RECORD), FakeSupabase())
+    video = recording.storage.from_("videos").download("lab/1.mp4")
+    recording.storage.from_("videos").create_signed_url("lab/2.mp4", 60)
+
+    replaying = ReplaySupabase(Cassette(path))
+    assert replaying.storage.from_("videos").download("lab/1.mp4") == video
+    signed_url = replaying.storage.from_("videos").create_signed_url("lab/2.mp4", 60)["signedURL"]
+    assert open(signed_url, "rb").read() == b"video bytes of lab/2.mp4"
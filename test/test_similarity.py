@@ -0,0 +1,102 @@
+import json
+import re
+
+import openai
+
+from autolab import gpt_transcript
+from autolab.gpt_transcript import TranscriptConversion
+from autolab.similarity import ProcedureIndex
+
+TITRATION = (
+    "fill the burette with sodium hydroxide [0.0-6.0]\n"
+    "add three drops of phenolphthalein to the flask [9.0-14.0]\n"
+    "open the stopcock and swirl the flask until it turns pink [15.0-31.0]\n"
+    "record the final volume on the burette [33.0-38.0]\n"
+)
+GEL = (
+    "pour the agarose into the casting tray and insert the comb [0.0-12.0]\n"
+    "load five microliters of ladder into the first well [14.0-22.0]\n"
+    "run the gel at one hundred volts for forty minutes [25.0-33.0]\n"
+)
+
+
+class WordEncoding:
+    def encode(self, text):
+        return text.split()
+
+
+def test_index_finds_recordings_of_the_same_protocol(tmp_path):
+    path = str(tmp_path / "procedures.sqlite3")
+    index = ProcedureIndex(path)
+    index.add(TITRATION, {"Summary": "Titration", "Procedure": []})
+    index.add(GEL, {"Summary": "Gel", "Procedure": []})
+
+    # another student, other timestamps and a misrecognized word
+    retimed = TITRATION.replace("[9.0-14.0]", "[12.5-18.0]").replace("swirl", "twirl")
+    match = index.query(retimed)
+    assert match.procedure["Summary"] == "Titration"
+    assert 0.5 <= match.similarity < 1.0
+    assert index.query("centrifuge the samples for ten minutes at four degrees [0.0-5.0]\n") is None
+
+    # signatures are loaded back from the database
+    index.close()
+    reopened = ProcedureIndex(path)
+    assert len(reopened) == 2
+    assert reopened.query(GEL.replace("[0.0-12.0]", "[3.0-15.0]")).similarity == 1.0
+
+
+def test_retime_moves_steps_to_the_aligned_lines():
+    from autolab.similarity import retime
+
+    procedure = {"Summary": "Titration", "Procedure": [{"step": "Swirl", "start_time": 15, "end_time": 35}]}
+    # the second student skipped a line and was slower to swirl
+    other = TITRATION.replace("add three drops of phenolphthalein to the flask [9.0-14.0]\n", "").replace(
+        "[15.0-31.0]", "[20.0-40.0]"
+    ).replace("[33.0-38.0]", "[42.0-47.0]")
+    # 35 is between the end of the swirl line (31 -> 40) and the start of the last one (33 -> 42)
+    assert retime(procedure, TITRATION, other)["Procedure"] == [{"step": "Swirl", "start_time": 20.0, "end_time": 44.0}]
+    assert retime(procedure, TITRATION, GEL) is None
+
+
+def test_conversion_reuses_or_edits_the_procedure_of_a_match(monkeypatch):
+    outputs = iter(
+        [
+            '{"Summary": "Titration", "Procedure": [{"step": "Fill the burette", "start_time": 0, "end_time": 6},'
+            ' {"step": "Add phenolphthalein", "start_time": 9, "end_time": 14}]}',
+            '{"Summary": "Titration", "Procedure": [{"draft": 1, "start_time": 2, "end_time": 8},'
+            ' {"step": "Stir the flask", "start_time": 9, "end_time": 20}]}',
+        ]
+    )
+    requests = []
+
+    def create(**request):
+        requests.append(request)
+        return {"choices": [{"message": {"content": next(outputs)}, "finish_reason": "stop"}]}
+
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    # tiktoken downloads its encoders, one token per word is enough here
+    monkeypatch.setattr(gpt_transcript, "get_encoding", lambda *args: WordEncoding())
+    index = ProcedureIndex()
+    conversion = TranscriptConversion("gpt-4", "key", index=index, draft_threshold=0.3)
+    first = conversion.generateInstructions(transcript=TITRATION)
+    assert len(index) == 1
+
+    # the same words recorded 3 seconds later are returned without calling GPT, at the times of this recording
+    later = re.sub(r"[\d.]+", lambda time: str(float(time.group()) + 3), TITRATION)
+    reused = conversion.generateInstructions(transcript=later)
+    assert len(requests) == 1
+    assert [(step["start_time"], step["end_time"]) for step in first["procedure"]] == [(0, 6), (9, 14)]
+    assert reused["procedure"] == [
+        {"step": "Fill the burette", "start_time": 3.0, "end_time": 9.0},
+        {"step": "Add phenolphthalein", "start_time": 12.0, "end_time": 17.0},
+    ]
+
+    # a similar recording is sent with the stored procedure as a draft, and its references are expanded
+    edited = TITRATION.replace("open the stopcock and swirl", "stir")
+    result = conversion.generateInstructions(transcript=edited)
+    assert len(requests) == 2
+    assert json.dumps([{"draft": 1, "step": "Fill the burette"}, {"draft": 2, "step": "Add phenolphthalein"}]) in (
+        requests[1]["messages"][1]["content"]
+    )
+    assert result["procedure"][0] == {"start_time": 2, "end_time": 8, "step": "Fill the burette"}
+    assert len(index) == 2
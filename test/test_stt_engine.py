@@ -0,0 +1,63 @@
+import pytest
+
+from autolab.autolab import Autolab
+from autolab.cache import LocalDirectoryStore, ResultCache
+from autolab.googlestt import SpeechToText
+from autolab.stt_engine import SpeechEngine, VoskEngine, engine_class, utterances_from_results
+
+
+def test_utterances_from_vosk_results():
+    results = [
+        {
+            "result": [
+                {"word": "add", "start": 0.42, "end": 0.6, "conf": 1.0},
+                {"word": "buffer", "start": 0.6, "end": 1.08, "conf": 0.9},
+            ],
+            "text": "add buffer",
+        },
+        {"text": ""},
+        {"result": [{"word": "vortex", "start": 3.5, "end": 4.01, "conf": 1.0}], "text": "vortex"},
+    ]
+    assert utterances_from_results(results) == [("add buffer", 0.42, 1.08), ("vortex", 3.5, 4.01)]
+
+
+def test_engine_selection():
+    assert engine_class("google") is SpeechToText
+    assert engine_class("vosk") is VoskEngine
+    assert issubclass(SpeechToText, SpeechEngine)
+    assert VoskEngine.SUPPORTED_ENCODINGS == {"linear16"}
+    with pytest.raises(Exception):
+        engine_class("whisper")
+    with pytest.raises(Exception, match="VOSK_MODEL_PATH"):
+        VoskEngine(model_path="/nonexistent/model")
+
+
+class FakeEngine(SpeechEngine):
+    name = "fake"
+    SUPPORTED_ENCODINGS = frozenset(("flac",))
+
+
+def test_generate_procedure_v2_raises_speech_errors(tmp_path, monkeypatch):
+    from autolab import vid_converter
+
+    class FailingEngine(FakeEngine):
+        def transcribe(self, content, duration=None):
+            raise Exception("Error: 503 Service Unavailable")
+
+    def generate_audio(self, path, **kwargs):
+        with open(path, "wb") as fd:
+            fd.write(b"audio")
+        return vid_converter.ConversionPlan(vid_converter.TRANSCODE, {}, "flac", None)
+
+    monkeypatch.setattr(vid_converter.VideoConverter, "generateAudio", generate_audio)
+    cache = ResultCache(LocalDirectoryStore(str(tmp_path / "cache")))
+    autolab = Autolab("project", "recognizer", "gpt-4", cache=cache, engine=FailingEngine())
+    (tmp_path / "video.mp4").write_bytes(b"video")
+
+    try:
+        autolab.generate_procedure_v2("video", str(tmp_path))
+        assert False, "the Speech error was reported as an empty recording"
+    except Exception as e:
+        assert "503" in str(e)
+    keys = autolab._cache_keys(str(tmp_path / "video.mp4"), mode="single")
+    assert cache.get_transcript(keys["transcript"]) is None
@@ -0,0 +1,62 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from autolab import tracing
+
+
+def test_spans_are_summed_by_stage_across_threads():
+    exported = []
+    with tracing.start_trace("run", exporter=exported.append, uid="uid") as trace:
+        with tracing.span("convert", bytes=1000, audio_seconds=120.0):
+            pass
+
+        def chunk(index):
+            with tracing.span("stt_chunk", index=index) as span:
+                span.set(bytes=100, audio_seconds=60.0)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(tracing.propagate(chunk), range(2)))
+
+        # a nested run is a span of the outer trace and is not exported on its own
+        with tracing.start_trace("inner") as inner:
+            with tracing.span("gpt_attempt", prompt_tokens=50, completion_tokens=10):
+                pass
+        assert inner is trace
+
+    assert exported == [trace]
+    timings = trace.timings()
+    assert timings["total_s"] > 0
+    stages = timings["stages"]
+    assert stages["convert"]["bytes"] == 1000
+    assert stages["stt_chunk"]["count"] == 2
+    assert stages["stt_chunk"]["audio_seconds"] == 120.0
+    assert stages["gpt_attempt"]["prompt_tokens"] == 50
+    assert stages["inner"]["count"] == 1
+
+    parents = {span.name: span.parent for span in trace.spans}
+    assert parents["stt_chunk"] is trace.root
+    assert parents["gpt_attempt"].name == "inner"
+    assert tracing.current_trace() is None
+
+
+def test_spans_outside_a_trace_are_not_recorded():
+    with tracing.span("convert") as span:
+        span.set(bytes=1)
+    assert tracing.current_trace() is None
+
+
+def test_emf_exporter_prints_one_record_per_stage(capsys):
+    with tracing.start_trace("generate_procedure", exporter="emf", uid="uid"):
+        with tracing.span("stt_chunk", bytes=100):
+            pass
+        with tracing.span("instructions_cache", cache_hit=True):
+            pass
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [record["Stage"] for record in records] == ["generate_procedure", "stt_chunk", "instructions_cache"]
+    stt = records[1]
+    assert stt["uid"] == "uid"
+    assert stt["Bytes"] == 100
+    metrics = {metric["Name"]: metric["Unit"] for metric in stt["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+    assert metrics == {"Duration": "Milliseconds", "Count": "Count", "Bytes": "Bytes"}
+    assert records[2]["CacheHit"] == 1
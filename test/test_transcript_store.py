@@ -0,0 +1,27 @@
+from autolab.transcript_store import TranscriptStore
+
+
+def test_store_writes_transcript_file_incrementally(tmp_path):
+    path = str(tmp_path / "uid.txt")
+    with TranscriptStore(path) as store:
+        store.append("add 5 ml of buffer", 0.0, 4.5)
+        store.flush()
+        with open(path) as fd:
+            assert fd.read() == "add 5 ml of buffer [0.0-4.5]\n"
+
+        store.extend([("vortex the tube", 4.5, 9.0), ("incubate at 37°C", 61.25, 65.0)])
+        assert len(store) == 3
+        assert list(store) == [
+            ("add 5 ml of buffer", 0.0, 4.5),
+            ("vortex the tube", 4.5, 9.0),
+            ("incubate at 37°C", 61.25, 65.0),
+        ]
+        assert store[2] == ("incubate at 37°C", 61.25, 65.0)
+        assert "".join(store.lines()) == open(path, encoding="utf-8").read()
+
+
+def test_store_keeps_one_segment_per_line(tmp_path):
+    with TranscriptStore(str(tmp_path / "uid.txt")) as store:
+        store.append("first line\nsecond line", 1.0, 2.0)
+        store.append("next", 2.0, 3.0)
+        assert list(store) == [("first line second line", 1.0, 2.0), ("next", 2.0, 3.0)]
@@ -0,0 +1,140 @@
+import numpy as np
+
+from autolab.autolab import Autolab
+from autolab.cache import LocalDirectoryStore, ResultCache
+from autolab.stt_engine import SpeechEngine
+from autolab.vad import detect_speech, extract_chunk, pack_regions
+from autolab.vid_converter import AudioSegment
+
+SAMPLE_RATE = 16000
+
+
+def _recording(layout):
+    """Builds a recording from (seconds, is_speech) parts: noise for silence, a loud tone for speech"""
+    rng = np.random.default_rng(0)
+    parts = []
+    for seconds, is_speech in layout:
+        n = int(seconds * SAMPLE_RATE)
+        part = rng.normal(0, 30, n)
+        if is_speech:
+            part += 8000 * np.sin(2 * np.pi * 220 * np.arange(n) / SAMPLE_RATE)
+        parts.append(part)
+    return np.concatenate(parts).astype(np.int16)
+
+
+def test_detect_speech_finds_regions():
+    samples = _recording([(5, False), (3, True), (10, False), (2, True), (4, False)])
+    regions = detect_speech(samples, SAMPLE_RATE, padding_ms=0)
+
+    assert len(regions) == 2
+    assert abs(regions[0][0] - 5) < 0.1 and abs(regions[0][1] - 8) < 0.1
+    assert abs(regions[1][0] - 18) < 0.1 and abs(regions[1][1] - 20) < 0.1
+
+
+def test_detect_speech_without_speech():
+    assert detect_speech(_recording([(10, False)]), SAMPLE_RATE) == []
+
+
+def test_pack_regions_respects_chunk_limit_and_maps_back():
+    regions = [(5.0, 35.0), (100.0, 140.0)]
+    chunks = pack_regions(regions, max_chunk_seconds=55.0, gap_seconds=0.5)
+
+    assert len(chunks) == 2
+    for region_map in chunks:
+        offset, _, duration = region_map[-1]
+        assert offset + duration <= 55.0
+
+    segment = AudioSegment(index=0, start=5.0, duration=55.0, region_map=tuple(chunks[0]))
+    assert segment.source_time(0.0) == 5.0
+    assert segment.source_time(10.0) == 15.0
+    # 30.5 is where the second region starts inside the chunk
+    assert segment.source_time(31.5) == 101.0
+
+
+def test_extract_chunk_length():
+    samples = _recording([(10, True)])
+    region_map = [(0.0, 1.0, 2.0), (2.5, 5.0, 1.0)]
+    assert len(extract_chunk(samples, SAMPLE_RATE, region_map)) == int(3.5 * SAMPLE_RATE)
+
+
+def test_frame_energy_of_streamed_chunks_matches_the_whole_recording():
+    from autolab.vad import FrameEnergy, frame_energy_db
+
+    samples = _recording([(2, False), (1, True), (2, False)])
+    pcm = samples.tobytes()
+    meter = FrameEnergy(SAMPLE_RATE)
+    # chunks that cut frames and samples in the middle
+    for start in range(0, len(pcm), 12345):
+        meter.update(pcm[start : start + 12345])
+
+    assert np.allclose(meter.energy, frame_energy_db(samples, meter.frame_length), atol=1e-4)
+    assert meter.duration == 5.0
+
+
+def test_detect_speech_threshold_without_a_noise_floor():
+    # speech in most frames: the 10th percentile is speech, the threshold stays below it
+    talking = _recording([(0.5, False), (10, True), (0.5, False)])
+    regions = detect_speech(talking, SAMPLE_RATE, padding_ms=0)
+    assert len(regions) == 1 and regions[0][1] - regions[0][0] > 9.9
+
+    # a single level throughout is silence below the absolute floor, and speech above it
+    assert detect_speech(_recording([(10, True)]), SAMPLE_RATE) == [(0.0, 10.0)]
+    hum = np.random.default_rng(1).normal(0, 3, 10 * SAMPLE_RATE).astype(np.int16)
+    assert detect_speech(hum, SAMPLE_RATE) == []
+
+
+class FakeEngine(SpeechEngine):
+    name = "fake"
+    SUPPORTED_ENCODINGS = frozenset(("flac",))
+
+
+def test_only_recordings_without_speech_skip_instruction_generation(tmp_path):
+    cache = ResultCache(LocalDirectoryStore(str(tmp_path / "cache")))
+    autolab = Autolab("project", "recognizer", "gpt-4", cache=cache, engine=FakeEngine())
+    autolab._generate_instructions = lambda store: {"procedure": list(store.lines())}
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"video")
+
+    # an empty transcript that VAD did not explain is neither cached nor reported as silence
+    keys = autolab._cache_keys(str(video), mode="batch", streaming=False, vad=False)
+    assert autolab._run_cached("video", str(tmp_path), keys, lambda store: True) == {"procedure": []}
+    assert cache.get_transcript(keys["transcript"]) is None
+
+    keys = autolab._cache_keys(str(video), mode="batch", streaming=False, vad=True)
+    for transcribe in (lambda store: False, None):
+        # the second run reads the empty transcript back from the cache
+        result = autolab._run_cached("video", str(tmp_path), keys, transcribe)
+        assert result["summary"] == "No speech was detected in the recording."
+    assert cache.get_transcript(keys["transcript"]) == []
+
+
+def test_vad_segments_are_cut_from_streamed_pcm(tmp_path):
+    import io
+    import wave
+
+    rate = 16000
+    rng = np.random.default_rng(0)
+    tone = 8000 * np.sin(2 * np.pi * 220 * np.arange(2 * rate) / rate)
+    samples = np.concatenate([rng.normal(0, 30, 5 * rate), tone, rng.normal(0, 30, 5 * rate)]).astype(np.int16)
+
+    class Converter:
+        def stream_pcm(self, sample_rate=16000):
+            pcm = samples.tobytes()
+            for start in range(0, len(pcm), 9999):
+                yield pcm[start : start + 9999]
+
+    autolab = Autolab("project", "recognizer", "gpt-4", engine=FakeEngine())
+    (segment,) = autolab._vad_segments(Converter(), str(tmp_path / "run"))
+    assert abs(segment.start - 4.8) < 0.05 and abs(segment.duration - 2.4) < 0.05
+    with wave.open(io.BytesIO(segment.content)) as audio:
+        chunk = np.frombuffer(audio.readframes(audio.getnframes()), dtype=np.int16)
+    start = int(round(segment.start * rate))
+    assert np.array_equal(chunk, samples[start : start + len(chunk)])
+    # the spooled PCM is not left behind
+    assert list((tmp_path / "run").iterdir()) == []
+
+    class Silence(Converter):
+        def stream_pcm(self, sample_rate=16000):
+            yield rng.normal(0, 30, 10 * rate).astype(np.int16).tobytes()
+
+    assert list(autolab._vad_segments(Silence(), str(tmp_path / "run"))) == []
@@ -0,0 +1,137 @@
+import io
+import os
+import wave
+
+import ffmpeg
+import pytest
+
+from autolab.googlestt import SpeechToText
+from autolab.vid_converter import AUDIO_PROFILES, VideoConverter, plan_segments, smallest_profile
+
+
+def test_smallest_profile_accepted_by_recognizer():
+    assert smallest_profile(SpeechToText.SUPPORTED_ENCODINGS).name == "stt-opus-low"
+    assert smallest_profile({"flac", "linear16"}).name == "stt-16k-mono-flac"
+    for profile in AUDIO_PROFILES.values():
+        assert profile.encoding in SpeechToText.SUPPORTED_ENCODINGS
+
+
+def test_smallest_profile_without_match():
+    with pytest.raises(Exception):
+        smallest_profile({"aac"})
+
+
+def test_plan_segments_covers_the_input_without_gaps():
+    assert plan_segments(150.5) == [(0, 60), (60, 60), (120, None)]
+    assert plan_segments(120.0) == [(0, 60), (60, None)]
+    assert plan_segments(12.0) == [(0, None)]
+    # float noise in the probed duration does not add an empty segment
+    assert plan_segments(120.0000001) == [(0, 60), (60, None)]
+
+
+def test_plan_conversion_copies_audio_that_needs_no_transcoding():
+    from autolab.vid_converter import COPY, REMUX, TRANSCODE, plan_conversion
+
+    def info(format_name, **audio):
+        streams = [{"codec_type": "video"}, {"codec_type": "audio", **audio}]
+        return {"format": {"format_name": format_name}, "streams": streams}
+
+    aac = info("mov,mp4,m4a,3gp,3g2,mj2", codec_name="aac", sample_rate="44100", channels=2)
+    plan = plan_conversion(aac, profile="stt-16k-mono-flac")
+    assert (plan.path, plan.reason) == (TRANSCODE, "codec aac instead of flac")
+    assert plan.output_args["map"] == "0:a:0"
+
+    flac_mp4 = info("mov,mp4,m4a,3gp,3g2,mj2", codec_name="flac", sample_rate="16000", channels=1)
+    plan = plan_conversion(flac_mp4, profile="stt-16k-mono-flac")
+    assert plan.path == REMUX
+    assert plan.output_args == {"vn": None, "map": "0:a:0", "acodec": "copy"}
+    flac = info("flac", codec_name="flac", sample_rate="16000", channels=1)
+    assert plan_conversion(flac, profile="stt-16k-mono-flac").path == COPY
+    assert plan_conversion(flac_mp4, codec="flac").path == REMUX
+
+    stereo = info("mov,mp4,m4a,3gp,3g2,mj2", codec_name="flac", sample_rate="16000", channels=2)
+    assert plan_conversion(stereo, profile="stt-16k-mono-flac").reason == "channels 2 instead of 1"
+    opus = info("ogg", codec_name="opus", sample_rate="16000", channels=1, bit_rate="64000")
+    assert plan_conversion(opus, profile="stt-opus-low").reason == "bit rate 64000 instead of 24000"
+    assert plan_conversion({"streams": []}).reason == "no audio stream"
+
+
+def test_parallel_segments_are_transcoded_to_be_cut_on_samples(tmp_path, monkeypatch):
+    from autolab import vid_converter
+    from autolab.vid_converter import TRANSCODE, VideoConverter
+
+    # audio that could be stream copied, see test_plan_conversion_copies_audio_that_needs_no_transcoding
+    info = {"format": {"format_name": "flac"}, "streams": [{"codec_type": "audio", "codec_name": "flac"}]}
+    monkeypatch.setattr(vid_converter, "probe", lambda path: info)
+    monkeypatch.setattr(vid_converter, "probe_duration", lambda path: 90.0)
+    video = tmp_path / "lab.mp4"
+    video.write_bytes(b"video")
+
+    outputs = []
+
+    class Input:
+        def __init__(self, **input_args):
+            self.input_args = input_args
+
+        def output(self, path, **output_args):
+            outputs.append((self.input_args, output_args))
+            return self
+
+        def run(self, quiet=True):
+            pass
+
+    converter = VideoConverter(str(video))
+    monkeypatch.setattr(converter, "_input", lambda **input_args: Input(**input_args))
+    converter.split_and_convert(str(tmp_path), codec="flac", max_workers=2)
+
+    assert converter.conversion.path == TRANSCODE
+    assert sorted(input_args["ss"] for input_args, _ in outputs) == [0, 60]
+    assert all(output_args["acodec"] == "flac" for _, output_args in outputs)
+
+
+def test_piped_pcm_does_not_block_on_ffmpeg_messages(tmp_path, fake_ffmpeg):
+    video = tmp_path / "lab.mp4"
+    video.write_bytes(b"")
+    # more messages than a pipe buffer holds, written before any audio
+    script = "import sys; sys.stderr.write('w' * (1 << 20)); sys.stdout.buffer.write(bytes(48000)); sys.exit({})"
+    fake_ffmpeg(script.format(0))
+    assert b"".join(VideoConverter(str(video)).stream_pcm(chunk_seconds=1)) == bytes(48000)
+
+    fake_ffmpeg(script.format(1))
+    with pytest.raises(ffmpeg.Error) as error:
+        list(VideoConverter(str(video)).stream_pcm(chunk_seconds=1))
+    assert len(error.value.stderr) == 1 << 20
+
+
+def test_list_segments_orders_by_segment_number(tmp_path):
+    video = tmp_path / "lab.mp4"
+    video.write_bytes(b"")
+    for name in ("lab_010.flac", "lab_002.flac", "lab_000.flac", "lab_001.ogg", "other_003.flac", "lab.flac"):
+        (tmp_path / name).write_bytes(b"")
+
+    segments = VideoConverter(str(video)).list_segments(str(tmp_path))
+    assert segments == [str(tmp_path / name) for name in ("lab_000.flac", "lab_002.flac", "lab_010.flac")]
+
+
+def test_stream_segments_cuts_the_pipe_into_wav_segments(tmp_path, fake_ffmpeg):
+    video = tmp_path / "lab.mp4"
+    video.write_bytes(b"")
+    # 150.5 seconds of 16-bit mono PCM at 100 Hz, read by the converter in uneven pipe writes
+    fake_ffmpeg(
+        "import sys\n"
+        "pcm = bytes(30100)\n"
+        "for start in range(0, len(pcm), 7001):\n"
+        "    sys.stdout.buffer.write(pcm[start : start + 7001])\n"
+    )
+
+    segments = list(VideoConverter(str(video)).stream_segments(segment_seconds=60, sample_rate=100))
+    assert [(segment.index, segment.start, segment.duration) for segment in segments] == [
+        (0, 0.0, 60.0),
+        (1, 60.0, 60.0),
+        (2, 120.0, 30.5),
+    ]
+    for segment in segments:
+        assert segment.path is None
+        with wave.open(io.BytesIO(segment.read())) as wav:
+            assert wav.getframerate() == 100 and wav.getnframes() == segment.duration * 100
+    assert os.listdir(tmp_path) == ["lab.mp4"]